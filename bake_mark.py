@@ -3,119 +3,102 @@ import json
 import math
 import time
 import os
+import sys
+import zipfile
 from pathlib import Path
 import io
 
 # Progress bar
 from tqdm import tqdm
 
-# Hashing stuff
-from friendly_hash import hash, hash_exists
-
 # Markdown parsing stuff
 import marko
 from marko.ext.gfm import GFMRendererMixin
 from marko.ext.gfm import elements
 import marko.renderer
+from marko.ast_renderer import ASTRenderer
 from markdown_tools import extract_front_matter
 
-# Code highlighting stuff
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name, guess_lexer
-from pygments.formatters import html
-from pygments.formatter import Formatter
-from pygments.formatters.img import ImageFormatter
-from pygments.formatters.html import HtmlFormatter
-from pygments.util import ClassNotFound
-from pygments.style import Style
-from pygments import token
-#from pygments.token import Token, Comment, Keyword, Name, String, \
-#    Error, Generic, Number, Operator, Whitespace
-from pygments.token import (
-    Keyword,
-    Name,
-    Comment,
-    String,
-    Error,
-    Number,
-    Operator,
-    Generic,
-    Literal,
-)
-from pygments.styles.sas import SasStyle
-from pygments.styles import get_style_by_name
-
 # Powerpoint stuff
-from pptx import Presentation
 from pptx.util import Inches
-from pptx.dml.color import RGBColor
-from pptx.enum.dml import MSO_THEME_COLOR
-from pptx.enum.text import MSO_AUTO_SIZE
-from pptx.util import Pt
-
-from pptx.opc.package import PartFactory
-from pptx.parts.media import MediaPart
-
-for aud_type in [ 'audio/mp3', 'audio/mp4', 'audio/mid', 
-                    'audio/x-wav', 'audio/mpeg' ]:
-    PartFactory.part_type_for.update({aud_type: MediaPart})
 
 # XML Handling stuff
 from lxml import etree
 
 # Amazon Polly stuff
 import polly
+import usage
 
-# MP3 Handling stuff
-from mutagen.mp3 import MP3
+# Timing each stage of the bake
+import timings
 
 # Monkey Patches
 import python_pptx_patches
 
-# Windows communication client
-import win32com.client
+# Caching of the template, images, slides and whole builds
+import template_cache
+import image_cache
+import slide_cache
+import build_cache
+from content_cache import format_size
 
 # Subtitling
 from make_subtitles import make_captions
 
-# FFMPEG conversion
-import ffmpeg
-
 # Local important data
-from locations import POWERPOINT_TEMPLATE
+from locations import POWERPOINT_TEMPLATE, H264_PRESETS, DEFAULT_H264_PRESET, MAX_H264_CRF, VIDEO_ENGINES
+
+# Batch baking of whole course trees
+import batch_bake
 
 # Actual code!
 
 def replace_with_image(img, shape, slide, max_size=False, presentation=None):
-    pic = slide.shapes.add_picture(img, shape.left, shape.top)
+    """
+    Puts the image where the placeholder shape was, shrunk to the size it is shown at.
+    Returns the image's original size and its size as embedded, in bytes.
+    """
+    with timings.stage("insert image") as details:
+        details["original_bytes"], details["embedded_bytes"] = _replace_with_image(img, shape, slide, max_size,
+                                                                                   presentation)
+    return details["original_bytes"], details["embedded_bytes"]
+
+
+def _replace_with_image(img, shape, slide, max_size, presentation):
+    blob = image_cache.read_image(img)
+    # The size add_picture would have given it, which everything below scales from
+    native_width, native_height = image_cache.native_size(blob)
 
     # calculate max width/height for target size
-    ratio = min(shape.width / float(pic.width), shape.height / float(pic.height))
+    ratio = min(shape.width / float(native_width), shape.height / float(native_height))
 
     if max_size:
         start_of_content_area = slide.shapes.title.top + slide.shapes.title.height
         height_of_content_area = presentation.slide_height - start_of_content_area
         height_of_content_area -= Inches(.5)
-        pic.width = int(height_of_content_area * pic.width / pic.height)
-        pic.height = int(height_of_content_area)
-        pic.top = start_of_content_area
-        pic.left = shape.left
+        width = int(height_of_content_area * native_width / native_height)
+        height = int(height_of_content_area)
+        top = start_of_content_area
+        left = shape.left
     else:
-        pic.height = int(pic.height * ratio)
-        pic.width = int(pic.width * ratio)
-        pic.top = shape.top + ((shape.height - pic.height) // 2)
-        pic.left = shape.left + ((shape.width - pic.width) // 2)
+        height = int(native_height * ratio)
+        width = int(native_width * ratio)
+        top = shape.top + ((shape.height - height) // 2)
+        left = shape.left + ((shape.width - width) // 2)
+
+    image_path, original_size, embedded_size = image_cache.fit(blob, width, height)
+    if image_path is None and isinstance(img, (str, os.PathLike)):
+        image_path = os.fspath(img)
+    # Given as a file, the deck only keeps its path, and reads the image from there when it is saved
+    with (open(image_path, "rb") if image_path else io.BytesIO(blob)) as image:
+        picture = slide.shapes.add_picture(image, left, top, width, height)
+    if isinstance(img, (str, os.PathLike)):
+        # Keep the source's name as the picture's description, as adding it by path would have
+        picture._element._nvXxPr.cNvPr.set("descr", os.path.basename(img))
 
     placeholder = shape.element
     placeholder.getparent().remove(placeholder)
-    return
-
-
-def no_bullet(paragraph):
-    paragraph._pPr.insert(
-        0,
-        etree.Element("{http://schemas.openxmlformats.org/drawingml/2006/main}buNone"),
-    )
+    return original_size, embedded_size
 
 
 def _parse_extras(line):
@@ -126,73 +109,12 @@ def _parse_extras(line):
             for k, v in [part.split("=")]}
 
 
-class CodeStyle(Style):
-    default_style = ''
-    styles = {
-        token.Whitespace:            '#bbbbbb',
-        token.Comment:               '#008800',
-        token.String:                '#800080',
-        token.Number:                '#2c8553',
-        token.Other:                 'bg:#ffffe0',
-        token.Keyword:               '#2c2cff',
-        token.Keyword.Reserved:      '#353580',
-        token.Keyword.Constant:      '',
-        token.Name.Builtin:          '#2c2cff',
-        token.Name.Variable:         '#2c2cff',
-        token.Generic:               '#2c2cff',
-        token.Generic.Emph:          '#008800',
-        token.Generic.Error:         '#d30202',
-        token.Error:                 'bg:#e3d2d2 #a61717'
-    }
-
-def format_run(ttype, run):
-    run.font.color.rgb = RGBColor(0x00, 0x00, 0x00)
-    color, bold, italic, underline, _, border, roman, sans, mono = SasStyle._styles[ttype]
-    
-    if color:
-        if len(color) == 3:
-            color = color[0]*2, color[1]*2, color[2]*2
-        else:
-            color = color[:2], color[2:4], color[4:]
-        color = [int(c, 16) for c in color]
-        run.font.color.rgb = RGBColor(*color)
-
-class PowerPointCodeFormatter(Formatter):
-    MAX_REASONABLE_LINE = 14
-    def __init__(self, text_frame, code, **options):
-        self.options = options
-        self.text_frame = text_frame
-        self.code = code
-        self.line_count = code.count('\n')
-        # 9 fits comfortably
-
-    def fix_height(self):
-        paragraph = self.text_frame.paragraphs[0]
-        #if self.line_count > 9:
-        #    spacing = (self.MAX_REASONABLE_LINE-(self.line_count-9))/self.MAX_REASONABLE_LINE/2
-        #    paragraph.line_spacing = spacing
-        paragraph.line_spacing = .5
-
-    def format(self, tokensource, outfile):
-        if self.text_frame:
-            self.text_frame.clear()
-            paragraph = self.text_frame.paragraphs[0]
-            no_bullet(paragraph)
-            paragraph.font.name = "Courier New"
-            for ttype, value in tokensource:
-                run = paragraph.add_run()
-                run.text = value
-                format_run(ttype, run)
-            self.fix_height()
-        else:
-            print("Throwing away codeblock!")
-
-
 class PowerPointRenderer(GFMRendererMixin):
     options = {}
     # TODO: Fix these to be instance locals instead of class locals!
     narrate = False
-    voice = polly.DEFAULT_VOICE
+    html = True
+    default_language = None
     GRAPHICS_FOLDER = "./"
     BASE_PRESENTATION = POWERPOINT_TEMPLATE
     SLIDE_LAYOUT_TYPES = {
@@ -212,11 +134,18 @@ class PowerPointRenderer(GFMRendererMixin):
         self._current_text = None
         self._current_slide = None
         self.is_blank_slide = True
-        self.presentation = Presentation(self.BASE_PRESENTATION)
+        python_pptx_patches.register_audio_parts()
+        self.presentation = template_cache.load_template(self.BASE_PRESENTATION)
+        # Look the layouts up once, rather than on every new slide
+        self._layouts = {type: self.presentation.slide_layouts[index]
+                         for type, index in self.SLIDE_LAYOUT_TYPES.items()}
         self._list = []
         self._notes = []
-        self._durations = []
+        # The (slide index, text) of every narrated slide, which only gets voiced once the deck is built
+        self._narrations = []
         self._transcript = []
+        # The (original, embedded) size in bytes of every image put on a slide
+        self._image_sizes = []
         self._seen_summary = False
 
     @property
@@ -236,13 +165,53 @@ class PowerPointRenderer(GFMRendererMixin):
     def finish_previous_slides(self):
         if self._notes:
             notes = "\n".join(n for n in self._notes if n)
-            self.add_narration(self._current_slide, notes)
+            # Only noted for now, so that the same slides can be voiced by every voice
+            self._narrations.append((self.presentation.slides.index(self._current_slide), notes))
             self._transcript.append(notes)
             self._notes = []
 
+    def render_document(self, element: "block.Document") -> str:
+        rendered = []
+        for group in slide_cache.split_slides(element.children, self.is_summary):
+            key = slide_cache.slide_key(group, self.GRAPHICS_FOLDER, self.BASE_PRESENTATION, self.default_language,
+                                        self.html)
+            cached = slide_cache.load(key)
+            if cached is None:
+                with timings.stage("render slide"):
+                    rendered.append(self.render_slides(group, key))
+            else:
+                with timings.stage("restore slide"):
+                    rendered.append(self.restore_slides(cached))
+        return "".join(rendered)
+
+    def render_slides(self, group, key):
+        first_slide = len(self.presentation.slides)
+        first_transcript, first_narration = len(self._transcript), len(self._narrations)
+        first_image = len(self._image_sizes)
+        rendered = "".join(self.render(child) for child in group)
+        self.finish_previous_slides()
+        slides = list(self.presentation.slides)[first_slide:]
+        if slides:
+            narrated = [index - first_slide for index, _ in self._narrations[first_narration:]]
+            slide_cache.save(key, self.presentation, slides, rendered, self._transcript[first_transcript:],
+                             narrated, self._image_sizes[first_image:], self._seen_summary)
+        return rendered
+
+    def restore_slides(self, cached):
+        first_slide = len(self.presentation.slides)
+        slides = slide_cache.restore(cached, self.presentation)
+        self._transcript.extend(cached["transcript"])
+        self._narrations.extend((first_slide + offset, text) for offset, text in zip(cached["narrated"],
+                                                                                     cached["transcript"]))
+        self._image_sizes.extend(cached["image_sizes"])
+        self._seen_summary = cached["seen_summary"]
+        if slides:
+            self._current_slide = slides[-1]
+            self._current_text = None
+        return cached["html"]
+
     def add_slide(self, type="title"):
-        slide_layout_index = self.SLIDE_LAYOUT_TYPES.get(type, 6)
-        slide_layout = self.presentation.slide_layouts[slide_layout_index]
+        slide_layout = self._layouts.get(type, self._layouts["blank"])
         self._current_slide = self.presentation.slides.add_slide(slide_layout)
         if type == "title_content":
             self._current_text = self.current_slide.shapes[1].text_frame
@@ -284,7 +253,7 @@ class PowerPointRenderer(GFMRendererMixin):
 
     def add_audio_overlay(self, slide, audio_file) -> int:
         #print(audio_file)
-        seconds = math.ceil(MP3(audio_file).info.length + 2)
+        seconds = math.ceil(polly.clip_info(audio_file)["duration"] + 2)
         duration = seconds * 1000
         self.add_slide_transition(slide, duration)
         #audio_file = os.path.abspath(audio_file)
@@ -294,10 +263,19 @@ class PowerPointRenderer(GFMRendererMixin):
         self.is_blank_slide = False
         return seconds
 
-    def add_narration(self, slide, text):
-        audio_file = polly.speech(text, self.voice, self.narrate, label=self._input_path)
-        duration = self.add_audio_overlay(slide, audio_file)
-        self._durations.append(duration)
+    def voice_deck(self, voice, copy_deck=True):
+        """
+        Adds the voice's narration, and transitions timed to it, to every narrated slide; on a copy of the deck,
+        unless this is the last voice that needs it. Returns the voiced deck and each narrated slide's duration.
+        """
+        presentation = self.presentation
+        if copy_deck:
+            presentation = template_cache.copy_presentation(self.presentation)
+        durations = []
+        for index, text in self._narrations:
+            audio_file = polly.speech(text, voice, self.narrate, label=self._input_path)
+            durations.append(self.add_audio_overlay(presentation.slides[index], audio_file))
+        return presentation, durations
 
     def render_strong_emphasis(self, element: "inline.StrongEmphasis") -> str:
         return f"{self.render_children(element)}"
@@ -313,32 +291,36 @@ class PowerPointRenderer(GFMRendererMixin):
         #return f"{element.children}"
 
     def render_fenced_code(self, element):
+        # Highlighting pulls in all of Pygments, so it waits until a deck actually has code in it
+        import code_cache
+        from code_lexers import resolve_lexer
+        from code_formatting import CodeStyle, PowerPointCodeFormatter
         code = element.children[0].children
         options = PowerPointRenderer.options.copy()
         # options.update(_parse_extras(getattr(element, "extra", None)))
-        if element.lang:
-            try:
-                lexer = get_lexer_by_name(element.lang, stripall=True)
-            except ClassNotFound:
-                lexer = guess_lexer(code)
-        else:
-            lexer = guess_lexer(code)
+        lexer = resolve_lexer(code, element.lang, self.default_language)
 
         if code.count('\n') < PowerPointCodeFormatter.MAX_REASONABLE_LINE:
-            formatter = PowerPointCodeFormatter(self.current_text, code, **options)
-            result = highlight(code, lexer, formatter)
+            with timings.stage("highlight code", lines=code.count('\n')):
+                formatter = PowerPointCodeFormatter(self.current_text, code, **options)
+                formatter.format(code_cache.tokens(code, lexer), None)
+            result = ""
         else:
-            formatter = ImageFormatter(line_numbers=False, style = CodeStyle,#get_style_by_name('sas'), 
-                font_size=30, image_pad = 0, line_pad = 8, **options)
-            image_information = highlight(code, lexer, formatter)
+            with timings.stage("highlight code", lines=code.count('\n'), as_image=True):
+                image_information = code_cache.image(code, lexer, line_numbers=False, style = CodeStyle,#get_style_by_name('sas'),
+                    font_size=30, image_pad = 0, line_pad = 8, **options)
             with io.BytesIO() as temporary_image:
                 temporary_image.write(image_information)
                 temporary_image.seek(0)
                 placeholder = self.current_slide.placeholders[1]
-                replace_with_image(temporary_image, placeholder, self.current_slide, True, self.presentation)
-            # For no real reason, also generate HTML
-            formatter = HtmlFormatter(**options)
-            result = highlight(code, lexer, formatter)
+                self._image_sizes.append(replace_with_image(temporary_image, placeholder, self.current_slide, True,
+                                                            self.presentation))
+            # The HTML version is only worth making if someone is going to read it
+            if self.html:
+                with timings.stage("highlight code as html", lines=code.count('\n')):
+                    result = code_cache.html(code, lexer, **options)
+            else:
+                result = ""
             
         #self.current_text.auto_size = MSO_AUTO_SIZE.TEXT_TO_FIT_SHAPE
         #self.current_text.fit_text("Courier New")
@@ -417,7 +399,7 @@ class PowerPointRenderer(GFMRendererMixin):
         # for shape in self.current_slide.placeholders:
         #    print('%d %s %s' % (shape.placeholder_format.idx, shape.name, shape.placeholder_format.type), dir(shape))
         placeholder = self.current_slide.placeholders[1]
-        replace_with_image(url, placeholder, self.current_slide)
+        self._image_sizes.append(replace_with_image(url, placeholder, self.current_slide))
         render_func = self.render
         self.render = self.render_plain_text  # type: ignore
         body = self.render_children(element)
@@ -438,6 +420,61 @@ class PowerPointRenderer(GFMRendererMixin):
         return raw
 
 
+class NarrationCollector(PowerPointRenderer):
+    """
+    Walks a parsed document the same way the PowerPointRenderer does, but only records the
+    narration text that each slide would be given, without building any slides.
+    """
+    def __init__(self, **options):
+        self._list = []
+        self._notes = []
+        self._seen_summary = False
+        self.narrations = []
+
+    def render_document(self, element: "block.Document") -> str:
+        # Every slide's narration is needed, including the slides that would come from the slide cache
+        return self.render_children(element)
+
+    def finish_previous_slides(self):
+        if self._notes:
+            self.narrations.append("\n".join(n for n in self._notes if n))
+            self._notes = []
+
+    def render_heading(self, element: "block.Heading") -> str:
+        self.finish_previous_slides()
+        child_content = self.render_children(element)
+        if self.is_summary(element):
+            self._seen_summary = True
+            return child_content
+        if element.level == 1:
+            self.add_transcript(child_content)
+        return child_content
+
+    def render_paragraph(self, element: "block.Paragraph") -> str:
+        children = self.render_children(element)
+        if not self._list and not self._seen_summary:
+            self.add_transcript(children)
+        return children
+
+    def render_list(self, element: "block.List") -> str:
+        if self._seen_summary:
+            return ""
+        self._list.append(element)
+        self.render_children(element)
+        self._list.pop()
+        return ""
+
+    def render_fenced_code(self, element):
+        return ""
+
+    def render_image(self, element: "inline.Image") -> str:
+        return ""
+
+    def finish(self):
+        self.finish_previous_slides()
+        return self.narrations
+
+
 class PPTXRenderExtension:
     elements = [
         elements.Paragraph,
@@ -452,6 +489,24 @@ class PPTXRenderExtension:
     parser_mixins = []
 
 
+def collect_narration(document):
+    # Mirror how marko would mix the renderer into the HTML renderer, minus the parser
+    collector = type("_NarrationRenderer", (NarrationCollector, marko.HTMLRenderer), {})()
+    collector.root_node = document
+    with collector as renderer:
+        renderer.render(document)
+    return collector.finish()
+
+
+def lesson_narration(input_path):
+    """ Returns the narration of every slide in the lesson, without baking it. """
+    with open(input_path, encoding='utf-8') as input_file:
+        _, _, input_content = extract_front_matter(input_file.read())
+    converter = marko.Markdown()
+    converter.use(PPTXRenderExtension)
+    return collect_narration(converter.parse(input_content))
+
+
 # XML Stuff
 
 ETREE_NAMESPACE_MAP = {
@@ -478,12 +533,14 @@ CREATE_VIDEO_STATUSES = {
 
 # https://docs.microsoft.com/en-us/office/vba/api/powerpoint.presentation.createvideo
 ppSaveAsWMV, ppSaveAsMP4 = 37, 39
-def convert_ppt_to_wmv(ppt_src, wmv_target, fps=24, quality=100, resolution=1080):
-    ppt_src, wmv_target = os.path.abspath(ppt_src), os.path.abspath(wmv_target)
+def convert_ppt_with_powerpoint(ppt_src, video_target, fps=24, quality=100, resolution=1080):
+    # Windows communication client, only available where PowerPoint is installed
+    import win32com.client
+    ppt_src, video_target = os.path.abspath(ppt_src), os.path.abspath(video_target)
     ppt = win32com.client.Dispatch('PowerPoint.Application')
     presentation = ppt.Presentations.Open(ppt_src, WithWindow=False)
-    presentation.CreateVideo(wmv_target,-1,4,resolution,fps,quality)
-    start_time_stamp = time.time()
+    # CreateVideo picks WMV or MP4 from the target's extension
+    presentation.CreateVideo(video_target,-1,4,resolution,fps,quality)
     print(f"Status: {CREATE_VIDEO_STATUSES[presentation.CreateVideoStatus]}")
     with tqdm() as pbar:
         while presentation.CreateVideoStatus < 3:
@@ -491,109 +548,279 @@ def convert_ppt_to_wmv(ppt_src, wmv_target, fps=24, quality=100, resolution=1080
             pbar.set_description(f"Status: {CREATE_VIDEO_STATUSES[presentation.CreateVideoStatus]}")
             #pbar.refresh()
             time.sleep(1)
-    end_time_stamp=time.time()
-    print(end_time_stamp-start_time_stamp)
     time.sleep(1)
     ppt.Quit()
 
 
-def convert_wmv_to_mp4(wmv_src, mp4_target):
-    wmv_src, mp4_target = os.path.abspath(wmv_src), os.path.abspath(mp4_target)
-    ffmpeg.input(wmv_src).output(mp4_target).run(overwrite_output=True, quiet=True)
-
-
-HASH_FILE_PATH = "finished_video_hashes.json"
-
-def load_previous_hashes():
-    # Create the hash file if it doesn't exist
-    if not os.path.exists(HASH_FILE_PATH):
-        with open(HASH_FILE_PATH, 'w') as hash_file:
-            json.dump({}, hash_file)
-    # Actually load it
-    with open(HASH_FILE_PATH) as hash_file:
-        return json.load(hash_file)
+def export_video(ppt_src, video_target, engine, preset=DEFAULT_H264_PRESET, crf=None, **options):
+    if engine == 'powerpoint':
+        # PowerPoint has its own encoder settings, so the preset and CRF only apply to ffmpeg
+        convert_ppt_with_powerpoint(ppt_src, video_target, **options)
+    else:
+        # Video export without PowerPoint, through FFMPEG
+        import video_export
+        video_export.convert_ppt_to_video(ppt_src, video_target, preset=preset, crf=crf, **options)
 
-def save_hash(contents):
-    hashes = load_previous_hashes()
-    hashes[hash(contents)] = contents
-    with open(HASH_FILE_PATH, 'w') as hash_file:
-        json.dump(hashes, hash_file, indent=2)
 
 # Main Function
 
+DEFAULT_VIDEO_ENGINE = 'powerpoint' if sys.platform == 'win32' else 'ffmpeg'
+
 WMV_OPTIONS = {
     'low': {'quality': 40, 'resolution': 720},
     'high': {'quality': 100, 'resolution': 1080}
 }
-
-def bake_markdown(input_path, output_path, graphics_path, narrate, voice, wmv, force_rebuild, nosave, transcript, mp4):
-    previous_hashes = load_previous_hashes()
+# MP4s are always made at full resolution, whatever the WMV is made at; their size is down to the preset and CRF
+MP4_OPTIONS = {'quality': 100, 'resolution': 1080}
+
+def h264_crf(value):
+    """ Checks a --crf argument against the range libx264 takes. """
+    crf = int(value)
+    if not 0 <= crf <= MAX_H264_CRF:
+        raise argparse.ArgumentTypeError(f"should be from 0 to {MAX_H264_CRF}, not {crf}")
+    return crf
+
+def default_output_path(input_path, build_folder='../build/'):
+    output_path = Path(input_path).stem
+    if output_path.endswith('_read'):
+        output_path = output_path[:-len('_read')]
+    return os.path.join(build_folder, output_path)
+
+def write_if_changed(path, contents):
+    """
+    Writes the file only if its contents would change, so that unchanged outputs keep their mtime.
+    Strings are written as UTF-8 text, and bytes as they are.
+    """
+    mode, encoding = ('', 'utf-8') if isinstance(contents, str) else ('b', None)
+    try:
+        with open(path, 'r' + mode, encoding=encoding) as existing_file:
+            if existing_file.read() == contents:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    with open(path, 'w' + mode, encoding=encoding) as output_file:
+        output_file.write(contents)
+    return True
+
+def package_contents(source):
+    """ The name, size and CRC of every part in the package, which is enough to tell two packages apart. """
+    with zipfile.ZipFile(source) as package:
+        return {info.filename: (info.file_size, info.CRC) for info in package.infolist()}
+
+def save_presentation(presentation, path):
+    """
+    Saves the presentation unless the saved one already has the same parts in it. Every save stamps the
+    parts with the current time, so the packages are compared part by part instead of byte for byte.
+    The deck is saved next to the old one first, so that neither ever has to be read into memory.
+    """
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    presentation.save(temporary_path)
+    try:
+        unchanged = package_contents(path) == package_contents(temporary_path)
+    except (FileNotFoundError, zipfile.BadZipFile):
+        unchanged = False
+    if unchanged:
+        os.remove(temporary_path)
+        return False
+    os.replace(temporary_path, path)
+    return True
+
+def referenced_images(document, graphics_path):
+    tree = ASTRenderer().render(document)
+    return [os.path.join(graphics_path, destination) for destination in slide_cache.find_images(tree)]
+
+def image_report(image_sizes):
+    original = sum(original_size for original_size, _ in image_sizes)
+    embedded = sum(embedded_size for _, embedded_size in image_sizes)
+    return (f"Images: saved {format_size(original - embedded)} ({format_size(original)} down to "
+            f"{format_size(embedded)}) across {len(image_sizes)} images")
+
+def bake_markdown(input_path, output_path, graphics_path, narrate, voice, wmv, force_rebuild, nosave, transcript, mp4,
+                  html=True, engine=DEFAULT_VIDEO_ENGINE, preset=DEFAULT_H264_PRESET, crf=None, only_changed=False,
+                  events=None, profile=None):
+    """
+    Bakes one lesson, yielding progress messages as it goes. The voice can also be a list of voices, which all
+    share one build of the slides, and each get their own PowerPoint, videos and captions.
+    With `only_changed`, videos are not exported again when the PowerPoint came out the same as the one already
+    there, which is what watch mode wants.
+    Every stage is timed (see `timings`), and appended to the `events` file as JSON lines if one is given;
+    with `profile`, the whole bake also runs under cProfile, and its stats get written to that file.
+    """
+    voices = [voice] if isinstance(voice, str) else list(voice)
+    timings.begin(input_path, events)
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with timings.stage("total"):
+            yield from bake_lesson(input_path, output_path, graphics_path, narrate, voices, wmv, force_rebuild,
+                                   nosave, transcript, mp4, html, engine, preset, crf, only_changed)
+    finally:
+        # Clips used before a failure were still used
+        usage.flush()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile)
+    if profiler is not None:
+        yield f"Wrote profile to {profile} (browse it with: python -m pstats {profile})"
+
+def bake_lesson(input_path, output_path, graphics_path, narrate, voices, wmv, force_rebuild, nosave, transcript, mp4,
+                html, engine, preset, crf, only_changed):
     PowerPointRenderer.GRAPHICS_FOLDER = graphics_path
-    PowerPointRenderer.narrate = narrate
-    PowerPointRenderer.voice = voice
+    PowerPointRenderer.html = html
+    # Narration is synthesized up front, so rendering only ever reads existing clips
+    PowerPointRenderer.narrate = False
     PowerPointRenderer._input_path = input_path
     converter = marko.Markdown()
     converter.use(PPTXRenderExtension)
     with open(input_path, encoding='utf-8') as input_file:
         input_text = input_file.read()
     if output_path is None:
-        output_path = Path(input_path).stem
-        if output_path.endswith('_read'):
-            output_path = output_path[:-len('_read')]
-        output_path = os.path.join('../build/', output_path)
-    regular_metadata, front_matter_metadata, input_content = extract_front_matter(input_text)
-    if not force_rebuild and hash_exists(input_text, previous_hashes):
-        yield "Skipping - hashed output already exists: " + previous_hashes[hash(input_text)]
-    else:
-        rendered = converter.convert(input_content)
+        output_path = default_output_path(input_path)
+    with timings.stage("front matter"):
+        regular_metadata, front_matter_metadata, input_content = extract_front_matter(input_text)
+    PowerPointRenderer.default_language = regular_metadata.get('language')
+    with timings.stage("parse markdown"):
+        document = converter.parse(input_content)
+    narration = collect_narration(document)
+    if narrate:
+        with timings.stage("narration") as details:
+            # Every voice is synthesized at the same time
+            created = polly.prefetch_voices(narration, voices)
+            details["clips"], details["synthesized"] = len(set(narration)) * len(voices), len(created)
+            details["cached"] = details["clips"] - details["synthesized"]
+        yield f"Finished narration, synthesized {len(created)} new clips"
+    # Only now are the clips settled, so a build with new or different clips never matches an old one
+    clips = [path for voice in voices for text in narration
+             for path in [polly.speech_path(text, voice), polly.marks_path(text, voice)]]
+    key = build_cache.build_key(input_text, referenced_images(document, graphics_path), POWERPOINT_TEMPLATE,
+                                ",".join(voices), clips, narrate=narrate, wmv=wmv, mp4=mp4, transcript=transcript,
+                                html=html, engine=engine if wmv != 'none' or mp4 else None,
+                                preset=preset if mp4 else None, crf=crf if mp4 else None)
+    with timings.stage("restore build") as details:
+        restored = None if force_rebuild or nosave else build_cache.restore(key, output_path)
+        details["hit"] = restored is not None
+    if restored is not None:
+        yield "Skipping - cached build already exists: " + ", ".join(restored)
+        return
+    with timings.stage("render"):
+        rendered = converter.render(document)
         rendered += converter.renderer.finish()
-        if nosave:
-            yield "Skipping - nosave parameter was given."
+    if nosave:
+        yield "Skipping - nosave parameter was given."
+        return
+    outputs = []
+    if html:
+        write_if_changed(output_path + ".html", rendered)
+        outputs.append(".html")
+    if converter.renderer._image_sizes:
+        yield image_report(converter.renderer._image_sizes)
+    for index, voice in enumerate(voices):
+        # The last voice can have the deck itself, instead of a copy
+        outputs += yield from bake_voice(converter.renderer, voice, output_path, wmv, transcript, mp4, engine,
+                                         preset, crf, only_changed, copy_deck=index < len(voices) - 1,
+                                         label=f" ({voice})" if len(voices) > 1 else "")
+    build_cache.store(key, output_path, outputs)
+
+def bake_voice(renderer, voice, output_path, wmv, transcript, mp4, engine, preset, crf, only_changed, copy_deck,
+               label=""):
+    """ Voices the built deck, and saves its PowerPoint, videos and captions; returns the outputs' suffixes. """
+    with timings.stage("voice deck", voice=voice):
+        presentation, durations = renderer.voice_deck(voice, copy_deck)
+    outputs = [f"-{voice}.pptx"]
+    with timings.stage("save pptx") as details:
+        presentation_changed = save_presentation(presentation, output_path + f"-{voice}.pptx")
+        details["changed"] = presentation_changed
+    yield ("Finished powerpoint" if presentation_changed else "Unchanged powerpoint") + label
+    videos_current = only_changed and not presentation_changed
+    if wmv != 'none':
+        if videos_current and os.path.exists(output_path+f"-{voice}.wmv"):
+            yield "Unchanged wmv" + label
         else:
-            with open(output_path + ".html", "w", encoding='utf-8') as output_file:
-                output_file.write(rendered)
-            presentation = converter.renderer.presentation
-            presentation.save(output_path + f"-{voice}.pptx")
-            yield "Finished powerpoint"
-            if wmv != 'none':
-                convert_ppt_to_wmv(output_path+f"-{voice}.pptx", output_path+f"-{voice}.wmv", **WMV_OPTIONS[wmv])
-                save_hash(input_text)
-                yield "Finished wmv"
-            if mp4:
-                convert_wmv_to_mp4(output_path+f"-{voice}.wmv", output_path+f"-{voice}.mp4")
-                yield "Finished mp4"
-            if transcript:
-                with open(f"{output_path}-{voice}.vtt", "w", encoding='utf-8') as output_file:
-                    captions = make_captions(converter.renderer._transcript, converter.renderer._durations)
-                    output_file.write("\n".join(captions))
-                    yield "Finished captions"
-
+            with timings.stage("export wmv", engine=engine):
+                export_video(output_path+f"-{voice}.pptx", output_path+f"-{voice}.wmv", engine, **WMV_OPTIONS[wmv])
+            yield "Finished wmv" + label
+        outputs.append(f"-{voice}.wmv")
+    if mp4:
+        if videos_current and os.path.exists(output_path+f"-{voice}.mp4"):
+            yield "Unchanged mp4" + label
+        else:
+            with timings.stage("export mp4", engine=engine):
+                export_video(output_path+f"-{voice}.pptx", output_path+f"-{voice}.mp4", engine,
+                             preset=preset, crf=crf, **MP4_OPTIONS)
+            yield "Finished mp4" + label
+        outputs.append(f"-{voice}.mp4")
+    if transcript:
+        with timings.stage("captions"):
+            # Speech marks come from the voice cache, so captions can be timed without going online
+            marks = [polly.load_speech_marks(text, voice) for text in renderer._transcript]
+            captions = make_captions(renderer._transcript, durations, marks)
+            captions_changed = write_if_changed(f"{output_path}-{voice}.vtt", "\n".join(captions))
+        outputs.append(f"-{voice}.vtt")
+        yield ("Finished captions" if captions_changed else "Unchanged captions") + label
+    return outputs
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Compile Markdown into PowerPoint Videos"
     )
-    parser.add_argument("input", metavar="i", help="The input Markdown file (.md)")
+    parser.add_argument("input", metavar="i", help="The input Markdown file (.md), or a directory/glob of lessons to bake as a batch.")
     parser.add_argument(
         "--output", metavar="o",
-        help="The base filename for the outputs (e.g., PowerPoint file, WMV file). If not provided, then the path will be generated based on the input filename.",
+        help="The base filename for the outputs (e.g., PowerPoint file, WMV file). If not provided, then the path will be generated based on the input filename. In batch mode, this is the folder the outputs go into instead.",
         default=None
     )
     parser.add_argument("--graphics", metavar="g", help="The location of the folder with images in it.", default="../graphics/")
 
     parser.add_argument('-a', "--narrate", action='store_true', help="Add in automatic narration using Amazon Polly.")
-    parser.add_argument('-v', "--voice", choices=['Amy', 'Bart'], default=polly.DEFAULT_VOICE, help="Choose the voice-over files that will be used.")
+    parser.add_argument('-v', "--voice", choices=['Amy', 'Bart'], nargs="+", default=[polly.DEFAULT_VOICE],
+                        help="Choose the voice-over files that will be used; give several to make a version in each voice from one build of the slides.")
 
     parser.add_argument("-w", "--wmv", choices=['none', 'low', 'high'], default='none', help="Export a WMV file too")
-    parser.add_argument("-m", "--mp4", action="store_true", help="Export an MP4 file too")
-
-    parser.add_argument("-f", "--force", action="store_true", help="Force recreating the built output, even if its current hash is in the built list.")
+    parser.add_argument("-m", "--mp4", action="store_true", help="Export an MP4 file too, encoded directly rather than from the WMV.")
+    parser.add_argument("--preset", choices=H264_PRESETS, default=DEFAULT_H264_PRESET,
+                        help="The H.264 encoder preset for MP4s: faster presets make bigger files.")
+    parser.add_argument("--crf", type=h264_crf, default=None,
+                        help="The H.264 constant rate factor for MP4s (0-51, lower is better), instead of deriving it from the quality.")
+    parser.add_argument("--engine", choices=VIDEO_ENGINES, default=DEFAULT_VIDEO_ENGINE,
+                        help="How to make videos: through PowerPoint (Windows only), or by drawing the slides and joining them with ffmpeg.")
+
+    parser.add_argument("-f", "--force", action="store_true", help="Force recreating the built output, even if a build with the same inputs is already cached.")
     parser.add_argument("-n", "--nosave", action="store_true",
                         help="Do NOT save the rendered presentation at all. Useful for setting up narration, since audio files will still be created.")
     
     parser.add_argument('-t', "--transcript", action="store_true", help="Generate a transcript of the narration.")
+    parser.add_argument("--skip-html", action="store_true", help="Do NOT write the HTML version of the lesson, which also skips highlighting long code blocks as HTML.")
+
+    parser.add_argument("--timings", metavar="FILE", default=None, help="Append how long each stage took to this file, as JSON lines.")
+    parser.add_argument("--profile", metavar="FILE", default=None, help="Run the bake under cProfile, and write its stats to this file (one per deck, named after it, in batch mode).")
+
+    parser.add_argument("--watch", action="store_true", help="Keep running, and bake the lesson again whenever it or its graphics change.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="How many decks to bake at once in batch mode.")
+    parser.add_argument("--pattern", default=batch_bake.DEFAULT_PATTERN, help="Which files to pick up when the input is a directory.")
 
     args = parser.parse_args()
-    for progress in bake_markdown(args.input, args.output, args.graphics, args.narrate, args.voice,
-                                    args.wmv, args.force, args.nosave, args.transcript, args.mp4):
-        print(progress)
+    if args.watch:
+        import watch
+        watch.watch_lesson(args.input, args.output, args.graphics,
+                           dict(narrate=args.narrate, voice=args.voice, wmv=args.wmv, force_rebuild=args.force,
+                                nosave=args.nosave, transcript=args.transcript, mp4=args.mp4,
+                                html=not args.skip_html, engine=args.engine, preset=args.preset, crf=args.crf,
+                                events=args.timings, profile=args.profile))
+    elif batch_bake.is_batch_target(args.input):
+        results = batch_bake.bake_batch(args.input, args.output, args.graphics, args.narrate, args.voice,
+                                        args.wmv, args.force, args.nosave, args.transcript, args.mp4,
+                                        html=not args.skip_html, engine=args.engine, preset=args.preset,
+                                        crf=args.crf, jobs=args.jobs, pattern=args.pattern, events=args.timings,
+                                        profile=args.profile)
+        if not all(result['ok'] for result in results):
+            sys.exit(1)
+    else:
+        for progress in bake_markdown(args.input, args.output, args.graphics, args.narrate, args.voice,
+                                        args.wmv, args.force, args.nosave, args.transcript, args.mp4,
+                                        html=not args.skip_html, engine=args.engine, preset=args.preset,
+                                        crf=args.crf, events=args.timings, profile=args.profile):
+            print(progress)
+        print(timings.summary_table())
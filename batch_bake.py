@@ -0,0 +1,152 @@
+"""
+Bakes a whole folder (or glob) of lessons at once, spreading the decks across a pool of worker processes.
+
+Every deck is planned up front, so that problems like two lessons writing to the same output are caught
+before any work starts. Each worker imports the baking pipeline once and then reuses it for every deck it is given.
+"""
+import glob
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+DEFAULT_PATTERN = "*_read.md"
+
+
+def is_batch_target(target):
+    return os.path.isdir(target) or glob.has_magic(target)
+
+
+def find_lessons(target, pattern=DEFAULT_PATTERN):
+    if os.path.isdir(target):
+        target = os.path.join(target, "**", pattern)
+    return sorted(set(glob.glob(target, recursive=True)))
+
+
+def plan_decks(target, output_folder=None, pattern=DEFAULT_PATTERN):
+    """
+    Figures out every deck that will be baked, as a list of (input path, output path) pairs.
+    If the output folder is not given, each deck uses the same default location as a single bake would.
+    """
+    from bake_mark import default_output_path
+    plan = []
+    claimed = {}
+    for input_path in find_lessons(target, pattern):
+        if output_folder is None:
+            output_path = default_output_path(input_path)
+        else:
+            output_path = default_output_path(input_path, output_folder)
+        if output_path in claimed:
+            raise Exception(f"Both {claimed[output_path]!r} and {input_path!r} would be baked into {output_path!r}")
+        claimed[output_path] = input_path
+        plan.append((input_path, output_path))
+    return plan
+
+
+def _warm_worker():
+    # Pay for the heavy imports once per worker, instead of once per deck
+    import bake_mark
+
+
+def deck_profile_path(profile, output_path):
+    """ Every deck gets a profile of its own, named after the deck: batch.prof becomes batch-lesson.prof. """
+    root, extension = os.path.splitext(profile)
+    return f"{root}-{os.path.basename(output_path)}{extension}"
+
+
+def failed_deck(input_path, output_path, error, messages, seconds, stages):
+    return {"input": input_path, "output": output_path, "ok": False, "messages": messages,
+            "error": f"{type(error).__name__}: {error}", "traceback": traceback.format_exc(),
+            "seconds": seconds, "stages": stages}
+
+
+def bake_deck(input_path, output_path, options):
+    import timings
+    import usage
+    from bake_mark import bake_markdown
+    start_time_stamp = time.time()
+    messages = []
+    if options.get("profile"):
+        options = dict(options, profile=deck_profile_path(options["profile"], output_path))
+    try:
+        for progress in bake_markdown(input_path, output_path, **options):
+            messages.append(progress)
+    except Exception as error:
+        return failed_deck(input_path, output_path, error, messages, time.time() - start_time_stamp,
+                           timings.totals())
+    finally:
+        # Workers never run atexit handlers, so nothing the deck recorded can wait for the process to end
+        usage.flush()
+    return {"input": input_path, "output": output_path, "ok": True, "messages": messages,
+            "error": None, "traceback": None, "seconds": time.time() - start_time_stamp,
+            "stages": timings.totals()}
+
+
+def summarize(results):
+    width = max([len(result["input"]) for result in results] + [len("Deck")])
+    yield f"{'Deck':<{width}}  {'Status':<6}  {'Time':>8}  Result"
+    for result in results:
+        status = "ok" if result["ok"] else "FAILED"
+        outcome = result["error"] if not result["ok"] else (result["messages"][-1] if result["messages"] else "")
+        yield f"{result['input']:<{width}}  {status:<6}  {result['seconds']:>7.1f}s  {outcome}"
+    failures = sum(not result["ok"] for result in results)
+    yield f"Baked {len(results) - failures} of {len(results)} decks, {failures} failed."
+
+
+def bake_batch(target, output_folder, graphics_path, narrate, voice, wmv, force_rebuild, nosave, transcript, mp4,
+               html=True, engine=None, preset=None, crf=None, jobs=None, pattern=DEFAULT_PATTERN, events=None,
+               profile=None):
+    """
+    Bakes every lesson found in the target, printing a summary of how each one went and where the time
+    went across all of them. With `profile`, each deck gets profiled into a file of its own.
+    """
+    plan = plan_decks(target, output_folder, pattern)
+    if not plan:
+        print(f"No lessons matching {pattern!r} found in {target!r}")
+        return []
+    if output_folder is not None:
+        os.makedirs(output_folder, exist_ok=True)
+    options = dict(graphics_path=graphics_path, narrate=narrate, voice=voice, wmv=wmv,
+                   force_rebuild=force_rebuild, nosave=nosave, transcript=transcript, mp4=mp4, html=html, crf=crf,
+                   events=events, profile=profile)
+    # Leave the rest at bake_markdown's defaults unless they were given
+    for name, value in [("engine", engine), ("preset", preset)]:
+        if value is not None:
+            options[name] = value
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(plan)))
+    print(f"Planned {len(plan)} decks across {jobs} workers")
+    results = []
+    with tqdm(total=len(plan), unit="deck") as pbar:
+        def finished(result):
+            results.append(result)
+            if not result["ok"]:
+                pbar.write(f"Failed {result['input']}:\n{result['traceback']}")
+            pbar.set_postfix_str(os.path.basename(result["input"]))
+            pbar.update(n=1)
+        if jobs == 1:
+            for input_path, output_path in plan:
+                finished(bake_deck(input_path, output_path, options))
+        else:
+            start_time_stamp = time.time()
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_warm_worker) as pool:
+                futures = {pool.submit(bake_deck, input_path, output_path, options): (input_path, output_path)
+                           for input_path, output_path in plan}
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        # The worker died under the deck (out of memory, or a crash in lxml or ffmpeg), which
+                        # also breaks the pool for every deck still waiting
+                        input_path, output_path = futures[future]
+                        result = failed_deck(input_path, output_path, error, [], time.time() - start_time_stamp, {})
+                    finished(result)
+    order = {input_path: index for index, (input_path, _) in enumerate(plan)}
+    results.sort(key=lambda result: order[result["input"]])
+    for line in summarize(results):
+        print(line)
+    import timings
+    print("Time spent in each stage, across every deck:")
+    print(timings.summary_table(timings.combine(result["stages"] for result in results)))
+    return results
@@ -0,0 +1,281 @@
+"""
+Bakes synthetic lessons of a chosen size, and reports how long that took and what it produced, so that
+changes that make baking slower (or decks bigger) get caught before the nightly course build.
+
+Everything runs offline and from scratch in a temporary folder: Polly is replaced by a stub that makes
+silent clips and proportional speech marks, some of the narration is already in the voices folder (so both
+the cached and the synthesized paths get used), and video export just writes a placeholder file.
+
+Each run bakes the lesson twice, each time in a fresh interpreter: "cold", with every cache empty, and "warm",
+rebuilding the same lesson with the caches left from the cold bake. Every bake reports its wall time, peak RSS, the
+size of the .pptx, and how many XML elements (and text runs) its slides have.
+
+    python benchmarks/bake.py [--slides 30] [--code-blocks 12] [--images 4] [--runs 3] [--save results.json]
+    python benchmarks/bake.py --compare results.json [--tolerance 0.25]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from lxml import etree
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE = os.path.join(ROOT, "templates", "empty_presentation.pptx")
+SCENARIOS = ["cold", "warm"]
+# The numbers that count as a regression when they grow past the tolerance
+COMPARED_METRICS = ["seconds", "peak_rss_mb", "pptx_bytes", "slide_elements"]
+DEFAULT_TOLERANCE = 0.25
+
+# One silent MPEG-1 Layer III frame: 32kbps, 44.1kHz, mono, and 1152 samples long
+SILENT_FRAME = bytes([0xFF, 0xFB, 0x10, 0xC0]) + bytes(100)
+SECONDS_PER_FRAME = 1152 / 44100
+# How quickly the stub voice speaks
+CHARACTERS_PER_SECOND = 15
+
+WORDS = ("function value list loop variable return string number print index module class object method "
+         "argument result error test data file line program code call name type").split()
+CODE_LINES = ["total = total + {n}", "items.append({n})", "if value > {n}:", "    print(value, {n})",
+              "for index in range({n}):", "result = compute(index, {n})", "name = 'item{n}'", "return {n}"]
+
+
+class StubPolly:
+    """ Answers like boto3's Polly client, with silent clips as long as the text would take to read. """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = 0
+
+    def synthesize_speech(self, Text, OutputFormat, VoiceId, **options):
+        self.calls += 1
+        time.sleep(self.latency)
+        seconds = max(1.0, len(Text) / CHARACTERS_PER_SECOND)
+        if OutputFormat == "json":
+            return {"AudioStream": io.BytesIO(self.speech_marks(Text, seconds).encode("utf-8"))}
+        return {"AudioStream": io.BytesIO(SILENT_FRAME * int(seconds / SECONDS_PER_FRAME))}
+
+    def speech_marks(self, text, seconds):
+        encoded = text.encode("utf-8")
+        marks, offset = [], 0
+        for sentence in text.split(". "):
+            start = encoded.find(sentence.encode("utf-8"), offset)
+            end = start + len(sentence.encode("utf-8"))
+            marks.append({"time": int(start / len(encoded) * seconds * 1000), "type": "sentence",
+                          "start": start, "end": end, "value": sentence})
+            offset = end
+        return "\n".join(json.dumps(mark) for mark in marks)
+
+
+def sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(6, 14))]
+    return " ".join(words).capitalize() + "."
+
+
+def code_block(rng, lines, tagged):
+    code = "\n".join(rng.choice(CODE_LINES).format(n=rng.randint(0, 99)) for _ in range(lines))
+    return f"```{'python' if tagged else ''}\n{code}\n```"
+
+
+def make_image(path, width, height, seed):
+    """ A noisy gradient, which compresses about as badly as a real screenshot or photo. """
+    from PIL import Image
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed % 20)
+    Image.merge("RGB", [gradient, noise, Image.blend(gradient, noise, 0.5)]).save(path)
+
+
+def make_lesson(folder, config):
+    """ Writes a lesson (and its graphics) with the configured number of slides, code blocks and images. """
+    rng = random.Random(config["seed"])
+    graphics = os.path.join(folder, "graphics")
+    os.makedirs(graphics, exist_ok=True)
+    slides = [[f"## Slide {number}", " ".join(sentence(rng) for _ in range(config["narration_sentences"]))]
+              for number in range(1, config["slides"] + 1)]
+    for number in range(config["code_blocks"]):
+        tagged = rng.random() >= config["untagged"]
+        # Long code becomes an image, and a slide only has room for one, so every block gets a slide of its own
+        if number >= len(slides):
+            slides.append([f"## Code {number}", sentence(rng)])
+        slides[number].append(code_block(rng, config["code_lines"], tagged))
+    for number in range(config["images"]):
+        name = f"image{number}.png"
+        make_image(os.path.join(graphics, name), config["image_width"], config["image_height"], number)
+        # Images go on slides of their own, since each one takes over the content placeholder
+        slides.append([f"## Picture {number}", sentence(rng), f"![Picture {number}]({name})"])
+    lesson = ["---", "waltz:", "  title: benchmark", "---", "# Benchmark Lesson", sentence(rng)]
+    lesson += ["\n\n".join(slide) for slide in slides]
+    path = os.path.join(folder, "lessons", "benchmark_read.md")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as lesson_file:
+        lesson_file.write("\n\n".join(lesson) + "\n")
+    return path
+
+
+def slide_xml_counts(pptx_path):
+    elements = runs = 0
+    with zipfile.ZipFile(pptx_path) as package:
+        for name in package.namelist():
+            if name.startswith("ppt/slides/slide") and name.endswith(".xml"):
+                root = etree.fromstring(package.read(name))
+                elements += sum(1 for _ in root.iter())
+                runs += sum(1 for _ in root.iter("{http://schemas.openxmlformats.org/drawingml/2006/main}r"))
+    return elements, runs
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def bake_once(config, force):
+    """ Runs one bake in the current folder, returning its measurements. """
+    import bake_mark
+    import timings
+    output_path = os.path.join("build", "benchmark")
+    start_time_stamp = time.perf_counter()
+    for _ in bake_mark.bake_markdown(os.path.join("lessons", "benchmark_read.md"), output_path, "graphics/",
+                                     narrate=True, voice=config["voice"], wmv="none", force_rebuild=force,
+                                     nosave=False, transcript=True, mp4=config["video"], engine="ffmpeg"):
+        pass
+    seconds = time.perf_counter() - start_time_stamp
+    pptx_path = f"{output_path}-{config['voice']}.pptx"
+    elements, runs = slide_xml_counts(pptx_path)
+    return {"seconds": seconds, "peak_rss_mb": peak_rss_mb(), "pptx_bytes": os.path.getsize(pptx_path),
+            "slide_elements": elements, "text_runs": runs,
+            "stages": {name: round(total["seconds"], 4) for name, total in timings.totals().items()}}
+
+
+def child(folder, config, scenario):
+    """ Bakes the lesson once, inside a fresh interpreter working in the benchmark folder. """
+    os.chdir(folder)
+    sys.path.insert(0, ROOT)
+    import bake_mark
+    import polly
+    stub = StubPolly(config["polly_latency"])
+    polly.make_client = lambda: stub
+    # Stands in for PowerPoint or ffmpeg, which would dwarf everything else being measured
+    bake_mark.export_video = lambda source, target, engine, **options: open(target, "wb").close()
+    if scenario == "cold":
+        # Seed part of the narration, as if earlier lessons had already paid for it
+        narration = bake_mark.lesson_narration(os.path.join("lessons", "benchmark_read.md"))
+        for text in narration[:int(len(narration) * config["seeded"])]:
+            polly.synthesize_clip(stub, text, config["voice"], polly.speech_path(text, config["voice"]))
+        stub.calls = 0
+    result = bake_once(config, force=True)
+    result["polly_calls"] = stub.calls
+    print(json.dumps(result))
+
+
+def run(config):
+    """ Bakes the lesson cold and then warm in a new folder, each time in a fresh interpreter. """
+    folder = tempfile.mkdtemp(prefix="bake-benchmark-")
+    try:
+        os.makedirs(os.path.join(folder, "templates"))
+        os.makedirs(os.path.join(folder, "build"))
+        shutil.copy(TEMPLATE, os.path.join(folder, "templates"))
+        make_lesson(folder, config)
+        results = {}
+        for scenario in SCENARIOS:
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", folder,
+                                     json.dumps(config), scenario], check=True, stdout=subprocess.PIPE, text=True).stdout
+            results[scenario] = json.loads(output.strip().splitlines()[-1])
+        return results
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def summarize(runs):
+    """ Takes the median of every measurement, per scenario. """
+    summary = {}
+    for scenario in SCENARIOS:
+        metrics = [result[scenario] for result in runs]
+        summary[scenario] = {name: statistics.median(metric[name] for metric in metrics)
+                             for name in metrics[0] if name != "stages"}
+        summary[scenario]["stages"] = {name: statistics.median(metric["stages"].get(name, 0) for metric in metrics)
+                                       for name in metrics[0]["stages"]}
+    return summary
+
+
+def print_summary(summary):
+    print(f"{'':<6} {'seconds':>9} {'peak RSS':>10} {'pptx':>10} {'elements':>9} {'runs':>7} {'polly':>6}")
+    for scenario in SCENARIOS:
+        numbers = summary[scenario]
+        print(f"{scenario:<6} {numbers['seconds']:>9.3f} {numbers['peak_rss_mb']:>8.1f}MB "
+              f"{numbers['pptx_bytes'] / 1024:>8.1f}KB {numbers['slide_elements']:>9.0f} {numbers['text_runs']:>7.0f} "
+              f"{numbers['polly_calls']:>6.0f}")
+    for scenario in SCENARIOS:
+        slowest = sorted(summary[scenario]["stages"].items(), key=lambda stage: -stage[1])[:6]
+        print(f"{scenario} stages: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in slowest))
+
+
+def regressions(summary, baseline, tolerance):
+    found = []
+    for scenario in SCENARIOS:
+        for name in COMPARED_METRICS:
+            before, after = baseline[scenario][name], summary[scenario][name]
+            if before and after > before * (1 + tolerance):
+                found.append(f"{scenario} {name}: {before:g} -> {after:g} ({after / before - 1:+.0%})")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark baking synthetic lessons, with Polly and video export stubbed out")
+    parser.add_argument("--slides", type=int, default=30, help="How many slides of narrated text.")
+    parser.add_argument("--code-blocks", type=int, default=12, help="How many code blocks, spread over the slides.")
+    parser.add_argument("--code-lines", type=int, default=8,
+                        help="How long each code block is; 14 lines or more become images.")
+    parser.add_argument("--untagged", type=float, default=0.25,
+                        help="The share of code blocks with no language, which have to be guessed.")
+    parser.add_argument("--images", type=int, default=4, help="How many images, each on a slide of its own.")
+    parser.add_argument("--image-size", default="1600x1000", help="The size of each image, in pixels.")
+    parser.add_argument("--narration-sentences", type=int, default=3, help="How many sentences of narration per slide.")
+    parser.add_argument("--seeded", type=float, default=0.5,
+                        help="The share of narration already in the voices folder before the bake.")
+    parser.add_argument("--polly-latency", type=float, default=0.0, help="Seconds the stub Polly takes per request.")
+    parser.add_argument("--video", action="store_true", help="Also go through (stubbed) MP4 export.")
+    parser.add_argument("--seed", type=int, default=0, help="Seeds the random lesson, so that runs can be compared.")
+    parser.add_argument("--runs", type=int, default=3, help="How many times to bake from scratch.")
+    parser.add_argument("--save", metavar="FILE", help="Write the results here, to compare later runs against.")
+    parser.add_argument("--compare", metavar="FILE", help="Fail if any result is worse than these saved ones.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="How much worse than the saved results counts as a regression (0.25 is 25%%).")
+    parser.add_argument("--child", nargs=3, metavar=("FOLDER", "CONFIG", "SCENARIO"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.child[0], json.loads(args.child[1]), args.child[2])
+        return
+    width, height = map(int, args.image_size.lower().split("x"))
+    config = {"slides": args.slides, "code_blocks": args.code_blocks, "code_lines": args.code_lines,
+              "untagged": args.untagged, "images": args.images, "image_width": width, "image_height": height,
+              "narration_sentences": args.narration_sentences, "seeded": args.seeded,
+              "polly_latency": args.polly_latency, "video": args.video, "seed": args.seed, "voice": "Amy"}
+    runs = [run(config) for _ in range(args.runs)]
+    summary = summarize(runs)
+    summary["config"] = config
+    print_summary(summary)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as results_file:
+            json.dump(summary, results_file, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as results_file:
+            baseline = json.load(results_file)
+        if baseline.get("config") != config:
+            print("The saved results were made with different settings, so they cannot be compared")
+            sys.exit(2)
+        found = regressions(summary, baseline, args.tolerance)
+        for regression in found:
+            print("Regressed: " + regression)
+        sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures how long it takes to start baking, and fails if startup has regressed.
+
+Each run starts a fresh interpreter, so nothing is already imported or cached. Two things are timed:
+importing bake_mark, and running `bake_mark.py --help`. Startup also fails if importing bake_mark pulls in
+any of the heavy dependencies that are supposed to wait for the stage that needs them.
+
+    python benchmarks/startup.py [--runs 5] [--budget 1.0]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# None of these should be imported until a deck actually needs them (Pillow is not here, since python-pptx needs it)
+DEFERRED_MODULES = ["win32com", "boto3", "botocore", "pydub", "spacy", "ffmpeg", "pygments", "video_export"]
+DEFAULT_RUNS = 5
+# Seconds, for the median run of each command
+DEFAULT_BUDGET = 1.0
+
+IMPORT_CHECK = f"""
+import json, sys
+import bake_mark
+print(json.dumps([name for name in {DEFERRED_MODULES!r} if name in sys.modules]))
+"""
+
+
+def time_command(command, runs):
+    timings = []
+    for _ in range(runs):
+        start_time_stamp = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start_time_stamp)
+    return timings
+
+
+def eagerly_imported():
+    output = subprocess.run([sys.executable, "-c", IMPORT_CHECK], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark how long bake_mark takes to start up")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="How many fresh interpreters to time per command.")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET,
+                        help="The most seconds the median run of each command may take.")
+    args = parser.parse_args()
+    commands = {
+        "import bake_mark": [sys.executable, "-c", "import bake_mark"],
+        "bake_mark.py --help": [sys.executable, "bake_mark.py", "--help"],
+    }
+    failed = False
+    for name, command in commands.items():
+        timings = time_command(command, args.runs)
+        median = statistics.median(timings)
+        status = "ok" if median <= args.budget else "OVER BUDGET"
+        failed = failed or median > args.budget
+        print(f"{name:<22} median {median:.3f}s  min {min(timings):.3f}s  max {max(timings):.3f}s  {status}")
+    imported = eagerly_imported()
+    if imported:
+        failed = True
+        print("Imported too early: " + ", ".join(imported))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Remembers finished builds, so that a lesson whose inputs have not changed is not baked again.
+
+A build is keyed on a digest of everything that goes into its outputs: the Markdown, the images it references,
+the PowerPoint template, the voice, the narration clips and speech marks it gets voiced with, and the output
+options. The code of the pipeline itself is part of the key too, so changing how outputs are made stops old builds
+from matching without anyone having to remember to invalidate them. The outputs themselves are kept in the cache,
+so that they can be put back in place if they went missing from the build folder.
+"""
+import json
+import os
+import shutil
+
+import content_cache
+
+NAMESPACE = "builds"
+# The modules that decide what a build turns out like. video_export is one of them, so bumping its
+# SEGMENT_VERSION invalidates builds as well as segments.
+PIPELINE_MODULES = ["bake_mark", "build_cache", "code_cache", "code_formatting", "code_lexers", "image_cache",
+                    "make_subtitles", "markdown_tools", "mp3_frames", "python_pptx_patches", "slide_cache",
+                    "template_cache", "video_export"]
+
+
+def file_or_missing(path):
+    return content_cache.file_digest(path) if os.path.exists(path) else "missing:" + path
+
+
+def pipeline_version():
+    """ A digest of the pipeline's source code, which changes whenever any of it does. """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    return content_cache.digest(*(content_cache.file_digest(os.path.join(folder, name + ".py"))
+                                  for name in PIPELINE_MODULES))
+
+
+def build_key(markdown, image_paths, template, voice, clip_paths=(), **options):
+    """
+    The clip paths are every narration clip and speech marks file the build gets voiced with, so that a
+    clip voiced again makes for a new build.
+    """
+    return content_cache.digest(pipeline_version(), markdown, *map(file_or_missing, image_paths),
+                                content_cache.file_digest(template), voice, *map(file_or_missing, clip_paths),
+                                json.dumps(options, sort_keys=True))
+
+
+def store(key, output_path, suffixes):
+    """ Copies each output (the output path plus one of the suffixes) into the cache under the key. """
+    path = content_cache.entry_path(NAMESPACE, key)
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(temporary_path, exist_ok=True)
+    artifacts = {}
+    for suffix in suffixes:
+        shutil.copyfile(output_path + suffix, os.path.join(temporary_path, "artifact" + suffix))
+        artifacts[suffix] = content_cache.file_digest(output_path + suffix)
+    with open(os.path.join(temporary_path, "manifest.json"), "w", encoding="utf-8") as manifest_file:
+        json.dump({"artifacts": artifacts}, manifest_file)
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rename(temporary_path, path)
+    except OSError:
+        # Another bake stored the same build first
+        shutil.rmtree(temporary_path, ignore_errors=True)
+
+
+def restore(key, output_path):
+    """
+    Makes sure every output of the cached build is in place at the output path, copying any that are
+    missing or different back out of the cache. Returns the output paths, or None if the build is not cached.
+    """
+    path = content_cache.entry_path(NAMESPACE, key)
+    try:
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+    restored = []
+    for suffix, expected in manifest["artifacts"].items():
+        target = output_path + suffix
+        if not os.path.exists(target) or content_cache.file_digest(target) != expected:
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            shutil.copyfile(os.path.join(path, "artifact" + suffix), target)
+        restored.append(target)
+    content_cache.touch(path)
+    return restored
@@ -0,0 +1,304 @@
+"""
+A local HTTP build service, so that authoring tools can share one warm, throttled builder instead of each
+running the whole pipeline themselves:
+
+    python build_service.py [--host 127.0.0.1] [--port 8080] [-j JOBS]
+
+Clients POST a job to /jobs, with the same options as `bake_markdown` (as JSON), and then follow it through
+GET /jobs/<id> or the streaming GET /jobs/<id>/events, which sends one JSON object per line: each progress
+message as `bake_markdown` yields it, and finally the finished job. A job that is identical to one still
+queued or running is not baked twice; the client just gets the existing job back.
+
+Bakes run in a pool of worker processes (the renderer keeps its settings on the class, so two bakes cannot
+share a process at the same time), and the pool's size is what throttles the service.
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+from bottle import Bottle, HTTPError, ServerAdapter, request, response
+
+import batch_bake
+import content_cache
+from locations import H264_PRESETS, MAX_H264_CRF, VIDEO_ENGINES
+
+ACTIVE_STATUSES = {"queued", "running"}
+VOICES = ["Amy", "Bart"]
+WMV_QUALITIES = ["none", "low", "high"]
+# How many queued jobs to accept before turning new ones away
+MAX_QUEUED_JOBS = 100
+# How many finished jobs to remember, for clients that check on them late
+FINISHED_JOBS_KEPT = 200
+# Seconds between blank lines on an idle event stream, so that clients can tell the service is still there
+KEEPALIVE_INTERVAL = 15
+
+JOB_OPTIONS = {
+    # name: (default, type or tuple of types)
+    "output": (None, str),
+    "graphics": ("../graphics/", str),
+    "narrate": (False, bool),
+    # One voice, or a list of them to bake the lesson in each
+    "voice": ("Amy", (str, list)),
+    "wmv": ("none", str),
+    "mp4": (False, bool),
+    "transcript": (False, bool),
+    "force": (False, bool),
+    "nosave": (False, bool),
+    "html": (True, bool),
+    "engine": (None, str),
+    "preset": (None, str),
+    "crf": (None, int),
+}
+
+app = Bottle()
+jobs = {}
+changed = threading.Condition()
+_job_ids = itertools.count(1)
+_pool = None
+_events = None
+
+
+def normalize_request(body):
+    """ Checks a job request and fills in its defaults, returning the options to bake it with. """
+    if not isinstance(body, dict) or not isinstance(body.get("input"), str):
+        raise HTTPError(400, "A job needs an 'input' path to a Markdown file")
+    unknown = set(body) - set(JOB_OPTIONS) - {"input"}
+    if unknown:
+        raise HTTPError(400, "Unknown job options: " + ", ".join(sorted(unknown)))
+    job = {"input": os.path.abspath(body["input"])}
+    for name, (default, kind) in JOB_OPTIONS.items():
+        value = body.get(name, default)
+        # JSON's true and false would pass for numbers, since bool is a kind of int
+        if value is not None and (not isinstance(value, kind) or isinstance(value, bool) and kind is not bool):
+            kinds = kind if isinstance(kind, tuple) else (kind,)
+            raise HTTPError(400, f"Job option {name!r} should be a " + " or ".join(k.__name__ for k in kinds))
+        job[name] = value
+    if not os.path.isfile(job["input"]):
+        raise HTTPError(400, f"No lesson found at {body['input']!r}")
+    # Always a list from here on, so that asking for "Amy" and ["Amy"] is the same job
+    if isinstance(job["voice"], str):
+        job["voice"] = [job["voice"]]
+    if not job["voice"]:
+        raise HTTPError(400, "A job needs at least one voice")
+    for voice in job["voice"]:
+        if not isinstance(voice, str) or voice not in VOICES:
+            raise HTTPError(400, f"Unknown voice {voice!r}")
+    if len(set(job["voice"])) < len(job["voice"]):
+        raise HTTPError(400, "Each voice should only be asked for once")
+    if job["wmv"] not in WMV_QUALITIES:
+        raise HTTPError(400, f"Unknown WMV quality {job['wmv']!r}")
+    if job["engine"] is not None and job["engine"] not in VIDEO_ENGINES:
+        raise HTTPError(400, f"Unknown video engine {job['engine']!r}")
+    if job["preset"] is not None and job["preset"] not in H264_PRESETS:
+        raise HTTPError(400, f"Unknown H.264 preset {job['preset']!r}")
+    if job["crf"] is not None and not 0 <= job["crf"] <= MAX_H264_CRF:
+        raise HTTPError(400, f"The CRF should be from 0 to {MAX_H264_CRF}")
+    for name in ["output", "graphics"]:
+        if job[name] is not None:
+            job[name] = os.path.abspath(job[name])
+    return job
+
+
+def bake_options(job):
+    """ Turns a job's options into bake_markdown's keyword arguments, leaving unset ones at their defaults. """
+    options = dict(graphics_path=job["graphics"], narrate=job["narrate"], voice=job["voice"], wmv=job["wmv"],
+                   force_rebuild=job["force"], nosave=job["nosave"], transcript=job["transcript"], mp4=job["mp4"],
+                   html=job["html"], crf=job["crf"])
+    for name in ["engine", "preset"]:
+        if job[name] is not None:
+            options[name] = job[name]
+    return options
+
+
+def run_job(job_id, job, events):
+    """ Bakes one job in a worker process, sending its progress back through the events queue. """
+    from bake_mark import bake_markdown
+    events.put((job_id, "started", None))
+    try:
+        for progress in bake_markdown(job["input"], job["output"], **bake_options(job)):
+            events.put((job_id, "message", progress))
+    except Exception as error:
+        events.put((job_id, "failed", {"error": f"{type(error).__name__}: {error}",
+                                       "traceback": traceback.format_exc()}))
+        return
+    events.put((job_id, "done", {}))
+
+
+def public_view(job, include_messages=True):
+    view = {name: job[name] for name in ["id", "status", "request", "error", "created", "started", "finished"]}
+    if include_messages:
+        view["messages"] = list(job["messages"])
+    return view
+
+
+def forget_old_jobs():
+    finished = sorted((job for job in jobs.values() if job["status"] not in ACTIVE_STATUSES),
+                      key=lambda job: job["finished"])
+    for job in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+        del jobs[job["id"]]
+
+
+def finish_job(job_id, status, error=None, traceback_text=None):
+    """ Marks a job as finished, unless it already was. Call with the `changed` lock held. """
+    job = jobs.get(job_id)
+    if job is None or job["status"] not in ACTIVE_STATUSES:
+        return
+    job["status"], job["error"], job["traceback"] = status, error, traceback_text
+    job["finished"] = time.time()
+    forget_old_jobs()
+
+
+def collect_events():
+    """ Moves progress from the worker processes onto the jobs, waking up anyone streaming them. """
+    while True:
+        job_id, kind, payload = _events.get()
+        with changed:
+            job = jobs.get(job_id)
+            if job is None:
+                continue
+            if kind == "started":
+                job["status"], job["started"] = "running", time.time()
+            elif kind == "message":
+                job["messages"].append(payload)
+            else:
+                finish_job(job_id, kind, payload.get("error"), payload.get("traceback"))
+            changed.notify_all()
+
+
+def job_submitted(job_id):
+    def on_done(future):
+        # Only matters if the worker died without reporting back, like when its process gets killed
+        error = future.exception()
+        if error is not None:
+            with changed:
+                finish_job(job_id, "failed", f"{type(error).__name__}: {error}")
+                changed.notify_all()
+    return on_done
+
+
+def json_error(error):
+    response.content_type = "application/json"
+    return json.dumps({"error": error.body, "status": error.status_code})
+
+
+app.default_error_handler = json_error
+
+
+def find_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPError(404, f"No job {job_id!r}")
+    return job
+
+
+@app.post("/jobs")
+def submit_job():
+    try:
+        body = request.json
+    except ValueError:
+        raise HTTPError(400, "Jobs are submitted as JSON")
+    job_request = normalize_request(body)
+    key = content_cache.digest(json.dumps(job_request, sort_keys=True))
+    with changed:
+        for job in jobs.values():
+            if job["key"] == key and job["status"] in ACTIVE_STATUSES:
+                response.status = 200
+                return dict(public_view(job, include_messages=False), deduplicated=True)
+        if sum(job["status"] == "queued" for job in jobs.values()) >= MAX_QUEUED_JOBS:
+            raise HTTPError(503, "Too many jobs are waiting already; try again later")
+        job_id = str(next(_job_ids))
+        job = jobs[job_id] = {"id": job_id, "key": key, "status": "queued", "request": job_request, "messages": [],
+                              "error": None, "traceback": None, "created": time.time(), "started": None,
+                              "finished": None}
+    _pool.submit(run_job, job_id, job_request, _events).add_done_callback(job_submitted(job_id))
+    response.status = 202
+    return dict(public_view(job, include_messages=False), deduplicated=False)
+
+
+@app.get("/jobs")
+def list_jobs():
+    with changed:
+        return {"jobs": [public_view(job, include_messages=False) for job in jobs.values()]}
+
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id):
+    with changed:
+        view = public_view(find_job(job_id))
+        view["traceback"] = jobs[job_id]["traceback"]
+        return view
+
+
+@app.get("/jobs/<job_id>/events")
+def job_events(job_id):
+    """ Streams the job's progress messages (starting after `since` of them), then the finished job. """
+    with changed:
+        job = find_job(job_id)
+    seen = int(request.query.get("since") or 0)
+    response.content_type = "application/x-ndjson"
+
+    def stream():
+        nonlocal seen
+        while True:
+            with changed:
+                if len(job["messages"]) <= seen and job["status"] in ACTIVE_STATUSES:
+                    changed.wait(KEEPALIVE_INTERVAL)
+                messages, status = job["messages"][seen:], job["status"]
+                view = public_view(job, include_messages=False)
+            if not messages and status in ACTIVE_STATUSES:
+                yield "\n"
+            for message in messages:
+                yield json.dumps({"message": message}) + "\n"
+            seen += len(messages)
+            if status not in ACTIVE_STATUSES:
+                yield json.dumps(view) + "\n"
+                return
+    return stream()
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingServer(ServerAdapter):
+    """ Serves each request on its own thread, so that streaming one job never holds up the others. """
+    def run(self, handler):
+        handler_class = WSGIRequestHandler if not self.quiet else QuietHandler
+        server = make_server(self.host, self.port, handler, ThreadingWSGIServer, handler_class)
+        server.serve_forever()
+
+
+def serve(host="127.0.0.1", port=8080, workers=None, quiet=False):
+    global _pool, _events
+    manager = multiprocessing.Manager()
+    _events = manager.Queue()
+    _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, initializer=batch_bake._warm_worker)
+    threading.Thread(target=collect_events, daemon=True).start()
+    try:
+        app.run(server=ThreadingServer(host=host, port=port), quiet=quiet)
+    finally:
+        _pool.shutdown(cancel_futures=True)
+        manager.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve bake jobs over HTTP from a shared pool of workers")
+    parser.add_argument("--host", default="127.0.0.1", help="The address to listen on.")
+    parser.add_argument("--port", type=int, default=8080, help="The port to listen on.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="How many lessons to bake at once.")
+    parser.add_argument("--quiet", action="store_true", help="Do not log every request.")
+    args = parser.parse_args()
+    serve(args.host, args.port, args.jobs, args.quiet)
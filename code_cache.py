@@ -0,0 +1,81 @@
+"""
+Caches the expensive parts of highlighting code blocks: the token stream from the lexer, the PNG images
+drawn for long blocks, and the HTML version of each block.
+
+Everything is keyed on the code, the lexer and its options, the style's colors, the formatter options,
+and the Pygments version, so an entry is only reused when it would come out exactly the same.
+"""
+import json
+import os
+
+import pygments
+from pygments.formatters.html import HtmlFormatter
+from pygments.formatters.img import ImageFormatter
+from pygments.token import string_to_tokentype
+
+import content_cache
+
+NAMESPACE = "code"
+
+
+def describe(value):
+    """ Turns formatter options into something stable to hash, including what a style actually looks like. """
+    if isinstance(value, type) and hasattr(value, "styles"):
+        return {"style": value.__name__,
+                "colors": sorted((".".join(ttype), rule) for ttype, rule in value.styles.items())}
+    return value
+
+
+def code_key(kind, code, lexer, options):
+    return content_cache.digest(kind, pygments.__version__, code, type(lexer).__name__,
+                                json.dumps(lexer.options, sort_keys=True, default=str),
+                                json.dumps({name: describe(value) for name, value in options.items()},
+                                           sort_keys=True, default=str))
+
+
+def read(key, filename):
+    path = content_cache.entry_path(NAMESPACE, key)
+    try:
+        with open(os.path.join(path, filename), "rb") as cached_file:
+            contents = cached_file.read()
+    except FileNotFoundError:
+        return None
+    content_cache.touch(path)
+    return contents
+
+
+def write(key, filename, contents):
+    path = content_cache.entry_path(NAMESPACE, key)
+    os.makedirs(path, exist_ok=True)
+    temporary_path = os.path.join(path, f"{filename}.{os.getpid()}.tmp")
+    with open(temporary_path, "wb") as cached_file:
+        cached_file.write(contents)
+    os.replace(temporary_path, os.path.join(path, filename))
+
+
+def tokens(code, lexer):
+    key = code_key("tokens", code, lexer, {})
+    cached = read(key, "tokens.json")
+    if cached is not None:
+        return [(string_to_tokentype(ttype), value) for ttype, value in json.loads(cached)]
+    stream = list(lexer.get_tokens(code))
+    write(key, "tokens.json", json.dumps([(".".join(ttype), value) for ttype, value in stream]).encode("utf-8"))
+    return stream
+
+
+def image(code, lexer, **options):
+    key = code_key("image", code, lexer, options)
+    cached = read(key, "code.png")
+    if cached is None:
+        cached = pygments.format(tokens(code, lexer), ImageFormatter(**options))
+        write(key, "code.png", cached)
+    return cached
+
+
+def html(code, lexer, **options):
+    key = code_key("html", code, lexer, options)
+    cached = read(key, "code.html")
+    if cached is None:
+        cached = pygments.format(tokens(code, lexer), HtmlFormatter(**options)).encode("utf-8")
+        write(key, "code.html", cached)
+    return cached.decode("utf-8")
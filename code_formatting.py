@@ -0,0 +1,113 @@
+"""
+Highlighted code for slides: the style used for code drawn as images, and a Pygments formatter that writes
+short code blocks straight into a slide's text frame as colored runs.
+
+This lives apart from bake_mark so that Pygments is only imported once a deck actually has code in it.
+"""
+from lxml import etree
+from pptx.dml.color import RGBColor
+from pygments import token
+from pygments.formatter import Formatter
+from pygments.style import Style
+from pygments.styles.sas import SasStyle
+
+
+def no_bullet(paragraph):
+    paragraph._pPr.insert(
+        0,
+        etree.Element("{http://schemas.openxmlformats.org/drawingml/2006/main}buNone"),
+    )
+
+
+class CodeStyle(Style):
+    default_style = ''
+    styles = {
+        token.Whitespace:            '#bbbbbb',
+        token.Comment:               '#008800',
+        token.String:                '#800080',
+        token.Number:                '#2c8553',
+        token.Other:                 'bg:#ffffe0',
+        token.Keyword:               '#2c2cff',
+        token.Keyword.Reserved:      '#353580',
+        token.Keyword.Constant:      '',
+        token.Name.Builtin:          '#2c2cff',
+        token.Name.Variable:         '#2c2cff',
+        token.Generic:               '#2c2cff',
+        token.Generic.Emph:          '#008800',
+        token.Generic.Error:         '#d30202',
+        token.Error:                 'bg:#e3d2d2 #a61717'
+    }
+
+BLACK = RGBColor(0x00, 0x00, 0x00)
+
+_color_tables = {}
+
+
+def color_table(style):
+    """ Returns the color of every token type in the style, worked out once per style. """
+    if style not in _color_tables:
+        _color_tables[style] = {ttype: RGBColor.from_string(definition["color"]) if definition["color"] else BLACK
+                                for ttype, definition in style}
+    return _color_tables[style]
+
+
+def token_color(colors, ttype):
+    # Lexers can make token types of their own, which look like their closest standard parent
+    while ttype not in colors:
+        ttype = ttype.parent
+    return colors[ttype]
+
+
+def coalesce(tokensource, colors):
+    """
+    Yields (color, text) for each stretch of neighbouring tokens that look the same, so that each stretch
+    needs only one run. Whitespace looks the same in any color, so it joins whatever stretch it is next to.
+    """
+    current_color, pieces = None, []
+    for ttype, value in tokensource:
+        if value.strip():
+            color = token_color(colors, ttype)
+            if current_color is None:
+                current_color = color
+            elif color != current_color:
+                yield current_color, "".join(pieces)
+                current_color, pieces = color, []
+        pieces.append(value)
+    if pieces:
+        yield current_color or BLACK, "".join(pieces)
+
+
+def format_run(color, run):
+    run.font.color.rgb = color
+
+
+class PowerPointCodeFormatter(Formatter):
+    MAX_REASONABLE_LINE = 14
+    style = SasStyle
+    def __init__(self, text_frame, code, **options):
+        self.options = options
+        self.text_frame = text_frame
+        self.code = code
+        self.line_count = code.count('\n')
+        # 9 fits comfortably
+
+    def fix_height(self):
+        paragraph = self.text_frame.paragraphs[0]
+        #if self.line_count > 9:
+        #    spacing = (self.MAX_REASONABLE_LINE-(self.line_count-9))/self.MAX_REASONABLE_LINE/2
+        #    paragraph.line_spacing = spacing
+        paragraph.line_spacing = .5
+
+    def format(self, tokensource, outfile):
+        if self.text_frame:
+            self.text_frame.clear()
+            paragraph = self.text_frame.paragraphs[0]
+            no_bullet(paragraph)
+            paragraph.font.name = "Courier New"
+            for color, text in coalesce(tokensource, color_table(self.style)):
+                run = paragraph.add_run()
+                run.text = text
+                format_run(color, run)
+            self.fix_height()
+        else:
+            print("Throwing away codeblock!")
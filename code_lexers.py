@@ -0,0 +1,57 @@
+"""
+Picks the Pygments lexer for a code block, trying the cheap options before falling back to guessing.
+
+Guessing runs every registered lexer's `analyse_text` over the code, which is by far the slowest part of
+highlighting a block. So a block's own language comes first, then the deck's default language (the `language` key
+of its front matter), then a few quick pattern checks, and only then a full guess. The author's word beats the
+patterns, which only have to cover blocks in decks that never said what language they are in.
+"""
+import re
+from functools import lru_cache
+
+from pygments.lexers import get_lexer_by_name, guess_lexer
+from pygments.util import ClassNotFound
+
+# Checked in order; the first pattern found at the start of any line of the block decides its language.
+# Python has to be a whole statement that no other common language writes the same way, so lines like
+# "import x" (Kotlin, Java, Go) or "print(x)" (Ruby, Swift) do not count, and neither do braces or semicolons.
+HEURISTICS = [
+    ("pycon", re.compile(r"^>>> ", re.MULTILINE)),
+    ("python", re.compile(r"^[ \t]*(def \w+\([^{};]*\)( -> [^{};]+)?:|class \w+(\([^{};]*\))?:|"
+                          r"from [\w.]+ import [\w*(][\w*(), ]*|for \w+(, ?\w+)* in [^{};]+:|"
+                          r"(while|if|elif) [^{};]+:|else:)[ \t]*(#.*)?$",
+                          re.MULTILINE)),
+    ("console", re.compile(r"^\$ \w", re.MULTILINE)),
+    ("html", re.compile(r"^\s*<(!DOCTYPE|html|head|body|div|p|span|table)\b", re.MULTILINE | re.IGNORECASE)),
+    ("json", re.compile(r"\A\s*[\[{]\s*(\"[^\"]*\"\s*:|[\[{\"\d]|\]|\})")),
+]
+
+
+@lru_cache(maxsize=None)
+def lexer_by_name(name):
+    """ Returns a shared lexer for the language, or None if Pygments does not know it. """
+    try:
+        return get_lexer_by_name(name, stripall=True)
+    except ClassNotFound:
+        return None
+
+
+def classify(code):
+    for name, pattern in HEURISTICS:
+        if pattern.search(code):
+            return name
+    return None
+
+
+@lru_cache(maxsize=256)
+def guess(code):
+    return guess_lexer(code)
+
+
+def resolve_lexer(code, language=None, default_language=None):
+    for name in [language, default_language, classify(code)]:
+        if name:
+            lexer = lexer_by_name(name.lower())
+            if lexer is not None:
+                return lexer
+    return guess(code)
@@ -0,0 +1,143 @@
+"""
+A content-addressed cache on disk, shared by the stages of the build.
+
+Every entry lives under a namespace (like "slides"), in a folder named after the digest of everything
+that went into making it. If any input changes, so does the digest, so entries never need invalidating;
+instead, old and rarely used entries get evicted to keep the cache within its size and age budget:
+
+    python content_cache.py stats
+    python content_cache.py prune [--max-size 20GB] [--max-age 90] [--dry-run]
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import time
+
+from locations import CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_AGE_DAYS
+
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4}
+
+_file_digests = {}
+
+
+def digest(*parts):
+    """ Returns a full-width SHA-256 hex digest of the given strings and bytes, taken together. """
+    hasher = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # Length prefixes keep ("ab", "c") and ("a", "bc") from colliding
+        hasher.update(str(len(part)).encode("ascii") + b":")
+        hasher.update(part)
+    return hasher.hexdigest()
+
+
+def file_digest(path):
+    """ Returns the SHA-256 hex digest of a file's contents, remembered until the file changes. """
+    stats = os.stat(path)
+    signature = (os.path.abspath(path), stats.st_mtime_ns, stats.st_size)
+    if signature not in _file_digests:
+        hasher = hashlib.sha256()
+        with open(path, "rb") as data:
+            for chunk in iter(lambda: data.read(1 << 20), b""):
+                hasher.update(chunk)
+        _file_digests[signature] = hasher.hexdigest()
+    return _file_digests[signature]
+
+
+def entry_path(namespace, key):
+    return os.path.join(CACHE_DIR, namespace, key[:2], key)
+
+
+def touch(path):
+    """ Marks an entry as just used, so that eviction treats it as fresh. """
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def entries(namespace=None):
+    """ Yields (namespace, path, size in bytes, last used timestamp) for every entry in the cache. """
+    namespaces = [namespace] if namespace else sorted(os.listdir(CACHE_DIR)) if os.path.isdir(CACHE_DIR) else []
+    for name in namespaces:
+        root = os.path.join(CACHE_DIR, name)
+        if not os.path.isdir(root):
+            continue
+        for prefix in sorted(os.listdir(root)):
+            for key in sorted(os.listdir(os.path.join(root, prefix))):
+                path = os.path.join(root, prefix, key)
+                if key.endswith(".tmp"):
+                    continue
+                size = sum(os.path.getsize(os.path.join(folder, file))
+                           for folder, _, files in os.walk(path) for file in files)
+                yield name, path, size, os.path.getmtime(path)
+
+
+def stats():
+    summary = {}
+    for namespace, _, size, last_used in entries():
+        if namespace not in summary:
+            summary[namespace] = {"entries": 0, "bytes": 0, "oldest": last_used, "newest": last_used}
+        summary[namespace]["entries"] += 1
+        summary[namespace]["bytes"] += size
+        summary[namespace]["oldest"] = min(summary[namespace]["oldest"], last_used)
+        summary[namespace]["newest"] = max(summary[namespace]["newest"], last_used)
+    return summary
+
+
+def prune(max_bytes=CACHE_MAX_BYTES, max_age_days=CACHE_MAX_AGE_DAYS, dry_run=False):
+    """
+    Evicts every entry not used within the age limit, and then the least recently used entries
+    until the whole cache fits in the size budget. Returns the (path, size) of each evicted entry.
+    """
+    everything = sorted(entries(), key=lambda entry: entry[3])
+    oldest_allowed = time.time() - max_age_days * 24 * 60 * 60
+    total = sum(size for _, _, size, _ in everything)
+    evicted = []
+    for _, path, size, last_used in everything:
+        if last_used >= oldest_allowed and total <= max_bytes:
+            break
+        if not dry_run:
+            shutil.rmtree(path, ignore_errors=True)
+        evicted.append((path, size))
+        total -= size
+    return evicted
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    number = text.rstrip("KMGTB")
+    return int(float(number) * SIZE_UNITS[text[len(number):]])
+
+
+def format_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and trim the build cache")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Show how much is cached, per stage.")
+    prune_parser = commands.add_parser("prune", help="Evict old and least recently used entries.")
+    prune_parser.add_argument("--max-size", type=parse_size, default=CACHE_MAX_BYTES, help="The size budget, like 20GB.")
+    prune_parser.add_argument("--max-age", type=float, default=CACHE_MAX_AGE_DAYS, help="Evict entries unused for this many days.")
+    prune_parser.add_argument("--dry-run", action="store_true", help="Only report what would be evicted.")
+    args = parser.parse_args()
+    if args.command == "stats":
+        summary = stats()
+        for namespace, numbers in summary.items():
+            print(f"{namespace:<10} {numbers['entries']:>7} entries {format_size(numbers['bytes']):>10}, "
+                  f"last used between {time.strftime('%Y-%m-%d', time.localtime(numbers['oldest']))} "
+                  f"and {time.strftime('%Y-%m-%d', time.localtime(numbers['newest']))}")
+        print(f"{'total':<10} {sum(n['entries'] for n in summary.values()):>7} entries "
+              f"{format_size(sum(n['bytes'] for n in summary.values())):>10}")
+    else:
+        evicted = prune(args.max_size, args.max_age, args.dry_run)
+        verb = "Would evict" if args.dry_run else "Evicted"
+        print(f"{verb} {len(evicted)} entries, freeing {format_size(sum(size for _, size in evicted))}")
@@ -0,0 +1,170 @@
+"""
+The dub index remembers which text each voice clip was generated from, keyed by the clip's hash name.
+It also keeps each clip's duration, sample rate, frame count and validity, so that renders never have to
+probe the audio files themselves; those entries are only trusted while the clip's size and mtime match.
+
+It lives in a SQLite database in WAL mode, so that several bakes can update it at the same time and
+each lookup is an indexed query instead of a load of the entire index. The old `dubs.json` file is
+imported the first time the database is opened, and can be regenerated on demand for diffing:
+
+    python dub_index.py export [path]
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from locations import DUBS_DATABASE_PATH, DUBS_FILE_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dubs (
+    hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clips (
+    voice TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    sample_rate INTEGER NOT NULL,
+    frames INTEGER NOT NULL,
+    valid INTEGER NOT NULL,
+    PRIMARY KEY (voice, hash)
+);
+CREATE TABLE IF NOT EXISTS imports (
+    source TEXT PRIMARY KEY,
+    imported_at TEXT NOT NULL
+);
+"""
+
+_connections = threading.local()
+
+
+def connect(path=DUBS_DATABASE_PATH):
+    """
+    Returns this thread's connection to the database, opening (and if needed, creating) it first.
+    Connections are never shared between threads or processes.
+    """
+    key = (os.getpid(), path)
+    existing = getattr(_connections, "by_key", None)
+    if existing is None:
+        existing = _connections.by_key = {}
+    if key not in existing:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Autocommit mode, so that writes can take the lock up front with BEGIN IMMEDIATE
+        connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        import_json_index(connection)
+        existing[key] = connection
+    return existing[key]
+
+
+@contextmanager
+def transaction(connection):
+    """ Holds the database's write lock for the duration of the block. """
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        yield connection
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    connection.execute("COMMIT")
+
+
+def import_json_index(connection, json_path=DUBS_FILE_PATH):
+    with transaction(connection):
+        already = connection.execute("SELECT 1 FROM imports WHERE source = ?", (json_path,)).fetchone()
+        if already:
+            return 0
+        entries = {}
+        if os.path.exists(json_path):
+            try:
+                with open(json_path) as dub_file:
+                    entries = json.load(dub_file)
+            except json.JSONDecodeError as e:
+                raise Exception("Error while importing dub index; perhaps corrupted?\nOriginal error was:", str(e))
+        connection.executemany("INSERT OR IGNORE INTO dubs (hash, text) VALUES (?, ?)", entries.items())
+        connection.execute("INSERT INTO imports (source, imported_at) VALUES (?, ?)",
+                           (json_path, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    return len(entries)
+
+
+def add_dub_entry(hash_text, text):
+    with transaction(connect()) as connection:
+        connection.execute("INSERT INTO dubs (hash, text) VALUES (?, ?) "
+                           "ON CONFLICT (hash) DO UPDATE SET text = excluded.text "
+                           "WHERE dubs.text != excluded.text", (hash_text, text))
+
+
+def get_dub_text(hash_text):
+    row = connect().execute("SELECT text FROM dubs WHERE hash = ?", (hash_text,)).fetchone()
+    return row[0] if row else None
+
+
+def get_clip(voice, hash_text, size, mtime_ns):
+    """ Returns what is known about the clip, or None if it was never scanned or has changed since. """
+    row = connect().execute("SELECT duration, sample_rate, frames, valid FROM clips "
+                            "WHERE voice = ? AND hash = ? AND size = ? AND mtime_ns = ?",
+                            (voice, hash_text, size, mtime_ns)).fetchone()
+    if row is None:
+        return None
+    return {"duration": row[0], "sample_rate": row[1], "frames": row[2], "valid": bool(row[3])}
+
+
+def put_clip(voice, hash_text, size, mtime_ns, info):
+    with transaction(connect()) as connection:
+        connection.execute("INSERT OR REPLACE INTO clips (voice, hash, size, mtime_ns, duration, sample_rate, frames, valid) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                           (voice, hash_text, size, mtime_ns, info["duration"], info["sample_rate"], info["frames"],
+                            int(info["valid"])))
+
+
+def forget_clips(clips):
+    """ Drops what is known about each (voice, hash) clip. """
+    with transaction(connect()) as connection:
+        connection.executemany("DELETE FROM clips WHERE voice = ? AND hash = ?", clips)
+
+
+def forget_dubs(hashes):
+    """ Drops the text of each hash, for clips that are gone in every voice. """
+    with transaction(connect()) as connection:
+        connection.executemany("DELETE FROM dubs WHERE hash = ?", [(hash_text,) for hash_text in hashes])
+
+
+def dub_hashes():
+    return {row[0] for row in connect().execute("SELECT hash FROM dubs")}
+
+
+def indexed_clips():
+    """ Returns the (voice, hash) of every clip the index knows about. """
+    return connect().execute("SELECT voice, hash FROM clips").fetchall()
+
+
+def vacuum():
+    """ Gives the space of deleted rows back to the file system; needs nobody else writing at the time. """
+    connection = connect()
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connection.execute("VACUUM")
+
+
+def export_json(json_path=DUBS_FILE_PATH):
+    entries = dict(connect().execute("SELECT hash, text FROM dubs ORDER BY hash"))
+    temporary_path = f"{json_path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w') as dub_file:
+        json.dump(entries, dub_file, indent=4)
+    os.replace(temporary_path, json_path)
+    return len(entries)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "export":
+        print("Usage: python dub_index.py export [path]")
+        sys.exit(1)
+    target = sys.argv[2] if len(sys.argv) > 2 else DUBS_FILE_PATH
+    print(f"Exported {export_json(target)} dubs to {target}")
@@ -0,0 +1,110 @@
+"""
+Shrinks images to the size they are actually shown at on their slide before they get embedded, so that
+multi-megabyte screenshots do not bloat every deck (and every save and video export) that uses them.
+
+Images are resized to fit their box on the slide at TARGET_PPI, and recompressed in their own format. The
+results live in the content cache, keyed on the original image and the target size. An image is only
+replaced when that actually makes it smaller, and formats other than PNG and JPEG are left alone.
+"""
+import io
+import math
+import os
+import shutil
+
+from PIL import Image
+from pptx.parts.image import Image as PptxImage
+from pptx.util import Emu, Inches
+
+import content_cache
+
+# Bump this whenever images get processed differently, so old entries stop matching
+CACHE_VERSION = "2"
+NAMESPACE = "images"
+# Pixels per inch of slide, enough for 1080p video with room to spare for zooming in
+TARGET_PPI = 200
+JPEG_QUALITY = 85
+OPTIMIZED_FORMATS = {"PNG": "png", "JPEG": "jpg"}
+# Marks an entry where the original image was already as small as it gets
+KEEP_ORIGINAL = "original"
+
+
+def read_image(img):
+    """ Returns the bytes of an image given as a path or a file-like object. """
+    if isinstance(img, (str, os.PathLike)):
+        with open(img, "rb") as image_file:
+            return image_file.read()
+    img.seek(0)
+    return img.read()
+
+
+def native_size(blob):
+    """ Returns the size python-pptx gives a picture when it is added without one, from its pixels and DPI. """
+    image = PptxImage.from_blob(blob)
+    (width_px, height_px), (horizontal_dpi, vertical_dpi) = image.size, image.dpi
+    return Emu(int(Inches(1) * width_px / horizontal_dpi)), Emu(int(Inches(1) * height_px / vertical_dpi))
+
+
+def target_pixels(width, height):
+    return (max(1, math.ceil(width / Inches(1) * TARGET_PPI)),
+            max(1, math.ceil(height / Inches(1) * TARGET_PPI)))
+
+
+def optimize(blob, size):
+    """ Returns the image shrunk to fit in the size (in pixels) and recompressed, or None if it cannot be. """
+    with Image.open(io.BytesIO(blob)) as image:
+        image_format = image.format
+        if image_format not in OPTIMIZED_FORMATS or getattr(image, "is_animated", False):
+            return None
+        metadata = {name: image.info[name] for name in ["exif", "icc_profile"] if image.info.get(name)}
+        image.load()
+        if image.width > size[0] or image.height > size[1]:
+            # Pillow quietly resizes palette and 1-bit images with NEAREST whatever it is asked for, which
+            # leaves screenshots jagged
+            if image.mode == "P":
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+            elif image.mode == "1":
+                image = image.convert("RGB")
+            image.thumbnail(size, Image.LANCZOS)
+        output = io.BytesIO()
+        if image_format == "JPEG":
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True, **metadata)
+        else:
+            image.save(output, "PNG", optimize=True, **metadata)
+    return output.getvalue()
+
+
+def fit(blob, width, height):
+    """
+    Returns the path of the image to embed in a box of the given size (in EMU), or None when that is the original
+    image itself, along with the original and embedded sizes in bytes. The path is in the cache, so the
+    image can be streamed from there into the deck.
+    """
+    size = target_pixels(width, height)
+    key = content_cache.digest(CACHE_VERSION, blob, str(TARGET_PPI), str(JPEG_QUALITY), *map(str, size))
+    path = content_cache.entry_path(NAMESPACE, key)
+    if not os.path.isdir(path):
+        optimized = optimize(blob, size)
+        if optimized is not None and len(optimized) >= len(blob):
+            optimized = None
+        save(path, optimized, PptxImage.from_blob(blob).ext)
+    content_cache.touch(path)
+    for name in os.listdir(path):
+        if name.startswith("image."):
+            image_path = os.path.join(path, name)
+            return image_path, len(blob), os.path.getsize(image_path)
+    return None, len(blob), len(blob)
+
+
+def save(path, optimized, extension):
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(temporary_path, exist_ok=True)
+    name = KEEP_ORIGINAL if optimized is None else "image." + extension
+    with open(os.path.join(temporary_path, name), "wb") as image_file:
+        image_file.write(optimized or b"")
+    try:
+        os.rename(temporary_path, path)
+    except OSError:
+        # Another bake made the same image first
+        shutil.rmtree(temporary_path, ignore_errors=True)
@@ -1,7 +1,20 @@
 POWERPOINT_TEMPLATE = "templates/empty_presentation.pptx"
 
 DUBS_FILE_PATH = './data/dubs.json'
-BACKUP_DUBS_FILE_PATH = './data/dubs.bak.json'
+DUBS_DATABASE_PATH = './data/dubs.sqlite3'
 VOICES_DIR ="./voices/"
 DEFAULT_VOICE = 'Amy'
-USED_DUBS_FILE_PATH = "./data/used.json"
\ No newline at end of file
+USED_DUBS_FILE_PATH = "./data/used.json"
+CACHE_DIR = "./cache/"
+CACHE_MAX_BYTES = 20 * 1024 ** 3
+CACHE_MAX_AGE_DAYS = 90
+# libx264's speed/size trade-off, used when encoding MP4s
+H264_PRESETS = ["ultrafast", "superfast", "veryfast", "faster", "fast", "medium", "slow", "slower", "veryslow"]
+DEFAULT_H264_PRESET = "medium"
+# libx264's constant rate factors run from lossless (0) to the smallest possible file
+MAX_H264_CRF = 51
+# How videos can be exported: through PowerPoint itself, or drawn and encoded with ffmpeg
+VIDEO_ENGINES = ["powerpoint", "ffmpeg"]
+# How much voice clip storage to allow, and how long unreferenced clips are kept, when collecting garbage
+VOICES_MAX_BYTES = 5 * 1024 ** 3
+VOICES_MAX_AGE_DAYS = 180
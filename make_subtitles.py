@@ -1,12 +1,20 @@
-import spacy
+from functools import lru_cache
 
+# Seconds each slide's transition takes, before its timeline starts
 SLIDE_DELAY = 1
+# Seconds into a slide's timeline that its narration starts
 NARRATION_DELAY = 1
 MAX_LINE_LENGTH = 80
 MIN_LINE_LENGTH = 40
 
-nlp_sentencizer = spacy.blank("en")
-nlp_sentencizer.add_pipe("sentencizer")
+
+@lru_cache(maxsize=None)
+def get_sentencizer():
+    """ Builds the spaCy sentence splitter the first time captions are made, since loading spaCy takes seconds. """
+    import spacy
+    nlp_sentencizer = spacy.blank("en")
+    nlp_sentencizer.add_pipe("sentencizer")
+    return nlp_sentencizer
 
 def find_nearest_space(text: str, index: int, extent=5) -> int:
     for i in range(0, extent):
@@ -16,12 +24,17 @@ def find_nearest_space(text: str, index: int, extent=5) -> int:
             return index - i
     return index
 
-def as_time(seconds: int) -> str:
-    minutes = seconds // 60
-    return f"{minutes:02}:{seconds % 60:02}.000"
+def as_time(seconds: float) -> str:
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    if hours:
+        return f"{hours:02}:{minutes:02}:{seconds:02}.{milliseconds:03}"
+    return f"{minutes:02}:{seconds:02}.{milliseconds:03}"
 
 def split_sentences(text: str, max_line_length=MAX_LINE_LENGTH, min_line_length = MIN_LINE_LENGTH) -> list[str]:
-    tokens = nlp_sentencizer(text)
+    tokens = get_sentencizer()(text)
     sentences = [str(sent).strip() for sent in tokens.sents]
     for sentence in sentences:
         split_sentences = [sentence]
@@ -37,23 +50,61 @@ def split_sentences(text: str, max_line_length=MAX_LINE_LENGTH, min_line_length
         
 #print(list(split_sentences("This is a test of the sentence splitter. It should split this sentence into two.", 5, 2)))
 
-def make_captions(transcript: list[str], durations: list[int]) -> list[str]:
+def proportional_cues(sentences: list[str], start: float, duration: float) -> list[tuple[float, float, str]]:
+    """ Spreads the duration across the sentences in proportion to their length, for clips without speech marks. """
+    sentence_lengths = [len(sent) for sent in sentences]
+    total_length = sum(sentence_lengths)
+    sentence_durations = [round(duration * (length / total_length)) for length in sentence_lengths]
+    sentence_durations[-1] += SLIDE_DELAY
+    cues = []
+    for sentence, sentence_duration in zip(sentences, sentence_durations):
+        cues.append((start, start + sentence_duration, sentence))
+        start += sentence_duration
+    return cues
+
+
+def marked_cues(text: str, sentences: list[str], marks: list[dict], start: float, end: float) -> list[tuple[float, float, str]]:
+    """
+    Times each sentence (or piece of a long sentence) by when Polly says its first word.
+    Speech marks count their offsets in bytes of the UTF-8 text, so the pieces get found in the text the same way.
+    """
+    word_marks = sorted((mark for mark in marks if mark.get("type") in ("word", "sentence")),
+                        key=lambda mark: (mark["start"], mark["time"]))
+    starts = []
+    cursor = 0
+    for sentence in sentences:
+        index = text.find(sentence.strip(), cursor)
+        if index == -1:
+            index = cursor
+        cursor = index + len(sentence.strip())
+        byte_offset = len(text[:index].encode("utf-8"))
+        spoken = [mark["time"] for mark in word_marks if mark["start"] >= byte_offset]
+        starts.append(start + spoken[0] / 1000 if spoken else (starts[-1] if starts else start))
+    ends = starts[1:] + [end]
+    return [(cue_start, max(cue_start, cue_end), sentence) for cue_start, cue_end, sentence in zip(starts, ends, sentences)]
+
+
+def make_captions(transcript: list[str], durations: list[int], marks: list[list[dict]] = None) -> list[str]:
+    """
+    Makes the WebVTT lines for the narration of every slide. Where a slide's speech marks are given, the cues
+    follow when each sentence is actually spoken; otherwise each slide's time gets shared out by sentence length.
+    """
     yield "WEBVTT\n"
     current_time = SLIDE_DELAY
-    for text, duration in zip(transcript, durations):
-        text = text.replace('\n', ' ')    
+    if marks is None:
+        marks = [None] * len(transcript)
+    for text, duration, slide_marks in zip(transcript, durations, marks):
+        text = text.replace('\n', ' ')
         sentences = list(split_sentences(text))
-        sentence_lengths = [len(sent) for sent in sentences]
-        total_length = sum(sentence_lengths)
-        sentence_durations = [round(duration * (length / total_length)) for length in sentence_lengths]
-        time_offset = current_time
-        sentence_durations[-1] += SLIDE_DELAY
-        for sentence, sentence_duration in zip(sentences, sentence_durations):
-            yield f"{as_time(time_offset)} --> {as_time(time_offset + sentence_duration)}"
+        if slide_marks:
+            cues = marked_cues(text, sentences, slide_marks, current_time + NARRATION_DELAY, current_time + duration)
+        else:
+            cues = proportional_cues(sentences, current_time, duration)
+        for cue_start, cue_end, sentence in cues:
+            yield f"{as_time(cue_start)} --> {as_time(cue_end)}"
             yield f"{sentence.strip()}\n"
-            time_offset += sentence_duration
         current_time += duration + SLIDE_DELAY
-        
-        
+
+
 #print("\n".join(make_captions(["This is a test of the sentence splitter. It should split this sentence into two.",
 #                          "However are you doing today, this will be a very long sentence indeed, twice as long in fact."], [5, 10])))
@@ -0,0 +1,134 @@
+"""
+Reads what we need to know about an MP3 clip (duration, sample rate, frame count) straight from its frame
+headers, and checks that the clip is intact while doing so.
+
+A clip counts as valid when everything after its ID3v2 tag is a run of consistent MPEG audio frames, with at
+most an ID3v1 tag at the end. Truncated or garbled clips (which used to get re-encoded wholesale, just in case)
+show up as invalid, so only those need repairing.
+"""
+# Bitrates in kbps, by (MPEG version 1 or not, layer) and the header's bitrate index
+BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# Sample rates by the header's version bits (0 is MPEG 2.5, 2 is MPEG 2, 3 is MPEG 1)
+SAMPLE_RATES = {0: [11025, 12000, 8000], 2: [22050, 24000, 16000], 3: [44100, 48000, 32000]}
+LAYERS = {1: 3, 2: 2, 3: 1}
+ID3V1_SIZE = 128
+
+
+def parse_header(data, offset):
+    """
+    Returns the frame header at the offset as a dict, or None if there is not a valid header there.
+    Free-format frames count as invalid, since their length cannot be known from the header.
+    """
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (data[offset + 1] >> 3) & 0x03
+    layer = LAYERS.get((data[offset + 1] >> 1) & 0x03)
+    bitrate_index = data[offset + 2] >> 4
+    sample_rate_index = (data[offset + 2] >> 2) & 0x03
+    if version_bits == 1 or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version_bits == 3
+    bitrate = BITRATES[mpeg1, layer][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version_bits][sample_rate_index]
+    padding = (data[offset + 2] >> 1) & 0x01
+    mono = data[offset + 3] >> 6 == 3
+    if layer == 1:
+        length, samples = (12 * bitrate // sample_rate + padding) * 4, 384
+    elif layer == 3 and not mpeg1:
+        length, samples = 72 * bitrate // sample_rate + padding, 576
+    else:
+        length, samples = 144 * bitrate // sample_rate + padding, 1152
+    return {"version": version_bits, "layer": layer, "sample_rate": sample_rate, "length": length,
+            "samples": samples, "mono": mono, "mpeg1": mpeg1}
+
+
+def id3v2_size(data):
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    # Bit 4 of the flags means a footer follows the tag
+    return 10 + size + (10 if data[5] & 0x10 else 0)
+
+
+def is_info_frame(data, offset, header):
+    """ Checks for a Xing/Info or VBRI tag, which takes up a frame but holds no audio. """
+    if header["layer"] == 3:
+        side_info = (17 if header["mono"] else 32) if header["mpeg1"] else (9 if header["mono"] else 17)
+        if data[offset + 4 + side_info:offset + 8 + side_info] in (b"Xing", b"Info"):
+            return True
+    return data[offset + 36:offset + 40] == b"VBRI"
+
+
+def audio_frames(data):
+    """
+    Walks every frame of the clip, returning the (offset, header) of each audio frame (leaving out the tags and
+    any Xing/Info frame), and whether the whole clip was made of intact frames.
+    """
+    offset = id3v2_size(data)
+    end = len(data)
+    if end - offset >= ID3V1_SIZE and data[end - ID3V1_SIZE:end - ID3V1_SIZE + 3] == b"TAG":
+        end -= ID3V1_SIZE
+    first, found = None, []
+    valid = True
+    while offset < end:
+        header = parse_header(data, offset)
+        if header is None or offset + header["length"] > end:
+            valid = False
+            break
+        if first is None:
+            first = header
+            if is_info_frame(data, offset, header):
+                offset += header["length"]
+                continue
+        elif (header["version"], header["layer"], header["sample_rate"]) != \
+                (first["version"], first["layer"], first["sample_rate"]):
+            valid = False
+            break
+        found.append((offset, header))
+        offset += header["length"]
+    return found, valid
+
+
+def scan_bytes(data):
+    """
+    Returns the clip's duration in seconds, sample rate and frame count, and whether the whole clip was made
+    of intact frames.
+    """
+    found, valid = audio_frames(data)
+    sample_rate = found[0][1]["sample_rate"] if found else 0
+    samples = sum(header["samples"] for _, header in found)
+    return {"duration": samples / sample_rate if sample_rate else 0.0, "sample_rate": sample_rate,
+            "frames": len(found), "valid": valid and bool(found)}
+
+
+def join(clips):
+    """
+    Joins whole clips into one by concatenating their audio frames, with no re-encoding and so no added gaps.
+    Every clip has to be intact and in the same format; the result has no tags.
+    """
+    joined = []
+    first = None
+    for data in clips:
+        found, valid = audio_frames(data)
+        if not valid or not found:
+            raise ValueError("Only intact clips can be joined")
+        header = found[0][1]
+        if first is None:
+            first = header
+        elif (header["version"], header["layer"], header["sample_rate"]) != \
+                (first["version"], first["layer"], first["sample_rate"]):
+            raise ValueError("Only clips in the same format can be joined")
+        joined.extend(data[offset:offset + frame_header["length"]] for offset, frame_header in found)
+    return b"".join(joined)
+
+
+def scan(path):
+    with open(path, "rb") as clip:
+        return scan_bytes(clip.read())
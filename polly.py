@@ -4,74 +4,285 @@ Library based off of the AWS Polly example code, with some modifications for thi
 Basically, this provides functions for generating speech from text using AWS Polly, and saving the resulting audio files to disk.
 """
 from contextlib import closing
-import os
-import sys
-import subprocess
 import json
-from tempfile import gettempdir
-import shutil
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from textwrap import fill
-from datetime import datetime
-
-from boto3 import Session
-from botocore.exceptions import BotoCoreError, ClientError
-from pydub import AudioSegment
 
 from friendly_hash import hash
-from locations import VOICES_DIR, DUBS_FILE_PATH, BACKUP_DUBS_FILE_PATH, USED_DUBS_FILE_PATH
+from locations import VOICES_DIR, DEFAULT_VOICE
+import dub_index
+import mp3_frames
+import usage
+
+PREFETCH_WORKERS = 4
+PREFETCH_RETRIES = 3
+PREFETCH_BACKOFF = 1.0
+SPEECH_MARK_TYPES = ["sentence", "word"]
+# Polly turns down requests with more than 3000 characters of text, so longer narration is voiced in chunks
+MAX_CHUNK_CHARACTERS = 1500
+CHUNK_WORKERS = 4
+
+
+class SynthesisError(Exception):
+    """ Polly could not voice some narration. """
 
 def make_default_files():
     # Make sure voices directory exists
     os.makedirs(VOICES_DIR, exist_ok=True)
-    # Make sure dub index and its backup exists
-    for path in [DUBS_FILE_PATH, BACKUP_DUBS_FILE_PATH]:
-        if not os.path.exists(path):
-            with open(path, 'w') as dub_file:
-                json.dump({}, dub_file)
 
-make_default_files()
+
+def service_errors():
+    """ The errors that mean Polly could not voice something, imported only once they are needed. """
+    from botocore.exceptions import BotoCoreError, ClientError
+    return (BotoCoreError, ClientError, IOError)
 
 def add_dub_entry(hash_text, text):
-    try:
-        with open(DUBS_FILE_PATH) as dub_file:
-            existing = json.load(dub_file)
-    except json.JSONDecodeError as e:
-        raise Exception("Error while loading dub index; perhaps corrupted? Check the backup!\nOriginal error was:", str(e))
-    # Is the update actually needed?
-    if hash_text in existing and existing[hash_text] == text:
-        return
-    # Make a backup in case things get interrupted and the file is corrupted
-    shutil.copy(DUBS_FILE_PATH, BACKUP_DUBS_FILE_PATH)
-    # Update the index file then!
-    existing[hash_text] = text
-    with open(DUBS_FILE_PATH, 'w') as dub_file:
-        json.dump(existing, dub_file, indent=4)
+    dub_index.add_dub_entry(hash_text, text)
 
 def reencode_mp3(path):
     """
     MP3s were getting corrupted, strangely enough. This function re-encodes the file to fix that.
     """
+    from pydub import AudioSegment
     song = AudioSegment.from_mp3(path)
     song.export(path, format="mp3")
-    
+
+
+def clip_info(path):
+    """
+    Returns the clip's duration, sample rate, frame count and validity from the dub index, scanning
+    the clip's frames only if it is new or has changed. Broken clips get re-encoded before they are recorded.
+    """
+    voice = os.path.basename(os.path.dirname(path))
+    hash_name = os.path.splitext(os.path.basename(path))[0]
+    stats = os.stat(path)
+    info = dub_index.get_clip(voice, hash_name, stats.st_size, stats.st_mtime_ns)
+    if info is not None:
+        return info
+    info = mp3_frames.scan(path)
+    if not info["valid"]:
+        reencode_mp3(path)
+        info = mp3_frames.scan(path)
+        stats = os.stat(path)
+    dub_index.put_clip(voice, hash_name, stats.st_size, stats.st_mtime_ns, info)
+    return info
+
     
 def remember_used(label, hash_name):
-    if not os.path.exists(USED_DUBS_FILE_PATH):
-        with open(USED_DUBS_FILE_PATH, 'w') as used_file:
-            json.dump({}, used_file)
-    with open(USED_DUBS_FILE_PATH) as used_file:
-        existing = json.load(used_file)
-    if hash_name not in existing:
-        existing[hash_name] = []
-    existing[hash_name].append({"label": label, "when": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
-    with open(USED_DUBS_FILE_PATH, 'w') as used_file:
-        json.dump(existing, used_file, indent=4)
+    usage.record(label, hash_name)
+
+
+def speech_name(text):
+    return "speech"+str(hash(text))
+
+
+def speech_path(text, voice):
+    return os.path.join(VOICES_DIR, voice, speech_name(text)+'.mp3')
+
+
+def marks_path(text, voice):
+    """ Speech marks are cached right next to their clip, under the same hash name. """
+    return os.path.join(VOICES_DIR, voice, speech_name(text)+'.marks.json')
+
+
+def make_client():
+    from boto3 import Session
+    session = Session(profile_name="default")
+    return session.client("polly")
+
+
+def synthesize(client, text, voice, output):
+    """
+    Asks Polly to voice the text, and writes the resulting clip to the output path.
+    The client can be anything with a `synthesize_speech` method that behaves like the boto3 one,
+    such as a local fake. Errors are raised rather than exiting, so that the caller can retry.
+    """
+    response = client.synthesize_speech(Text=text, OutputFormat="mp3",
+                                        VoiceId=voice, Engine="neural")
+    if "AudioStream" not in response:
+        raise IOError("Could not stream audio")
+    # Write to a temporary file first, so that an interrupted download never looks like a finished clip
+    temporary_output = f"{output}.{os.getpid()}.{threading.get_ident()}.part"
+    with closing(response["AudioStream"]) as stream:
+        with open(temporary_output, "wb") as file:
+            file.write(stream.read())
+    os.replace(temporary_output, output)
+    return output
+
+
+def synthesize_marks(client, text, voice, output):
+    """
+    Asks Polly when each sentence and word of the text is spoken, and writes the marks to the output path
+    as a JSON list. Each mark has its `time` in milliseconds from the start of the clip, its `type`, and the
+    `start` and `end` byte offsets of what it covers in the UTF-8 encoded text.
+    As with `synthesize`, the client can be a fake that returns JSON lines when asked for OutputFormat="json".
+    """
+    response = client.synthesize_speech(Text=text, OutputFormat="json", SpeechMarkTypes=SPEECH_MARK_TYPES,
+                                        VoiceId=voice, Engine="neural")
+    if "AudioStream" not in response:
+        raise IOError("Could not stream speech marks")
+    with closing(response["AudioStream"]) as stream:
+        marks = [json.loads(line) for line in stream.read().decode("utf-8").splitlines() if line.strip()]
+    temporary_output = f"{output}.{os.getpid()}.{threading.get_ident()}.part"
+    with open(temporary_output, "w", encoding="utf-8") as file:
+        json.dump(marks, file)
+    os.replace(temporary_output, output)
+    return output
+
+
+def load_speech_marks(text, voice):
+    """ Returns the cached speech marks for the text's clip, or None if they were never fetched. """
+    try:
+        with open(marks_path(text, voice), encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def synthesize_single(client, text, voice, output):
+    """ Makes whichever of the clip and its speech marks are missing, in one request each. """
+    if not os.path.exists(output):
+        synthesize(client, text, voice, output)
+    if not os.path.exists(marks_path(text, voice)):
+        synthesize_marks(client, text, voice, marks_path(text, voice))
+    return output
+
+
+def chunk_spans(text):
+    """
+    Splits text too long for one request at its sentences, returning the (start, end) character span of each;
+    shorter text stays whole, as a single span. A sentence too long for one request is split further, at the
+    last space that fits.
+    """
+    if len(text) <= MAX_CHUNK_CHARACTERS:
+        return [(0, len(text))]
+    from make_subtitles import get_sentencizer
+    spans = []
+    for sentence in get_sentencizer()(text).sents:
+        start, end = sentence.start_char, sentence.end_char
+        while start < end and text[start].isspace():
+            start += 1
+        while end - start > MAX_CHUNK_CHARACTERS:
+            cut = text.rfind(" ", start + 1, start + MAX_CHUNK_CHARACTERS)
+            if cut == -1:
+                cut = start + MAX_CHUNK_CHARACTERS
+            spans.append((start, cut))
+            start = cut
+            while start < end and text[start].isspace():
+                start += 1
+        if text[start:end].strip():
+            spans.append((start, end))
+    return spans
+
+
+def stitch_chunks(text, voice, spans, output):
+    """
+    Joins the chunks' clips into the text's clip, and their speech marks into its marks, moving each chunk's
+    marks along by the audio and the text that comes before it.
+    """
+    clips, marks = [], []
+    elapsed = 0.0
+    for start, end in spans:
+        chunk = text[start:end]
+        with open(speech_path(chunk, voice), "rb") as clip_file:
+            clips.append(clip_file.read())
+        offset = len(text[:start].encode("utf-8"))
+        for mark in load_speech_marks(chunk, voice):
+            marks.append(dict(mark, time=mark["time"] + round(elapsed * 1000),
+                              start=mark["start"] + offset, end=mark["end"] + offset))
+        elapsed += mp3_frames.scan_bytes(clips[-1])["duration"]
+    try:
+        joined = mp3_frames.join(clips)
+    except ValueError as error:
+        raise SynthesisError(f"Could not join the chunks of {output!r}: {error}") from error
+    temporary_output = f"{output}.{os.getpid()}.{threading.get_ident()}.part"
+    with open(temporary_output, "wb") as file:
+        file.write(joined)
+    os.replace(temporary_output, output)
+    temporary_output = f"{marks_path(text, voice)}.{os.getpid()}.{threading.get_ident()}.part"
+    with open(temporary_output, "w", encoding="utf-8") as file:
+        json.dump(marks, file)
+    os.replace(temporary_output, marks_path(text, voice))
+    return output
+
+
+def synthesize_clip(client, text, voice, output):
+    """
+    Makes whichever of the clip and its speech marks are missing. Narration too long for one request is
+    voiced a chunk at a time, several at once, and each chunk is kept as a clip of its own; so after an edit,
+    only the chunks that changed are voiced again before the clip gets stitched back together.
+    A clip that already exists is never voiced again, only its marks get fetched.
+    """
+    make_default_files()
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    if os.path.exists(output):
+        if not os.path.exists(marks_path(text, voice)):
+            synthesize_marks(client, text, voice, marks_path(text, voice))
+        return output
+    spans = chunk_spans(text)
+    if len(spans) <= 1:
+        return synthesize_single(client, text, voice, output)
+    # The same sentence can come up more than once, but only needs voicing once
+    chunks = dict.fromkeys(text[start:end] for start, end in spans)
+    with ThreadPoolExecutor(max_workers=CHUNK_WORKERS) as pool:
+        futures = {pool.submit(synthesize_single, client, chunk, voice, speech_path(chunk, voice)): chunk
+                   for chunk in chunks}
+        for future in as_completed(futures):
+            future.result()
+            add_dub_entry(speech_name(futures[future]), futures[future])
+    return stitch_chunks(text, voice, spans, output)
+
+
+def synthesize_with_retries(client, text, voice, output, retries=PREFETCH_RETRIES, backoff=PREFETCH_BACKOFF):
+    for attempt in range(retries + 1):
+        try:
+            return synthesize_clip(client, text, voice, output)
+        except service_errors() as error:
+            if attempt == retries:
+                raise SynthesisError(f"Polly could not voice {speech_name(text)} for voice {voice!r}: {error}") from error
+            time.sleep(backoff * 2 ** attempt)
+
+
+def prefetch(texts, voice, client=None, max_workers=PREFETCH_WORKERS):
+    """
+    Synthesizes every clip (and its speech marks) that is missing for the given narration texts, several at a time.
+    Returns the paths of the clips that had to be created or completed.
+    """
+    missing = {}
+    for text in texts:
+        output = speech_path(text, voice)
+        if not os.path.exists(output) or not os.path.exists(marks_path(text, voice)):
+            missing[output] = text
+    if not missing:
+        return []
+    os.makedirs(os.path.join(VOICES_DIR, voice), exist_ok=True)
+    if client is None:
+        client = make_client()
+    created = []
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(synthesize_with_retries, client, text, voice, output): text
+                   for output, text in missing.items()}
+        for future in as_completed(futures):
+            created.append(future.result())
+            add_dub_entry(speech_name(futures[future]), futures[future])
+            clip_info(future.result())
+    return created
+
+
+def prefetch_voices(texts, voices, client=None, max_workers=PREFETCH_WORKERS):
+    """ Prefetches the narration in every voice at the same time, returning the paths of all the created clips. """
+    with ThreadPoolExecutor(max_workers=len(voices)) as pool:
+        futures = [pool.submit(prefetch, texts, voice, client, max_workers) for voice in voices]
+        return [path for future in futures for path in future.result()]
 
 
 def speech(text, voice, use_remote=True, label=""):
-    hash_name = "speech"+str(hash(text))
+    hash_name = speech_name(text)
     remember_used(label, hash_name)
-    output = os.path.join(VOICES_DIR, voice, hash_name+'.mp3')
+    output = speech_path(text, voice)
     if os.path.exists(output):
         # Might need to update the index file!
         add_dub_entry(hash_name, text)
@@ -80,29 +291,10 @@ def speech(text, voice, use_remote=True, label=""):
         raise Exception(f"Local speech file {output!r} missing for voice {voice!r}. Text of speech was:\n"+
                         fill(text, initial_indent='    ', subsequent_indent='    '))
 
-    session = Session(profile_name="default")
-    polly = session.client("polly")
     try:
-        # Request speech synthesis
-        response = polly.synthesize_speech(Text=text, OutputFormat="mp3",
-                                            VoiceId=voice, Engine="neural")
-    except (BotoCoreError, ClientError) as error:
-        # The service returned an error, exit gracefully
-        print(error)
-        sys.exit(-1)
-    if "AudioStream" in response:
-        with closing(response["AudioStream"]) as stream:
-            try:
-                # Open a file for writing the output as a binary stream
-                with open(output, "wb") as file:
-                    file.write(stream.read())
-                add_dub_entry(hash_name, text)
-                return output
-            except IOError as error:
-                # Could not write to file, exit gracefully
-                print(error)
-                sys.exit(-1)
-    else:
-        # The response didn't contain audio data, exit gracefully
-        print("Could not stream audio")
-        sys.exit(-1)
+        synthesize_clip(make_client(), text, voice, output)
+    except service_errors() as error:
+        raise SynthesisError(f"Polly could not voice {speech_name(text)} for voice {voice!r}: {error}") from error
+    add_dub_entry(hash_name, text)
+    clip_info(output)
+    return output
@@ -1,6 +1,25 @@
+import hashlib
+import os
+
+from pptx.media import Video
+from pptx.opc.package import PartFactory
+from pptx.opc.serialized import PackageWriter
+from pptx.parts.image import Image, ImagePart
+from pptx.parts.media import MediaPart
+from pptx.util import lazyproperty
 from pptx.shapes.shapetree import (PicturePlaceholder, SlidePlaceholder, 
                                     CT_Picture, PlaceholderPicture)
 
+AUDIO_CONTENT_TYPES = ['audio/mp3', 'audio/mp4', 'audio/mid', 'audio/x-wav', 'audio/mpeg']
+# How much of a media file is read at a time when hashing it
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def register_audio_parts():
+    """ Loads audio parts as media parts, the same as video. Safe to call more than once. """
+    for aud_type in AUDIO_CONTENT_TYPES:
+        PartFactory.part_type_for.update({aud_type: MediaPart})
+
 
 class CustomPicturePlaceholder(PicturePlaceholder):
     def insert_picture(self, image_file, method = 'crop'):
@@ -59,3 +78,122 @@ SlidePlaceholder.insert_picture = CustomPicturePlaceholder.insert_picture
 SlidePlaceholder._new_placeholder_pic = CustomPicturePlaceholder._new_placeholder_pic
 SlidePlaceholder._get_or_add_image = CustomPicturePlaceholder._get_or_add_image
 
+
+
+# Media and images added from files on disk stay on disk: the package only keeps their paths, and they are
+# streamed into the .pptx when it gets saved, so a deck's memory does not grow with every clip narrated into
+# it. The files must stay where they are until the deck has been saved.
+
+def file_sha1(path):
+    """ Hashes the file a chunk at a time, the way python-pptx hashes media to find duplicates. """
+    digest = hashlib.sha1()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_path(source):
+    """ Returns the path of a media source given as a path or as a file opened from one, or else None. """
+    if isinstance(source, str):
+        return source
+    name = getattr(source, "name", None)
+    return name if isinstance(name, str) and os.path.isfile(name) else None
+
+
+class FileVideo(Video):
+    """ A video (or audio clip) known only by its path, so that its contents never need to be read. """
+    def __init__(self, path, mime_type, filename):
+        super().__init__(None, mime_type, filename)
+        self.path = path
+
+    @lazyproperty
+    def sha1(self):
+        return file_sha1(self.path)
+
+
+class FileBackedPart:
+    """ A part whose contents stay in a file, and are only read when python-pptx asks for them. """
+    path = None
+    _sha1 = None
+
+    @property
+    def _blob(self):
+        with open(self.path, "rb") as part_file:
+            return part_file.read()
+
+    @_blob.setter
+    def _blob(self, blob):
+        # Only ever set to nothing by the part's constructor
+        pass
+
+    @property
+    def sha1(self):
+        return self._sha1
+
+
+class FileMediaPart(FileBackedPart, MediaPart):
+    pass
+
+
+class FileImagePart(FileBackedPart, ImagePart):
+    pass
+
+
+def file_backed(part, path, sha1):
+    part.path, part._sha1 = path, sha1
+    return part
+
+
+_video_from_path_or_file_like = Video.from_path_or_file_like.__func__
+_image_from_file = Image.from_file.__func__
+_new_media_part = MediaPart.new.__func__
+_new_image_part = ImagePart.new.__func__
+
+
+def video_from_path_or_file_like(cls, movie_file, mime_type):
+    path = source_path(movie_file)
+    if path is None:
+        return _video_from_path_or_file_like(cls, movie_file, mime_type)
+    return FileVideo(path, mime_type, os.path.basename(movie_file) if isinstance(movie_file, str) else None)
+
+
+def image_from_file(cls, image_file):
+    # Images still get read once, for their size and format, but are not kept
+    image = _image_from_file(cls, image_file)
+    image.path = source_path(image_file)
+    return image
+
+
+def new_media_part(cls, package, media):
+    if getattr(media, "path", None) is None:
+        return _new_media_part(cls, package, media)
+    return file_backed(FileMediaPart(package.next_media_partname(media.ext), media.content_type, package),
+                       media.path, media.sha1)
+
+
+def new_image_part(cls, package, image):
+    if getattr(image, "path", None) is None:
+        return _new_image_part(cls, package, image)
+    return file_backed(FileImagePart(package.next_image_partname(image.ext), image.content_type, package, None,
+                                     image.filename),
+                       image.path, image.sha1)
+
+
+def write_parts(self, phys_writer):
+    """ Writes every part into the package, streaming file-backed ones from their files. """
+    for part in self._parts:
+        path = getattr(part, "path", None)
+        if path is None:
+            phys_writer.write(part.partname, part.blob)
+        else:
+            phys_writer._zipf.write(path, part.partname.membername)
+        if part._rels:
+            phys_writer.write(part.partname.rels_uri, part.rels.xml)
+
+
+Video.from_path_or_file_like = classmethod(video_from_path_or_file_like)
+Image.from_file = classmethod(image_from_file)
+MediaPart.new = classmethod(new_media_part)
+ImagePart.new = classmethod(new_image_part)
+PackageWriter._write_parts = write_parts
@@ -0,0 +1,186 @@
+"""
+Caches the slides of a deck one at a time, so that rebuilding a lesson only re-renders the slides whose source changed.
+
+A lesson is split into slides at its headings, the same places the renderer starts new slides. Each slide's key covers
+its Markdown (including code and narration text), the images it references, the template, the deck's default
+code language, and whether its HTML was rendered. A cached slide keeps its XML, speaker notes and media, and gets
+spliced into the new deck instead of being rendered again. Slides are cached before any voice's narration is added,
+so every voice shares them.
+"""
+import json
+import os
+import shutil
+
+from marko.ast_renderer import ASTRenderer
+from lxml import etree
+from pptx.media import Video
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.opc.package import _Relationship
+from pptx.oxml import parse_xml
+
+import content_cache
+
+# Bump this whenever the renderer changes how slides get built, so old entries stop matching
+CACHE_VERSION = "9"
+NAMESPACE = "slides"
+# The layout and notes are recreated from scratch when the slide is restored
+RECREATED_RELATIONSHIPS = {RT.SLIDE_LAYOUT, RT.NOTES_SLIDE}
+MEDIA_RELATIONSHIPS = {RT.MEDIA, RT.VIDEO}
+
+
+def split_slides(elements, is_summary):
+    """
+    Groups the top-level elements of a document by slide, starting a new group at each heading.
+    Everything from the Summary heading onward stays with the slide before it, since no new slides are made there.
+    """
+    groups = [[]]
+    seen_summary = False
+    for element in elements:
+        if element.get_type() == "Heading" and not seen_summary:
+            if is_summary(element):
+                seen_summary = True
+            else:
+                groups.append([])
+        groups[-1].append(element)
+    return [group for group in groups if group]
+
+
+def find_images(tree):
+    if isinstance(tree, list):
+        for child in tree:
+            yield from find_images(child)
+    elif isinstance(tree, dict):
+        if tree.get("element") == "image":
+            yield tree["dest"]
+        yield from find_images(tree.get("children"))
+
+
+def slide_key(elements, graphics_folder, template, default_language=None, html=True):
+    """ Slides rendered without their HTML (as with --skip-html) are kept apart, since their HTML lacks the code. """
+    tree = [ASTRenderer().render(element) for element in elements]
+    images = []
+    for destination in find_images(tree):
+        path = os.path.join(graphics_folder, destination)
+        images.append(content_cache.file_digest(path) if os.path.exists(path) else "missing:" + path)
+    return content_cache.digest(CACHE_VERSION, json.dumps(tree, sort_keys=True), *images,
+                                content_cache.file_digest(template), default_language or "", "html" if html else "")
+
+
+def load(key):
+    path = content_cache.entry_path(NAMESPACE, key)
+    try:
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as manifest_file:
+            cached = json.load(manifest_file)
+    except FileNotFoundError:
+        return None
+    cached["path"] = path
+    content_cache.touch(path)
+    return cached
+
+
+def capture_slide(presentation, slide, blobs):
+    captured = {
+        "layout": presentation.slide_layouts.index(slide.slide_layout),
+        "xml": etree.tostring(slide._element, encoding="unicode"),
+        "notes": slide.notes_slide.notes_text_frame.text if slide.has_notes_slide else None,
+        "relationships": [],
+        # Recreated relationships still get their old ids back, so that a restored slide matches a fresh one
+        "recreated": {},
+    }
+    for relationship in slide.part.rels.values():
+        if relationship.reltype in RECREATED_RELATIONSHIPS:
+            captured["recreated"][relationship.reltype] = relationship.rId
+            continue
+        if relationship.is_external:
+            captured["relationships"].append({"rId": relationship.rId, "reltype": relationship.reltype,
+                                              "external": relationship.target_ref})
+            continue
+        if relationship.reltype != RT.IMAGE and relationship.reltype not in MEDIA_RELATIONSHIPS:
+            # We would not know how to recreate this part, so this slide cannot be cached
+            return None
+        part = relationship.target_part
+        blob_key = content_cache.digest(part.blob)
+        blobs[blob_key] = part.blob
+        captured["relationships"].append({"rId": relationship.rId, "reltype": relationship.reltype,
+                                          "content_type": part.content_type, "extension": part.partname.ext,
+                                          "blob": blob_key})
+    return captured
+
+
+def save(key, presentation, slides, html, transcript, narrated, image_sizes, seen_summary):
+    blobs = {}
+    captured_slides = [capture_slide(presentation, slide, blobs) for slide in slides]
+    if None in captured_slides:
+        return False
+    path = content_cache.entry_path(NAMESPACE, key)
+    if os.path.exists(path):
+        return True
+    # Build the entry off to the side, so that nobody ever sees half of it
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    os.makedirs(temporary_path, exist_ok=True)
+    for blob_key, blob in blobs.items():
+        with open(os.path.join(temporary_path, blob_key), "wb") as blob_file:
+            blob_file.write(blob)
+    with open(os.path.join(temporary_path, "manifest.json"), "w", encoding="utf-8") as manifest_file:
+        json.dump({"slides": captured_slides, "html": html, "transcript": transcript,
+                   "narrated": narrated, "image_sizes": image_sizes, "seen_summary": seen_summary}, manifest_file)
+    try:
+        os.rename(temporary_path, path)
+    except OSError:
+        # Another bake cached the same slide first
+        shutil.rmtree(temporary_path, ignore_errors=True)
+    return True
+
+
+def restore_slide(presentation, captured, path):
+    slide = presentation.slides.add_slide(presentation.slide_layouts[captured["layout"]])
+    renamed = {}
+    for relationship in captured["relationships"]:
+        if "external" in relationship:
+            renamed[relationship["rId"]] = slide.part.relate_to(relationship["external"], relationship["reltype"],
+                                                                is_external=True)
+            continue
+        blob_path = os.path.join(path, relationship["blob"])
+        if relationship["reltype"] == RT.IMAGE:
+            # Given as an open file, the image stays in the cache until the deck is saved
+            with open(blob_path, "rb") as blob_file:
+                _, renamed[relationship["rId"]] = slide.part.get_or_add_image_part(blob_file)
+        else:
+            with open(blob_path, "rb") as blob_file:
+                blob = blob_file.read()
+            media = Video.from_blob(blob, relationship["content_type"], "media." + relationship["extension"])
+            media_part = slide.part.package.get_or_add_media_part(media)
+            renamed[relationship["rId"]] = slide.part.relate_to(media_part, relationship["reltype"])
+    cached = parse_xml(captured["xml"])
+    # Swap the freshly laid-out contents for the cached ones
+    for child in list(slide._element):
+        slide._element.remove(child)
+    for child in list(cached):
+        slide._element.append(child)
+    # python-pptx keeps hold of the shape tree it laid out, which is gone now, so narration added later must
+    # see the cached one
+    for name in ["shapes", "placeholders"]:
+        slide.__dict__.pop(name, None)
+    if captured["notes"] is not None:
+        slide.notes_slide.notes_text_frame.text = captured["notes"]
+    for relationship in slide.part.rels.values():
+        if relationship.reltype in captured["recreated"]:
+            renamed[captured["recreated"][relationship.reltype]] = relationship.rId
+    keep_relationship_ids(slide, renamed)
+    return slide
+
+
+def keep_relationship_ids(slide, renamed):
+    """
+    Gives each of the slide's relationships back the id it had when the slide was captured, given the ids it
+    has now, so that the cached XML can keep referring to them as it did.
+    """
+    relationships = slide.part.rels
+    moved = {original: relationships.pop(current) for original, current in renamed.items()}
+    for original, relationship in moved.items():
+        relationships._rels[original] = _Relationship(relationship._base_uri, original, relationship.reltype,
+                                                      relationship._target_mode, relationship._target)
+
+
+def restore(cached, presentation):
+    return [restore_slide(presentation, captured, cached["path"]) for captured in cached["slides"]]
@@ -0,0 +1,36 @@
+"""
+Keeps each PowerPoint template in memory, so that a process baking many decks (a batch worker, watch mode, or the
+build service) only reads the template from disk once.
+
+Every deck gets a presentation opened afresh from the template's bytes. A deepcopy of a parsed presentation would be
+quicker, but it is not safe in general: python-pptx holds on to elements inside a part's tree, and lxml copies each
+of those as a tree of its own, so the copy's objects stop pointing into the copy's XML. Copying a deck that has
+already been worked on (see `copy_presentation`) goes through bytes for the same reason. The template is read
+again whenever the file's size or mtime changes.
+"""
+import io
+import os
+
+from pptx import Presentation
+
+_templates = {}
+
+
+def load_template(path):
+    """ Returns a fresh presentation made from the template, that the caller is free to change. """
+    stats = os.stat(path)
+    signature = (stats.st_mtime_ns, stats.st_size)
+    key = os.path.abspath(path)
+    cached = _templates.get(key)
+    if cached is None or cached[0] != signature:
+        with open(path, "rb") as template_file:
+            cached = _templates[key] = (signature, template_file.read())
+    return Presentation(io.BytesIO(cached[1]))
+
+
+def copy_presentation(presentation):
+    """ Returns an independent copy of the presentation, by saving it and opening the result. """
+    stream = io.BytesIO()
+    presentation.save(stream)
+    stream.seek(0)
+    return Presentation(stream)
@@ -0,0 +1,43 @@
+import os
+import sys
+import threading
+
+import pytest
+
+# The modules live at the top of the repository, next to this folder
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+LESSON = """# Adding numbers
+
+Python adds numbers with a plus sign.
+
+# Subtracting numbers
+
+And it takes them away with a minus sign.
+"""
+
+
+@pytest.fixture(autouse=True)
+def fresh_databases(monkeypatch):
+    # Connections and unflushed uses are kept for the whole process, but every test runs in a folder of its own
+    import dub_index
+    import usage
+    monkeypatch.setattr(dub_index, "_connections", threading.local())
+    monkeypatch.setattr(usage, "_pending", [])
+    monkeypatch.setattr(usage, "_prepared", set())
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    # The voices, caches and databases are all found relative to where the bake runs
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def lesson_folder(workspace):
+    """ A workspace to bake lesson_read.md in, into out/lesson, with the templates in place. """
+    (workspace / "templates").symlink_to(os.path.join(REPOSITORY, "templates"))
+    (workspace / "lesson_read.md").write_text(LESSON, encoding="utf-8")
+    (workspace / "out").mkdir()
+    return workspace
@@ -0,0 +1,31 @@
+import argparse
+import os
+
+import pytest
+
+import bake_mark
+import polly
+from test_polly import FakePolly
+
+
+def test_mp4s_are_made_at_full_quality_whatever_the_wmv(lesson_folder, monkeypatch):
+    monkeypatch.setattr(polly, "make_client", FakePolly)
+    exported = {}
+
+    def export_video(ppt_src, video_target, engine, **options):
+        exported[os.path.splitext(video_target)[1]] = options
+        with open(video_target, "wb"):
+            pass
+    monkeypatch.setattr(bake_mark, "export_video", export_video)
+    list(bake_mark.bake_markdown("lesson_read.md", os.path.join("out", "lesson"), "graphics", True, "Amy", "low",
+                                 False, False, False, True, crf=30))
+    assert exported[".wmv"] == {"quality": 40, "resolution": 720}
+    assert exported[".mp4"] == dict(bake_mark.MP4_OPTIONS, preset=bake_mark.DEFAULT_H264_PRESET, crf=30)
+
+
+def test_crf_has_to_be_in_range():
+    assert bake_mark.h264_crf("0") == 0
+    assert bake_mark.h264_crf("51") == 51
+    for value in ["-1", "52"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            bake_mark.h264_crf(value)
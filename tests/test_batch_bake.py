@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import bake_mark
+import batch_bake
+
+
+@pytest.fixture
+def course(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name in ["one_read.md", "two_read.md", os.path.join("week2", "three_read.md"), "notes.md"]:
+        path = tmp_path / "course" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("# A slide\n", encoding="utf-8")
+    return tmp_path / "course"
+
+
+def test_plan_finds_lessons_and_catches_clashing_outputs(course, tmp_path):
+    plan = batch_bake.plan_decks(str(course), str(tmp_path / "out"))
+    assert [os.path.relpath(input_path, course) for input_path, _ in plan] == [
+        "one_read.md", "two_read.md", os.path.join("week2", "three_read.md")]
+    (course / "week2" / "one_read.md").write_text("# Another slide\n", encoding="utf-8")
+    with pytest.raises(Exception, match="would be baked into"):
+        batch_bake.plan_decks(str(course), str(tmp_path / "out"))
+
+
+def test_a_dead_worker_fails_its_deck_instead_of_the_batch(course, tmp_path, monkeypatch, capsys):
+    def bake_markdown(input_path, output_path, **options):
+        if input_path.endswith("two_read.md"):
+            # Like a worker killed for running out of memory, with no chance to report anything
+            os._exit(1)
+        yield "Finished powerpoint"
+    monkeypatch.setattr(bake_mark, "bake_markdown", bake_markdown)
+    results = batch_bake.bake_batch(str(course), str(tmp_path / "out"), "graphics", False, "Amy", "none", False,
+                                    False, False, False, jobs=2)
+    assert len(results) == 3
+    failed = {os.path.basename(result["input"]): result for result in results if not result["ok"]}
+    assert "BrokenProcessPool" in failed["two_read.md"]["error"]
+    assert "Baked" in capsys.readouterr().out
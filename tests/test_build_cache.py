@@ -0,0 +1,70 @@
+import os
+
+import bake_mark
+import build_cache
+import content_cache
+import polly
+from test_polly import CLIP, FakePolly
+
+TEMPLATE = os.path.join("templates", "empty_presentation.pptx")
+
+
+def key(clips=(), narrate=True):
+    return build_cache.build_key("# A slide\n", [], TEMPLATE, "Amy", clips, narrate=narrate, wmv="none")
+
+
+def test_key_covers_narration_and_its_clips(lesson_folder):
+    clip = lesson_folder / "clip.mp3"
+    assert key(narrate=True) != key(narrate=False)
+    missing = key([str(clip)])
+    clip.write_bytes(CLIP)
+    voiced = key([str(clip)])
+    assert voiced != missing
+    clip.write_bytes(CLIP[:-104])
+    assert key([str(clip)]) != voiced
+
+
+def test_key_covers_the_pipeline_code(lesson_folder, monkeypatch):
+    before = key()
+    file_digest = content_cache.file_digest
+
+    def exporter_changed(path):
+        return "changed" if os.path.basename(path) == "video_export.py" else file_digest(path)
+    monkeypatch.setattr(content_cache, "file_digest", exporter_changed)
+    assert key() != before
+
+
+def test_restore_puts_missing_and_changed_outputs_back(lesson_folder):
+    output = str(lesson_folder / "out" / "lesson")
+    assert build_cache.restore("abc123", output) is None
+    for suffix, contents in [(".html", "<p>Hi</p>"), ("-Amy.vtt", "WEBVTT")]:
+        with open(output + suffix, "w", encoding="utf-8") as output_file:
+            output_file.write(contents)
+    build_cache.store("abc123", output, [".html", "-Amy.vtt"])
+    os.remove(output + ".html")
+    with open(output + "-Amy.vtt", "w", encoding="utf-8") as output_file:
+        output_file.write("edited")
+    assert build_cache.restore("abc123", output) == [output + ".html", output + "-Amy.vtt"]
+    with open(output + ".html", encoding="utf-8") as output_file:
+        assert output_file.read() == "<p>Hi</p>"
+    with open(output + "-Amy.vtt", encoding="utf-8") as output_file:
+        assert output_file.read() == "WEBVTT"
+
+
+def bake(narrate):
+    return list(bake_mark.bake_markdown("lesson_read.md", os.path.join("out", "lesson"), "graphics", narrate, "Amy",
+                                        "none", False, False, False, False))
+
+
+def test_new_clips_are_never_skipped_as_cached(lesson_folder, monkeypatch):
+    client = FakePolly()
+    monkeypatch.setattr(polly, "make_client", lambda: client)
+    assert not any(message.startswith("Skipping") for message in bake(narrate=True))
+    assert any(message.startswith("Skipping") for message in bake(narrate=True))
+    # The same clips, without asking for narration, is still a different build
+    assert not any(message.startswith("Skipping") for message in bake(narrate=False))
+    # Voicing a clip again has to make it into the deck
+    clip = polly.speech_path(bake_mark.lesson_narration("lesson_read.md")[0], "Amy")
+    with open(clip, "wb") as clip_file:
+        clip_file.write(CLIP[:-104])
+    assert not any(message.startswith("Skipping") for message in bake(narrate=True))
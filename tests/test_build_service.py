@@ -0,0 +1,75 @@
+import io
+import json
+from concurrent.futures import Future
+from wsgiref.util import setup_testing_defaults
+
+import pytest
+from bottle import HTTPError
+
+import build_service
+
+
+class FakePool:
+    """ Takes jobs like the worker pool would, but leaves them for the test to finish. """
+    def __init__(self):
+        self.futures = []
+
+    def submit(self, *arguments):
+        self.futures.append(Future())
+        return self.futures[-1]
+
+
+@pytest.fixture
+def lesson(workspace, monkeypatch):
+    monkeypatch.setattr(build_service, "jobs", {})
+    monkeypatch.setattr(build_service, "_pool", FakePool())
+    path = workspace / "lesson_read.md"
+    path.write_text("# A slide\n", encoding="utf-8")
+    return str(path)
+
+
+def post(body):
+    data = json.dumps(body).encode("utf-8")
+    environ = {}
+    setup_testing_defaults(environ)
+    environ.update({"REQUEST_METHOD": "POST", "PATH_INFO": "/jobs", "CONTENT_TYPE": "application/json",
+                    "CONTENT_LENGTH": str(len(data)), "wsgi.input": io.BytesIO(data)})
+    statuses = []
+    body = b"".join(build_service.app(environ, lambda status, headers, exc_info=None: statuses.append(status)))
+    return int(statuses[0].split()[0]), json.loads(body)
+
+
+def test_jobs_get_their_defaults(lesson):
+    job = build_service.normalize_request({"input": lesson, "crf": 20})
+    assert (job["voice"], job["wmv"], job["html"], job["crf"], job["engine"]) == (["Amy"], "none", True, 20, None)
+    options = build_service.bake_options(job)
+    assert options["voice"] == ["Amy"] and "engine" not in options and "preset" not in options
+
+
+@pytest.mark.parametrize("options", [{"colour": "red"}, {"crf": True}, {"crf": 52}, {"engine": "vlc"},
+                                     {"preset": "fastest"}, {"wmv": "medium"}, {"voice": "Zed"}, {"voice": []},
+                                     {"voice": ["Amy", "Amy"]}, {"narrate": "yes"}])
+def test_bad_jobs_are_turned_away(lesson, options):
+    with pytest.raises(HTTPError) as error:
+        build_service.normalize_request(dict(options, input=lesson))
+    assert error.value.status_code == 400
+
+
+def test_a_job_already_waiting_is_not_baked_twice(lesson):
+    status, first = post({"input": lesson, "voice": "Amy"})
+    assert (status, first["status"], first["deduplicated"]) == (202, "queued", False)
+    status, again = post({"input": lesson, "voice": ["Amy"]})
+    assert (status, again["id"], again["deduplicated"]) == (200, first["id"], True)
+    status, other = post({"input": lesson, "voice": ["Amy", "Bart"]})
+    assert (status, other["deduplicated"]) == (202, False)
+    assert len(build_service._pool.futures) == 2
+
+
+def test_a_worker_that_dies_fails_its_job(lesson):
+    _, job = post({"input": lesson})
+    build_service._pool.futures[0].set_exception(RuntimeError("worker was killed"))
+    assert build_service.jobs[job["id"]]["status"] == "failed"
+    assert "worker was killed" in build_service.jobs[job["id"]]["error"]
+    # A finished job no longer holds up an identical new one
+    _, again = post({"input": lesson})
+    assert again["deduplicated"] is False
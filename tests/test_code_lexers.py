@@ -0,0 +1,26 @@
+from code_lexers import classify, resolve_lexer
+
+
+def test_the_deck_language_beats_the_patterns():
+    kotlin = "import kotlin.math.sqrt\n\nif (x > 0) {\n    print(sqrt(x))\n}\n"
+    assert resolve_lexer(kotlin, None, "kotlin").name == "Kotlin"
+    # The "else:" line would pass for Python, if the deck had not said otherwise
+    ruby = "if ready?\n  print(\"go\")\nelse:\nend\n"
+    assert classify(ruby) == "python"
+    assert resolve_lexer(ruby, None, "ruby").name == "Ruby"
+    assert resolve_lexer(ruby, "python", "ruby").name == "Python"
+
+
+def test_python_needs_a_statement_only_python_writes():
+    assert classify("from math import sqrt\nprint(sqrt(2))") == "python"
+    assert classify("def area(radius) -> float:\n    return 3.14 * radius ** 2") == "python"
+    assert classify("for name, age in people.items():  # everyone\n    pass") == "python"
+    assert classify("import kotlin.math.sqrt\nprint(sqrt(2.0))") is None
+    assert classify("if (ready) { go(); }") is None
+    assert classify("console.log(a ? b : c);") is None
+
+
+def test_other_patterns():
+    assert classify(">>> 1 + 1\n2") == "pycon"
+    assert classify("$ pip install pptx") == "console"
+    assert classify('{"name": "Amy"}') == "json"
@@ -0,0 +1,43 @@
+import os
+import time
+
+import content_cache
+
+
+def make_entry(namespace, key, size, days_old):
+    path = content_cache.entry_path(namespace, key)
+    os.makedirs(path)
+    with open(os.path.join(path, "blob"), "wb") as blob_file:
+        blob_file.write(bytes(size))
+    last_used = time.time() - days_old * 24 * 60 * 60
+    os.utime(path, (last_used, last_used))
+    return path
+
+
+def test_digests_keep_their_parts_apart():
+    assert content_cache.digest("ab", "c") != content_cache.digest("a", "bc")
+    assert content_cache.digest("abc") == content_cache.digest(b"abc")
+
+
+def test_file_digests_follow_the_file(workspace):
+    path = workspace / "image.png"
+    path.write_bytes(b"one")
+    first = content_cache.file_digest(str(path))
+    path.write_bytes(b"three")
+    assert content_cache.file_digest(str(path)) != first
+
+
+def test_prune_evicts_stale_entries_then_the_least_recently_used(workspace):
+    stale = make_entry("slides", "aa1", 10, days_old=100)
+    older = make_entry("slides", "bb2", 600, days_old=5)
+    newer = make_entry("builds", "cc3", 600, days_old=1)
+    assert content_cache.prune(max_bytes=1000, max_age_days=90, dry_run=True) == [(stale, 10), (older, 600)]
+    assert os.path.exists(stale)
+    content_cache.prune(max_bytes=1000, max_age_days=90)
+    assert [path for _, path, _, _ in content_cache.entries()] == [newer]
+
+
+def test_sizes():
+    assert content_cache.parse_size("20GB") == 20 * 1024 ** 3
+    assert content_cache.parse_size("1.5mb") == 1.5 * 1024 ** 2
+    assert content_cache.format_size(1536) == "1.5KB"
@@ -0,0 +1,43 @@
+import json
+import threading
+
+import dub_index
+
+INFO = {"duration": 1.5, "sample_rate": 24000, "frames": 57, "valid": True}
+
+
+def test_the_old_json_index_is_imported_once(workspace):
+    (workspace / "data").mkdir()
+    (workspace / "data" / "dubs.json").write_text(json.dumps({"speech1": "Hello."}), encoding="utf-8")
+    assert dub_index.get_dub_text("speech1") == "Hello."
+    dub_index.forget_dubs(["speech1"])
+    # Opening the database again must not bring the forgotten entry back
+    dub_index._connections.by_key.clear()
+    assert dub_index.get_dub_text("speech1") is None
+
+
+def test_entries_are_added_and_updated(workspace):
+    dub_index.add_dub_entry("speech2", "Hi.")
+    dub_index.add_dub_entry("speech2", "Hi there.")
+    assert dub_index.get_dub_text("speech2") == "Hi there."
+    assert dub_index.export_json() == 1
+    assert json.loads((workspace / "data" / "dubs.json").read_text(encoding="utf-8")) == {"speech2": "Hi there."}
+
+
+def test_clip_info_is_only_trusted_while_the_clip_is_unchanged(workspace):
+    dub_index.put_clip("Amy", "speech3", 1000, 111, INFO)
+    assert dub_index.get_clip("Amy", "speech3", 1000, 111) == INFO
+    assert dub_index.get_clip("Amy", "speech3", 1000, 222) is None
+    assert dub_index.get_clip("Bart", "speech3", 1000, 111) is None
+    dub_index.forget_clips([("Amy", "speech3")])
+    assert dub_index.indexed_clips() == []
+
+
+def test_threads_can_write_at_the_same_time(workspace):
+    threads = [threading.Thread(target=dub_index.add_dub_entry, args=(f"speech{index}", f"Line {index}."))
+               for index in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert dub_index.dub_hashes() == {f"speech{index}" for index in range(20)}
@@ -0,0 +1,39 @@
+from make_subtitles import NARRATION_DELAY, SLIDE_DELAY, make_captions, marked_cues
+
+
+def fake_marks(text, timings):
+    """ Speech marks like Polly's for each (word, milliseconds) pair, with offsets in bytes of the UTF-8 text. """
+    encoded = text.encode("utf-8")
+    marks, offset = [], 0
+    for word, time in timings:
+        start = encoded.index(word.encode("utf-8"), offset)
+        offset = start + len(word.encode("utf-8"))
+        marks.append({"time": time, "type": "word", "start": start, "end": offset, "value": word})
+    return marks
+
+
+def test_cues_start_when_their_first_word_is_spoken():
+    text = "Hello there. How are you today?"
+    marks = fake_marks(text, [("Hello", 50), ("there", 400), ("How", 1300), ("are", 1500), ("you", 1650),
+                              ("today", 1800)])
+    cues = marked_cues(text, ["Hello there.", "How are you today?"], marks, 2.0, 6.0)
+    assert cues == [(2.05, 3.3, "Hello there."), (3.3, 6.0, "How are you today?")]
+
+
+def test_cues_find_words_by_their_byte_offsets():
+    # Every "é" takes two bytes, which moves the second sentence's marks along in bytes but not in characters
+    text = "Café crème. Come in."
+    marks = fake_marks(text, [("Café", 0), ("crème", 300), ("Come", 1200), ("in", 1400)])
+    cues = marked_cues(text, ["Café crème.", "Come in."], marks, 0.0, 3.0)
+    assert [cue_start for cue_start, _, _ in cues] == [0.0, 1.2]
+
+
+def test_captions_follow_the_marks_of_each_slide():
+    transcript = ["Hello there. How are you today?", "Goodbye."]
+    marks = [fake_marks(transcript[0], [("Hello", 0), ("How", 1500)]), None]
+    captions = list(make_captions(transcript, [5, 3], marks))
+    slide_start = SLIDE_DELAY + NARRATION_DELAY
+    assert captions[1:5] == [f"00:0{slide_start}.000 --> 00:0{slide_start + 1}.500", "Hello there.\n",
+                             f"00:0{slide_start + 1}.500 --> 00:06.000", "How are you today?\n"]
+    # The slide without marks still shares out its time by sentence length, after the first slide and a transition
+    assert captions[5] == "00:07.000 --> 00:11.000"
@@ -0,0 +1,56 @@
+import pytest
+
+import mp3_frames
+import polly
+from test_polly import CLIP
+
+# MPEG-1 Layer III, 32kbps, mono: 104 byte frames of 1152 samples, at 44.1kHz or (with 0x14) 48kHz
+FRAME = bytes([0xFF, 0xFB, 0x10, 0xC0]) + bytes(100)
+FRAME_48K = bytes([0xFF, 0xFB, 0x14, 0xC0]) + bytes(92)
+ID3V2 = b"ID3\x04\x00\x00\x00\x00\x00\x05" + bytes(5)
+ID3V1 = b"TAG" + bytes(125)
+
+
+def test_scanning_reads_the_frames():
+    info = mp3_frames.scan_bytes(FRAME * 10)
+    assert info == {"duration": 10 * 1152 / 44100, "sample_rate": 44100, "frames": 10, "valid": True}
+
+
+def test_tags_and_info_frames_are_not_audio():
+    info_frame = FRAME[:4 + 17] + b"Info" + FRAME[4 + 17 + 4:]
+    info = mp3_frames.scan_bytes(ID3V2 + info_frame + FRAME * 10 + ID3V1)
+    assert (info["frames"], info["valid"]) == (10, True)
+
+
+@pytest.mark.parametrize("broken", [FRAME * 10 + FRAME[:50], FRAME * 10 + b"garbage", FRAME * 5 + FRAME_48K * 5,
+                                    b"", ID3V2])
+def test_broken_clips_are_invalid(broken):
+    assert not mp3_frames.scan_bytes(broken)["valid"]
+
+
+def test_joining_keeps_every_frame_and_drops_the_tags():
+    joined = mp3_frames.join([ID3V2 + FRAME * 3, CLIP + ID3V1])
+    assert joined == FRAME * 3 + CLIP
+    assert mp3_frames.scan_bytes(joined)["frames"] == 3 + len(CLIP) // len(FRAME)
+
+
+def test_only_intact_clips_of_one_format_can_be_joined():
+    with pytest.raises(ValueError):
+        mp3_frames.join([FRAME * 3, FRAME * 3 + FRAME[:50]])
+    with pytest.raises(ValueError):
+        mp3_frames.join([FRAME * 3, FRAME_48K * 3])
+
+
+def test_clip_info_is_scanned_once_until_the_clip_changes(workspace, monkeypatch):
+    path = workspace / "voices" / "Amy" / "speech1.mp3"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(FRAME * 10)
+    scans = []
+    scan = mp3_frames.scan
+    monkeypatch.setattr(mp3_frames, "scan", lambda clip: scans.append(clip) or scan(clip))
+    assert polly.clip_info(str(path))["frames"] == 10
+    assert polly.clip_info(str(path))["frames"] == 10
+    assert len(scans) == 1
+    path.write_bytes(FRAME * 12)
+    assert polly.clip_info(str(path))["frames"] == 12
+    assert len(scans) == 2
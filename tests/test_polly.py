@@ -0,0 +1,108 @@
+import io
+import json
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+import polly
+
+# One silent MPEG-1 Layer III frame, repeated into a clip about a second long
+CLIP = (bytes([0xFF, 0xFB, 0x10, 0xC0]) + bytes(100)) * 38
+MARKS = [{"time": 0, "type": "sentence", "start": 0, "end": 12, "value": "Hello there."},
+         {"time": 0, "type": "word", "start": 0, "end": 5, "value": "Hello"}]
+
+
+class FakePolly:
+    """ Stands in for boto3's Polly client, remembering every request it gets and throttling the first few. """
+    def __init__(self, throttled=0):
+        self.calls = []
+        self.throttled = throttled
+
+    def synthesize_speech(self, **request):
+        self.calls.append(request)
+        if len(self.calls) <= self.throttled:
+            raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}},
+                              "SynthesizeSpeech")
+        if request["OutputFormat"] == "json":
+            return {"AudioStream": io.BytesIO("\n".join(json.dumps(mark) for mark in MARKS).encode("utf-8"))}
+        return {"AudioStream": io.BytesIO(CLIP)}
+
+
+def test_prefetch_voices_missing_clips(workspace):
+    client = FakePolly()
+    created = polly.prefetch(["Hello there."], "Amy", client=client)
+    path = polly.speech_path("Hello there.", "Amy")
+    assert created == [path]
+    assert [(call["Text"], call["OutputFormat"], call["VoiceId"]) for call in client.calls] == [
+        ("Hello there.", "mp3", "Amy"), ("Hello there.", "json", "Amy")]
+    assert client.calls[1]["SpeechMarkTypes"] == polly.SPEECH_MARK_TYPES
+    with open(path, "rb") as clip_file:
+        assert clip_file.read() == CLIP
+    assert polly.load_speech_marks("Hello there.", "Amy") == MARKS
+    assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith(".part")]
+
+
+def test_cached_clips_need_no_requests(workspace, monkeypatch):
+    client = FakePolly()
+    polly.prefetch(["Hello there."], "Amy", client=client)
+    client.calls.clear()
+    assert polly.prefetch(["Hello there."], "Amy", client=client) == []
+    assert client.calls == []
+
+    def no_client():
+        raise AssertionError("A cached clip should not need Polly")
+    monkeypatch.setattr(polly, "make_client", no_client)
+    assert polly.speech("Hello there.", "Amy", label="lesson") == polly.speech_path("Hello there.", "Amy")
+
+
+def test_existing_clip_only_gets_its_marks(workspace):
+    text = "Hello there. How are you?"
+    path = polly.speech_path(text, "Amy")
+    os.makedirs(os.path.dirname(path))
+    # A frame shorter than anything the fake voices, so that voicing it again would show
+    with open(path, "wb") as clip_file:
+        clip_file.write(CLIP[:-104])
+    client = FakePolly()
+    assert polly.prefetch([text], "Amy", client=client) == [path]
+    assert [(call["Text"], call["OutputFormat"]) for call in client.calls] == [(text, "json")]
+    with open(path, "rb") as clip_file:
+        assert clip_file.read() == CLIP[:-104]
+    assert polly.load_speech_marks(text, "Amy") == MARKS
+
+
+def test_long_narration_is_voiced_in_chunks_and_stitched(workspace, monkeypatch):
+    monkeypatch.setattr(polly, "MAX_CHUNK_CHARACTERS", 30)
+    assert polly.chunk_spans("Short enough. For one go.") == [(0, 25)]
+    text = "Hello there. How are you today? Hello there."
+    assert polly.chunk_spans(text) == [(0, 12), (13, 31), (32, 44)]
+    client = FakePolly()
+    polly.prefetch([text], "Amy", client=client)
+    # The repeated sentence is only voiced once
+    assert sorted(call["Text"] for call in client.calls) == sorted(["Hello there.", "How are you today?"] * 2)
+    with open(polly.speech_path(text, "Amy"), "rb") as clip_file:
+        assert clip_file.read() == CLIP * 3
+    chunk_duration = polly.mp3_frames.scan_bytes(CLIP)["duration"] * 1000
+    marks = polly.load_speech_marks(text, "Amy")
+    assert [(mark["time"], mark["start"]) for mark in marks if mark["type"] == "sentence"] == [
+        (0, 0), (round(chunk_duration), 13), (round(2 * chunk_duration), 32)]
+    # After an edit, only the sentence that changed needs voicing
+    client.calls.clear()
+    polly.prefetch(["Hello there. How are you doing? Hello there."], "Amy", client=client)
+    assert sorted(call["Text"] for call in client.calls) == ["How are you doing?"] * 2
+
+
+def test_every_voice_is_prefetched(workspace):
+    client = FakePolly()
+    created = polly.prefetch_voices(["Hello there.", "Goodbye."], ["Amy", "Bart"], client=client)
+    assert sorted(created) == sorted(polly.speech_path(text, voice) for text in ["Hello there.", "Goodbye."]
+                                     for voice in ["Amy", "Bart"])
+    assert len(client.calls) == 8
+
+
+def test_throttled_requests_are_retried(workspace, monkeypatch):
+    monkeypatch.setattr(polly.time, "sleep", lambda seconds: None)
+    client = FakePolly(throttled=2)
+    assert polly.prefetch(["Hello there."], "Amy", client=client) == [polly.speech_path("Hello there.", "Amy")]
+    with pytest.raises(polly.SynthesisError, match="Rate exceeded"):
+        polly.prefetch(["Goodbye."], "Amy", client=FakePolly(throttled=polly.PREFETCH_RETRIES + 1))
@@ -0,0 +1,55 @@
+import os
+import zipfile
+
+import marko
+
+import bake_mark
+import polly
+import slide_cache
+import timings
+from test_polly import FakePolly
+
+TEMPLATE = os.path.join("templates", "empty_presentation.pptx")
+
+
+def parse(markdown):
+    converter = marko.Markdown()
+    converter.use(bake_mark.PPTXRenderExtension)
+    return converter.parse(markdown).children
+
+
+def test_slides_split_at_headings_until_the_summary(lesson_folder):
+    elements = parse("Intro\n\n# One\n\nText\n\n# Two\n\n# Summary\n\nRecap\n\n# After\n")
+    groups = slide_cache.split_slides(elements, lambda heading: heading.children[0].children == "Summary")
+    assert [[element.get_type() for element in group if element.get_type() != "BlankLine"] for group in groups] == [
+        ["Paragraph"], ["Heading", "Paragraph"], ["Heading", "Heading", "Paragraph", "Heading"]]
+
+
+def test_keys_cover_images_language_and_html(lesson_folder):
+    (lesson_folder / "graphics").mkdir()
+    image = lesson_folder / "graphics" / "chart.png"
+    image.write_bytes(b"first")
+    elements = parse("# Chart\n\n![chart](chart.png)\n")
+    key = slide_cache.slide_key(elements, "graphics", TEMPLATE)
+    assert slide_cache.slide_key(elements, "graphics", TEMPLATE) == key
+    assert slide_cache.slide_key(elements, "graphics", TEMPLATE, "python") != key
+    assert slide_cache.slide_key(elements, "graphics", TEMPLATE, html=False) != key
+    image.write_bytes(b"second")
+    assert slide_cache.slide_key(elements, "graphics", TEMPLATE) != key
+
+
+def bake_parts():
+    list(bake_mark.bake_markdown("lesson_read.md", os.path.join("out", "lesson"), "graphics", True, "Amy", "none",
+                                 True, False, False, False))
+    with zipfile.ZipFile(os.path.join("out", "lesson-Amy.pptx")) as deck:
+        return {name: deck.read(name) for name in deck.namelist()}
+
+
+def test_restored_slides_match_freshly_rendered_ones(lesson_folder, monkeypatch):
+    monkeypatch.setattr(polly, "make_client", FakePolly)
+    cold = bake_parts()
+    assert timings.totals()["render slide"]["calls"] == 2
+    warm = bake_parts()
+    assert "render slide" not in timings.totals()
+    assert timings.totals()["restore slide"]["calls"] == 2
+    assert warm == cold
@@ -0,0 +1,36 @@
+import os
+import shutil
+
+from pptx.util import Inches
+
+import template_cache
+from conftest import REPOSITORY
+
+TEMPLATE = os.path.join(REPOSITORY, "templates", "empty_presentation.pptx")
+
+
+def test_every_deck_gets_a_presentation_of_its_own():
+    first = template_cache.load_template(TEMPLATE)
+    first.slides.add_slide(first.slide_layouts[0])
+    assert len(template_cache.load_template(TEMPLATE).slides) == len(first.slides) - 1
+
+
+def test_a_changed_template_is_read_again(tmp_path):
+    path = str(tmp_path / "template.pptx")
+    shutil.copyfile(TEMPLATE, path)
+    before = len(template_cache.load_template(path).slides)
+    deck = template_cache.load_template(path)
+    deck.slides.add_slide(deck.slide_layouts[0])
+    deck.save(path)
+    assert len(template_cache.load_template(path).slides) == before + 1
+
+
+def test_copies_of_a_worked_on_deck_can_still_be_changed():
+    deck = template_cache.load_template(TEMPLATE)
+    slide = deck.slides.add_slide(deck.slide_layouts[0])
+    slide.shapes.add_textbox(Inches(1), Inches(1), Inches(2), Inches(1)).text_frame.text = "Original"
+    copy = template_cache.copy_presentation(deck)
+    copied_slide = copy.slides[len(copy.slides) - 1]
+    copied_slide.shapes.add_textbox(Inches(1), Inches(2), Inches(2), Inches(1)).text_frame.text = "Copy"
+    assert len(copied_slide.shapes) == len(slide.shapes) + 1
+    assert "Copy" in [shape.text_frame.text for shape in copied_slide.shapes if shape.has_text_frame]
@@ -0,0 +1,25 @@
+import pytest
+
+import bake_mark
+import usage
+
+
+def test_uses_are_only_written_when_flushed(workspace):
+    usage.record("lesson_read.md", "speech123")
+    assert usage.decks_using("speech123") == []
+    assert usage.flush() == 1
+    [(label, uses, _, _)] = usage.decks_using("speech123")
+    assert (label, uses) == ("lesson_read.md", 1)
+    assert usage.flush() == 0
+
+
+def test_a_failed_bake_still_flushes_its_uses(workspace, monkeypatch):
+    def bake_lesson(*arguments):
+        usage.record("lesson_read.md", "speech456")
+        raise IOError("ffmpeg went away")
+        yield
+    monkeypatch.setattr(bake_mark, "bake_lesson", bake_lesson)
+    with pytest.raises(IOError):
+        list(bake_mark.bake_markdown("lesson_read.md", "lesson", "graphics", True, "Amy", "none", False, False,
+                                     False, False))
+    assert [label for label, _, _, _ in usage.decks_using("speech456")] == ["lesson_read.md"]
@@ -0,0 +1,52 @@
+import io
+import re
+import subprocess
+
+from PIL import Image
+
+import video_export
+
+OPTIONS = video_export.encoding_options(".mp4", preset="ultrafast")
+
+
+def still(color):
+    image = io.BytesIO()
+    Image.new("RGB", (64, 36), color).save(image, "PNG")
+    return image.getvalue()
+
+
+def video_duration(path):
+    # ffprobe is not always installed next to ffmpeg, but ffmpeg reports the duration of its input too
+    report = subprocess.run(["ffmpeg", "-hide_banner", "-i", path], capture_output=True, text=True).stderr
+    hours, minutes, seconds = re.search(r"Duration: (\d+):(\d+):([\d.]+)", report).groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def slide(color, duration):
+    return {"image": still(color), "audio": None, "duration": duration, "delay": 0}
+
+
+def test_encoding_options_follow_the_target():
+    assert video_export.encoding_options(".wmv", quality=100)["vcodec"] == "wmv2"
+    assert video_export.encoding_options(".mp4", quality=100)["crf"] == 18
+    assert video_export.encoding_options(".mp4", quality=100, crf=30)["crf"] == 30
+
+
+def test_segment_keys_cover_what_goes_into_the_segment():
+    key = video_export.segment_key(slide("red", 1.0), ".mp4", 24, OPTIONS)
+    assert video_export.segment_key(slide("red", 1.0), ".mp4", 24, OPTIONS) == key
+    assert video_export.segment_key(slide("blue", 1.0), ".mp4", 24, OPTIONS) != key
+    assert video_export.segment_key(slide("red", 2.0), ".mp4", 24, OPTIONS) != key
+    assert video_export.segment_key(slide("red", 1.0), ".mp4", 24, dict(OPTIONS, crf=40)) != key
+
+
+def test_only_new_slides_get_encoded_and_the_video_keeps_their_timeline(workspace):
+    slides = [slide("red", 0.5), slide("blue", 1.0), slide("red", 0.5)]
+    paths, encoded = video_export.encode_segments(slides, ".mp4", 10, OPTIONS)
+    # The same slide twice is only encoded once
+    assert encoded == 2
+    assert paths[0] == paths[2]
+    slides[1] = slide("green", 1.0)
+    assert video_export.encode_segments(slides, ".mp4", 10, OPTIONS)[1] == 1
+    video_export.concatenate_segments(paths, str(workspace / "lesson.mp4"), str(workspace))
+    assert abs(video_duration(str(workspace / "lesson.mp4")) - 2.0) < 0.15
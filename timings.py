@@ -0,0 +1,91 @@
+"""
+Times the stages of a bake, so that a slow build shows where it spends its time.
+
+Each timed stage becomes an event, which can be appended to a JSON-lines file as it happens:
+
+    {"deck": "lesson_read.md", "stage": "render slide", "seconds": 0.0123, "time": 1700000000.0, "images": 1}
+
+and is added into a per-stage total, which `summary_table` lays out at the end of the bake. Any numbers
+given with a stage (like how many clips were synthesized) are added up in the summary as well.
+
+    with timings.stage("narration") as details:
+        details["synthesized"] = len(created)
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+_lock = threading.Lock()
+_totals = {}
+_deck = None
+_events_path = None
+
+
+def begin(deck, events_path=None):
+    """ Starts timing a new bake, forgetting the last one's totals. """
+    global _deck, _events_path
+    with _lock:
+        _totals.clear()
+        _deck, _events_path = deck, events_path
+
+
+def record(name, seconds, **details):
+    event = {"deck": _deck, "stage": name, "seconds": round(seconds, 6), "time": time.time(), **details}
+    with _lock:
+        total = _totals.setdefault(name, {"calls": 0, "seconds": 0.0, "details": {}})
+        total["calls"] += 1
+        total["seconds"] += seconds
+        for key, value in details.items():
+            # Flags count how often they were set
+            if isinstance(value, (int, float)):
+                total["details"][key] = total["details"].get(key, 0) + value
+        if _events_path:
+            with open(_events_path, "a", encoding="utf-8") as events_file:
+                events_file.write(json.dumps(event) + "\n")
+
+
+@contextmanager
+def stage(name, **details):
+    """ Times the block as one run of the stage; the block can add details to the dictionary it is given. """
+    start_time_stamp = time.perf_counter()
+    try:
+        yield details
+    finally:
+        record(name, time.perf_counter() - start_time_stamp, **details)
+
+
+def totals():
+    with _lock:
+        return {name: dict(total, details=dict(total["details"])) for name, total in _totals.items()}
+
+
+def combine(bakes):
+    """ Adds up the stage totals of several bakes, like every deck of a batch. """
+    combined = {}
+    for bake in bakes:
+        for name, total in bake.items():
+            into = combined.setdefault(name, {"calls": 0, "seconds": 0.0, "details": {}})
+            into["calls"] += total["calls"]
+            into["seconds"] += total["seconds"]
+            for key, value in total["details"].items():
+                into["details"][key] = into["details"].get(key, 0) + value
+    return combined
+
+
+def summary_table(stage_totals=None):
+    """
+    Lays out the time spent in each stage, in the order the stages first ran; of this bake, unless other
+    totals are given.
+    """
+    rows = [(name, str(total["calls"]), f"{total['seconds']:.3f}",
+             f"{total['seconds'] / total['calls'] * 1000:.1f}",
+             " ".join(f"{key}={value:g}" for key, value in total["details"].items()))
+            for name, total in (totals() if stage_totals is None else stage_totals).items()]
+    header = ("stage", "calls", "total s", "mean ms", "")
+    widths = [max(len(row[column]) for row in rows + [header]) for column in range(4)]
+    lines = []
+    for row in [header] + rows:
+        cells = [row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:4], widths[1:])]
+        lines.append("  ".join(cells + [row[4]]).rstrip())
+    return "\n".join(lines)
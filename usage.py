@@ -0,0 +1,161 @@
+"""
+Keeps track of which decks use which voice clips.
+
+Uses are collected in memory while a deck bakes, and flushed once at the end as plain inserts into an
+append-only log in the dub index database. Compacting folds the log into one summary row per clip and
+deck, so the history stays small no matter how often things are rebaked. The old `used.json` file is
+imported the first time the database is opened.
+
+    python usage.py used-by <clip>
+    python usage.py unused
+    python usage.py compact
+"""
+import atexit
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+import dub_index
+from dub_index import transaction
+from locations import USED_DUBS_FILE_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage_log (
+    hash TEXT NOT NULL,
+    label TEXT NOT NULL,
+    used_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_log_by_hash ON usage_log (hash);
+CREATE TABLE IF NOT EXISTS usage_summary (
+    hash TEXT NOT NULL,
+    label TEXT NOT NULL,
+    uses INTEGER NOT NULL,
+    first_used TEXT NOT NULL,
+    last_used TEXT NOT NULL,
+    PRIMARY KEY (hash, label)
+);
+"""
+
+_pending = []
+_pending_lock = threading.Lock()
+_prepared = set()
+
+
+def connect():
+    connection = dub_index.connect()
+    if id(connection) not in _prepared:
+        connection.executescript(SCHEMA)
+        import_json_usage(connection)
+        _prepared.add(id(connection))
+    return connection
+
+
+def import_json_usage(connection, json_path=USED_DUBS_FILE_PATH):
+    with transaction(connection):
+        already = connection.execute("SELECT 1 FROM imports WHERE source = ?", (json_path,)).fetchone()
+        if already:
+            return 0
+        history = {}
+        if os.path.exists(json_path):
+            with open(json_path) as used_file:
+                history = json.load(used_file)
+        rows = [(hash_name, use["label"], use["when"])
+                for hash_name, uses in history.items()
+                for use in uses]
+        connection.executemany("INSERT INTO usage_log (hash, label, used_at) VALUES (?, ?, ?)", rows)
+        connection.execute("INSERT INTO imports (source, imported_at) VALUES (?, ?)",
+                           (json_path, now()))
+    return len(rows)
+
+
+def now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def record(label, hash_name):
+    """ Remembers that the deck (label) used the clip; nothing is written until `flush` is called. """
+    with _pending_lock:
+        _pending.append((hash_name, label, now()))
+
+
+def flush():
+    with _pending_lock:
+        rows = _pending[:]
+        _pending.clear()
+    if rows:
+        with transaction(connect()) as connection:
+            connection.executemany("INSERT INTO usage_log (hash, label, used_at) VALUES (?, ?, ?)", rows)
+    return len(rows)
+
+
+atexit.register(flush)
+
+
+def compact():
+    """ Folds the append-only log into the summary table, returning how many log rows were folded. """
+    with transaction(connect()) as connection:
+        folded = connection.execute("SELECT COUNT(*) FROM usage_log").fetchone()[0]
+        connection.execute("""
+            INSERT INTO usage_summary (hash, label, uses, first_used, last_used)
+            SELECT hash, label, COUNT(*), MIN(used_at), MAX(used_at) FROM usage_log WHERE true GROUP BY hash, label
+            ON CONFLICT (hash, label) DO UPDATE SET
+                uses = uses + excluded.uses,
+                first_used = MIN(first_used, excluded.first_used),
+                last_used = MAX(last_used, excluded.last_used)
+        """)
+        connection.execute("DELETE FROM usage_log")
+    return folded
+
+
+def decks_using(hash_name):
+    """ Returns (label, uses, first used, last used) for every deck that has used the clip. """
+    return connect().execute(
+        "SELECT label, SUM(uses), MIN(first_used), MAX(last_used) FROM ("
+        "  SELECT label, uses, first_used, last_used FROM usage_summary WHERE hash = ?"
+        "  UNION ALL"
+        "  SELECT label, 1, used_at, used_at FROM usage_log WHERE hash = ?"
+        ") GROUP BY label ORDER BY label", (hash_name, hash_name)).fetchall()
+
+
+def last_uses():
+    """ Returns when each clip was last used by any deck, as {hash: "YYYY-MM-DD HH:MM:SS"}. """
+    return dict(connect().execute(
+        "SELECT hash, MAX(last_used) FROM ("
+        "  SELECT hash, last_used FROM usage_summary"
+        "  UNION ALL"
+        "  SELECT hash, used_at FROM usage_log"
+        ") GROUP BY hash"))
+
+
+def forget(hashes):
+    """ Drops the usage history of clips that no longer exist. """
+    rows = [(hash_name,) for hash_name in hashes]
+    with transaction(connect()) as connection:
+        connection.executemany("DELETE FROM usage_summary WHERE hash = ?", rows)
+        connection.executemany("DELETE FROM usage_log WHERE hash = ?", rows)
+
+
+def unused_clips():
+    """ Returns the hash names of every clip in the dub index that no deck has ever used. """
+    return [row[0] for row in connect().execute(
+        "SELECT hash FROM dubs"
+        " WHERE NOT EXISTS (SELECT 1 FROM usage_summary WHERE usage_summary.hash = dubs.hash)"
+        "   AND NOT EXISTS (SELECT 1 FROM usage_log WHERE usage_log.hash = dubs.hash)"
+        " ORDER BY hash")]
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "used-by" and len(sys.argv) > 2:
+        for label, uses, first_used, last_used in decks_using(sys.argv[2]):
+            print(f"{label}: {uses} uses, from {first_used} to {last_used}")
+    elif command == "unused":
+        for hash_name in unused_clips():
+            print(hash_name)
+    elif command == "compact":
+        print(f"Compacted {compact()} usage records")
+    else:
+        print("Usage: python usage.py used-by <clip> | unused | compact")
+        sys.exit(1)
@@ -0,0 +1,425 @@
+"""
+Exports a baked deck to video without PowerPoint, so that videos can be made on any machine that has ffmpeg.
+
+Each slide is drawn with Pillow (background, shapes, text, code and pictures), and then ffmpeg encodes the frame
+together with the slide's narration clip into a short segment. Slides follow the same timeline as in PowerPoint:
+each one takes its transition's time, then stays up for as long as the renderer set it to advance (which it worked
+out from the durations it recorded), and narration starts after the delay that `autoplay_media` sets up.
+
+Segments are encoded in parallel (each frame is piped straight into its ffmpeg process) and cached by what went
+into them, then joined without encoding them again, so re-exporting a deck after changing one slide only encodes
+that slide. MP4s are made this way directly from the slides, never by transcoding a WMV.
+"""
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import ffmpeg
+from lxml import etree
+from PIL import Image, ImageDraw, ImageFont
+from pptx import Presentation
+from pptx.enum.shapes import MSO_SHAPE_TYPE
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.util import Inches, Pt
+
+import content_cache
+from locations import DEFAULT_H264_PRESET
+
+# Seconds a slide without narration stays up, the same default given to CreateVideo
+DEFAULT_SLIDE_DURATION = 4
+# Seconds before a slide's narration starts, matching the delay in autoplay_media
+NARRATION_DELAY = 1
+AUDIO_SAMPLE_RATE = 44100
+# Bump this whenever segments get encoded differently, so old entries stop matching
+SEGMENT_VERSION = "2"
+SEGMENT_NAMESPACE = "segments"
+SEGMENT_WORKERS = os.cpu_count() or 1
+
+NAMESPACES = {
+    "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
+    "p": "http://schemas.openxmlformats.org/presentationml/2006/main",
+    "mc": "http://schemas.openxmlformats.org/markup-compatibility/2006",
+    "p14": "http://schemas.microsoft.com/office/powerpoint/2010/main",
+}
+FONT_FILES = {
+    (False, False): "DejaVuSans.ttf",
+    (False, True): "DejaVuSans-Bold.ttf",
+    (True, False): "DejaVuSansMono.ttf",
+    (True, True): "DejaVuSansMono-Bold.ttf",
+}
+MONOSPACE_TYPEFACES = {"Courier New", "Courier", "Consolas", "Lucida Console"}
+# Theme colors that slides refer to by their role, rather than by their name in the color scheme
+SCHEME_ALIASES = {"bg1": "lt1", "tx1": "dk1", "bg2": "lt2", "tx2": "dk2"}
+TEXT_INSET = Inches(0.1)
+LINE_HEIGHT = 1.2
+SMALLEST_SHRINK = 0.4
+
+
+def xpath(element, query):
+    return etree.ElementBase.xpath(element, query, namespaces=NAMESPACES)
+
+
+@lru_cache(maxsize=None)
+def load_font(size, monospace=False, bold=False):
+    try:
+        return ImageFont.truetype(FONT_FILES[monospace, bold], size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def hex_to_rgb(value):
+    return tuple(int(value[index:index + 2], 16) for index in (0, 2, 4))
+
+
+class Theme:
+    def __init__(self, master):
+        theme_part = master.part.part_related_by(RT.THEME)
+        scheme = xpath(etree.fromstring(theme_part.blob), "//a:clrScheme")[0]
+        self.colors = {}
+        for entry in scheme:
+            name = etree.QName(entry).localname
+            values = xpath(entry, "./a:srgbClr/@val") or xpath(entry, "./a:sysClr/@lastClr")
+            if values:
+                self.colors[name] = hex_to_rgb(values[0])
+
+    def color(self, fill):
+        """ Resolves a solidFill-like element (or None) into an RGB tuple, or None if it has no color. """
+        if fill is None:
+            return None
+        explicit = xpath(fill, "./a:srgbClr/@val")
+        if explicit:
+            return hex_to_rgb(explicit[0])
+        scheme = xpath(fill, "./a:schemeClr/@val")
+        if scheme:
+            return self.colors.get(SCHEME_ALIASES.get(scheme[0], scheme[0]))
+        return None
+
+
+def find(element, *queries):
+    """ Returns the first match of the first query that matches anything, or None. """
+    for query in queries:
+        found = xpath(element, query)
+        if found:
+            return found[0]
+    return None
+
+
+def inheritance_chain(shape):
+    """ Yields a placeholder's own element, then the layout's and master's versions of it. """
+    while shape is not None:
+        yield shape.element
+        shape = getattr(shape, "_base_placeholder", None) if shape.is_placeholder else None
+
+
+def inherited(shape, query, default=None):
+    for element in inheritance_chain(shape):
+        found = xpath(element, query)
+        if found:
+            return found[0]
+    return default
+
+
+def shape_box(shape, scale):
+    return (int(shape.left * scale), int(shape.top * scale),
+            int(shape.width * scale), int(shape.height * scale))
+
+
+def draw_background(draw, slide, theme, size):
+    for owner in [slide, slide.slide_layout, slide.slide_layout.slide_master]:
+        fill = find(owner.element, "./p:cSld/p:bg/p:bgPr/a:solidFill", "./p:cSld/p:bg/p:bgRef")
+        if fill is not None:
+            draw.rectangle([(0, 0), size], fill=theme.color(fill) or (255, 255, 255))
+            return
+    draw.rectangle([(0, 0), size], fill=(255, 255, 255))
+
+
+def draw_decoration(draw, shape, theme, scale):
+    """ Draws the plain rectangles and lines that templates use for decoration. """
+    left, top, width, height = shape_box(shape, scale)
+    if shape.shape_type == MSO_SHAPE_TYPE.LINE:
+        line_fill = find(shape.element, "./p:spPr/a:ln/a:solidFill", "./p:style/a:lnRef")
+        line_width = int(find(shape.element, "./p:spPr/a:ln/@w") or Pt(1))
+        draw.line([(left, top), (left + width, top + height)], fill=theme.color(line_fill) or (0, 0, 0),
+                  width=max(1, int(line_width * scale)))
+        return
+    if xpath(shape.element, "./p:spPr/a:noFill"):
+        return
+    fill = find(shape.element, "./p:spPr/a:solidFill", "./p:style/a:fillRef")
+    color = theme.color(fill)
+    if color is not None:
+        draw.rectangle([(left, top), (left + width, top + height)], fill=color)
+
+
+def draw_picture(canvas, shape, scale):
+    left, top, width, height = shape_box(shape, scale)
+    if width <= 0 or height <= 0:
+        return
+    with Image.open(io.BytesIO(shape.image.blob)) as picture:
+        picture = picture.convert("RGBA").resize((width, height), Image.LANCZOS)
+        canvas.paste(picture, (left, top), picture)
+
+
+def text_runs(shape, theme, scale):
+    """
+    Breaks a shape's text into lines of (text, font, color) pieces, before any wrapping.
+    Returns the lines, each with the paragraph's alignment and whether its words may wrap.
+    """
+    style = "./p:txStyles/p:titleStyle" if is_title(shape) else "./p:txStyles/p:bodyStyle"
+    master = shape.part.slide_layout.slide_master
+    default_size = int(inherited(shape, ".//a:lvl1pPr/a:defRPr/@sz")
+                       or find(master.element, style + "/a:lvl1pPr/a:defRPr/@sz") or 1800)
+    default_color = theme.color(inherited(shape, ".//a:lvl1pPr/a:defRPr/a:solidFill")) or theme.colors.get("dk1", (0, 0, 0))
+    alignment = inherited(shape, ".//a:lvl1pPr/@algn", find(master.element, style + "/a:lvl1pPr/@algn") or "l")
+    # Only body text gets bullets, and only where neither the layout nor the paragraph turns them off
+    bulleted = (shape.is_placeholder and not is_title(shape) and inherited(shape, ".//a:lvl1pPr/a:buNone") is None
+                and find(master.element, style + "/a:lvl1pPr/a:buChar") is not None)
+    lines = []
+    for paragraph in shape.text_frame.paragraphs:
+        paragraph_typeface = find(paragraph._p, "./a:pPr/a:defRPr/a:latin/@typeface")
+        paragraph_bullet = bulleted and find(paragraph._p, "./a:pPr/a:buNone") is None
+        line = []
+        for run in paragraph.runs:
+            size = run.font.size or default_size * 127
+            typeface = run.font.name or paragraph_typeface
+            monospace = typeface in MONOSPACE_TYPEFACES
+            font = load_font(max(1, int(size * scale)), monospace, bool(run.font.bold))
+            color = theme.color(find(run._r, "./a:rPr/a:solidFill")) or default_color
+            pieces = re.split(r"[\n\v]", run.text)
+            for index, piece in enumerate(pieces):
+                if index:
+                    lines.append((line, alignment, not monospace))
+                    line = []
+                if piece:
+                    line.append((piece, font, color))
+        if paragraph_bullet and line:
+            line.insert(0, ("• ", line[0][1], default_color))
+        lines.append((line, alignment, True))
+    return lines
+
+
+def is_title(shape):
+    return shape.is_placeholder and "TITLE" in str(shape.placeholder_format.type)
+
+
+def wrap_line(line, width):
+    """ Greedily wraps one line of pieces into as many lines as it takes to fit in the width. """
+    words = [(word, font, color) for text, font, color in line for word in re.split(r"(\s+)", text) if word]
+    wrapped, current, current_width = [], [], 0
+    for word, font, color in words:
+        word_width = font.getlength(word)
+        if current and current_width + word_width > width and not word.isspace():
+            wrapped.append(current)
+            current, current_width = [], 0
+        if not current and word.isspace():
+            continue
+        current.append((word, font, color))
+        current_width += word_width
+    wrapped.append(current)
+    return wrapped
+
+
+def layout_text(shape, theme, scale, width):
+    laid_out = []
+    for line, alignment, wraps in text_runs(shape, theme, scale):
+        for wrapped in (wrap_line(line, width) if wraps else [line]):
+            sizes = [font.size for _, font, _ in wrapped] or [line[0][1].size if line else 12]
+            laid_out.append((wrapped, alignment, int(max(sizes) * LINE_HEIGHT)))
+    return laid_out
+
+
+def draw_text(draw, shape, theme, scale):
+    if not shape.has_text_frame or not shape.text_frame.text.strip():
+        return
+    left, top, width, height = shape_box(shape, scale)
+    inset = int(TEXT_INSET * scale)
+    inner_width, inner_height = width - 2 * inset, height - 2 * inset
+    # Shrink the text until it fits, the way PowerPoint's autofit would
+    shrink = 1.0
+    lines = layout_text(shape, theme, scale, inner_width)
+    while sum(line_height for _, _, line_height in lines) > inner_height and shrink > SMALLEST_SHRINK:
+        shrink -= 0.1
+        lines = layout_text(shape, theme, scale * shrink, inner_width)
+    total_height = sum(line_height for _, _, line_height in lines)
+    anchor = inherited(shape, "./p:txBody/a:bodyPr/@anchor", "t")
+    y = top + inset
+    if anchor == "ctr":
+        y += (inner_height - total_height) // 2
+    elif anchor == "b":
+        y += inner_height - total_height
+    for pieces, alignment, line_height in lines:
+        line_width = sum(font.getlength(text) for text, font, _ in pieces)
+        x = left + inset
+        if alignment == "ctr":
+            x += (inner_width - line_width) / 2
+        elif alignment == "r":
+            x += inner_width - line_width
+        for text, font, color in pieces:
+            draw.text((x, y), text, font=font, fill=color)
+            x += font.getlength(text)
+        y += line_height
+
+
+def decorations(slide):
+    """ Yields the non-placeholder shapes that the master and layout draw behind the slide. """
+    layout = slide.slide_layout
+    if layout.element.get("showMasterSp") != "0" and slide.element.get("showMasterSp") != "0":
+        for shape in layout.slide_master.shapes:
+            if not shape.is_placeholder:
+                yield shape
+    if slide.element.get("showMasterSp") != "0":
+        for shape in layout.shapes:
+            if not shape.is_placeholder:
+                yield shape
+
+
+def rasterize_slide(slide, slide_width, slide_height, resolution=1080):
+    scale = resolution / slide_height
+    size = (int(slide_width * scale) // 2 * 2, resolution)
+    canvas = Image.new("RGB", size, (255, 255, 255))
+    draw = ImageDraw.Draw(canvas)
+    theme = Theme(slide.slide_layout.slide_master)
+    draw_background(draw, slide, theme, size)
+    for shape in decorations(slide):
+        draw_decoration(draw, shape, theme, scale)
+    for shape in slide.shapes:
+        if shape.shape_type == MSO_SHAPE_TYPE.MEDIA:
+            continue
+        if shape.shape_type == MSO_SHAPE_TYPE.PICTURE:
+            draw_picture(canvas, shape, scale)
+        elif shape.has_text_frame:
+            draw_text(draw, shape, theme, scale)
+    return canvas
+
+
+def slide_duration(slide):
+    advance = xpath(slide.element, ".//p:transition/@advTm")
+    return int(advance[0]) / 1000 if advance else DEFAULT_SLIDE_DURATION
+
+
+def transition_duration(slide):
+    """ PowerPoint plays a slide's transition before its own timeline (and advance timer) starts. """
+    transition = find(slide.element, ".//p:transition/@p14:dur")
+    return int(transition) / 1000 if transition else 0
+
+
+def slide_narration(slide):
+    """ Returns the narration clip's bytes and file extension, or (None, None) for a silent slide. """
+    for relationship in slide.part.rels.values():
+        if relationship.reltype == RT.MEDIA and not relationship.is_external:
+            return relationship.target_part.blob, relationship.target_part.partname.ext
+    return None, None
+
+
+def prepare_slides(presentation, workspace, resolution=1080):
+    """ Draws every slide and pulls out its narration, returning each slide's image, audio and duration. """
+    prepared = []
+    for index, slide in enumerate(presentation.slides):
+        # Frames stay in memory, and get piped straight into ffmpeg
+        image = io.BytesIO()
+        rasterize_slide(slide, presentation.slide_width, presentation.slide_height, resolution).save(image, "PNG")
+        audio, extension = slide_narration(slide)
+        audio_path = None
+        if audio is not None:
+            audio_path = os.path.join(workspace, f"slide{index:04}.{extension}")
+            with open(audio_path, "wb") as audio_file:
+                audio_file.write(audio)
+        transition = transition_duration(slide)
+        prepared.append({"image": image.getvalue(), "audio": audio_path,
+                         "duration": transition + slide_duration(slide), "delay": transition + NARRATION_DELAY})
+    return prepared
+
+
+def encoding_options(target, quality=100, preset=DEFAULT_H264_PRESET, crf=None):
+    """
+    Picks codecs from the target's extension, turning the 0-100 quality into each codec's scale.
+    For H.264, an explicit CRF wins over the quality; both are software encoder settings, so the same
+    options give the same video on any machine.
+    """
+    if target.lower().endswith(".wmv"):
+        return {"vcodec": "wmv2", "acodec": "wmav2", "q:v": max(2, round(31 - quality * 0.29)),
+                "pix_fmt": "yuv420p", "audio_bitrate": "128k"}
+    return {"vcodec": "libx264", "acodec": "aac", "preset": preset,
+            "crf": crf if crf is not None else round(51 - quality * 0.33),
+            "pix_fmt": "yuv420p", "audio_bitrate": "128k"}
+
+
+def narration_track(slide):
+    if slide["audio"] is None:
+        return ffmpeg.input(f"anullsrc=r={AUDIO_SAMPLE_RATE}:cl=stereo", f="lavfi", t=slide["duration"]).audio
+    return (ffmpeg.input(slide["audio"]).audio
+            .filter("adelay", delays=round(slide["delay"] * 1000), all=1)
+            .filter("aformat", sample_rates=AUDIO_SAMPLE_RATE, channel_layouts="stereo")
+            .filter("apad", whole_dur=slide["duration"])
+            .filter("atrim", duration=slide["duration"]))
+
+
+def segment_key(slide, extension, fps, options):
+    return content_cache.digest(SEGMENT_VERSION, slide["image"],
+                                content_cache.file_digest(slide["audio"]) if slide["audio"] else "silent",
+                                repr(slide["duration"]), repr(slide["delay"]), extension, str(fps), json.dumps(options, sort_keys=True))
+
+
+def encode_segment(slide, segment_path, fps, options):
+    """ Encodes one slide's still image and narration into a video of exactly that slide's duration. """
+    folder, filename = os.path.split(segment_path)
+    os.makedirs(folder, exist_ok=True)
+    # Keep the real extension last, since ffmpeg picks the container from it
+    temporary_path = os.path.join(folder, f"{os.getpid()}.{threading.get_ident()}.tmp.{filename}")
+    # The frame comes in once through stdin, and is held for the rest of the slide
+    video = ffmpeg.input("pipe:", f="image2pipe", framerate=fps).video.filter("loop", loop=-1, size=1, start=0)
+    (ffmpeg.output(video, narration_track(slide), temporary_path, r=fps, t=slide["duration"], **options)
+     .run(input=slide["image"], overwrite_output=True, quiet=True))
+    os.replace(temporary_path, segment_path)
+    return segment_path
+
+
+def encode_segments(slides, extension, fps, options, max_workers=SEGMENT_WORKERS):
+    """
+    Makes sure every slide has an encoded segment in the cache, encoding the missing ones in parallel.
+    Returns the segment paths in slide order, and how many had to be encoded.
+    """
+    paths, missing = [], []
+    for slide in slides:
+        path = os.path.join(content_cache.entry_path(SEGMENT_NAMESPACE, segment_key(slide, extension, fps, options)),
+                            "segment" + extension)
+        if os.path.exists(path):
+            content_cache.touch(os.path.dirname(path))
+        elif path not in [missing_path for _, missing_path in missing]:
+            missing.append((slide, path))
+        paths.append(path)
+    # ffmpeg does the actual work in its own process, so threads are enough to keep every core busy
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for future in [pool.submit(encode_segment, slide, path, fps, options) for slide, path in missing]:
+            future.result()
+    return paths, len(missing)
+
+
+def concatenate_segments(segment_paths, video_target, workspace):
+    """ Joins the segments with ffmpeg's concat demuxer, copying the streams instead of encoding them again. """
+    listing_path = os.path.join(workspace, "segments.txt")
+    with open(listing_path, "w", encoding="utf-8") as listing:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            listing.write(f"file '{escaped}'\n")
+    # MP4s get their index up front, so they can start playing before they finish downloading
+    container_options = {"movflags": "+faststart"} if video_target.lower().endswith(".mp4") else {}
+    (ffmpeg.input(listing_path, f="concat", safe=0)
+     .output(video_target, c="copy", **container_options)
+     .run(overwrite_output=True, quiet=True))
+
+
+def convert_ppt_to_video(ppt_src, video_target, fps=24, quality=100, resolution=1080, preset=DEFAULT_H264_PRESET, crf=None):
+    """ Returns how many of the deck's slides had to be encoded, rather than coming from the segment cache. """
+    presentation = Presentation(ppt_src)
+    extension = os.path.splitext(video_target)[1].lower()
+    options = encoding_options(extension, quality, preset, crf)
+    with tempfile.TemporaryDirectory() as workspace:
+        slides = prepare_slides(presentation, workspace, resolution)
+        segment_paths, encoded = encode_segments(slides, extension, fps, options)
+        concatenate_segments(segment_paths, os.path.abspath(video_target), workspace)
+    return encoded
@@ -0,0 +1,206 @@
+"""
+Keeps the voice clip store from growing forever. Every edited paragraph leaves its old clip behind, so garbage
+collection looks for clips that no current lesson narrates, and evicts them by a retention policy:
+
+- clips narrated by any lesson under the given course folders (and the chunks they were voiced in) are always
+  kept, in every voice;
+- other clips are evicted once they have not been used (or made) within the age limit;
+- after that, the least recently used of the other clips are evicted until the store fits its size budget.
+
+The dub index is then compacted to match: clips that are gone lose their entries, hashes with no clip left in
+any voice lose their text and usage history, and the usage log is folded into its summary. Run it while
+nothing else is baking, since a bake of a lesson outside the given folders could still want a clip.
+
+    python voices.py stats
+    python voices.py gc COURSE [COURSE ...] [--pattern "*_read.md"] [--max-size 5GB] [--max-age 180] [--dry-run]
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+
+import dub_index
+import usage
+from batch_bake import DEFAULT_PATTERN, find_lessons
+from content_cache import format_size, parse_size
+from locations import VOICES_DIR, VOICES_MAX_BYTES, VOICES_MAX_AGE_DAYS
+
+# A clip's audio and its speech marks are kept or evicted together
+CLIP_SUFFIXES = [".marks.json", ".mp3"]
+PARTIAL_SUFFIX = ".part"
+# Seconds after which a half-written download cannot still be in progress
+PARTIAL_MAX_AGE = 24 * 60 * 60
+
+
+def stored_clips(voices_dir=VOICES_DIR):
+    """
+    Returns every clip in the store, as a dict with its voice, hash name, files, total size and when it was
+    last modified, along with the paths of any half-written downloads.
+    """
+    clips = {}
+    partials = []
+    voices = sorted(os.listdir(voices_dir)) if os.path.isdir(voices_dir) else []
+    for voice in voices:
+        folder = os.path.join(voices_dir, voice)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if name.endswith(PARTIAL_SUFFIX):
+                partials.append(path)
+                continue
+            suffix = next((suffix for suffix in CLIP_SUFFIXES if name.endswith(suffix)), None)
+            if suffix is None or not name.startswith("speech"):
+                continue
+            stats = os.stat(path)
+            hash_name = name[:-len(suffix)]
+            clip = clips.setdefault((voice, hash_name), {"voice": voice, "hash": hash_name, "paths": [],
+                                                         "size": 0, "modified": 0})
+            clip["paths"].append(path)
+            clip["size"] += stats.st_size
+            clip["modified"] = max(clip["modified"], stats.st_mtime)
+    return list(clips.values()), partials
+
+
+def referenced_hashes(sources, pattern=DEFAULT_PATTERN):
+    """ Returns the hash names of every clip that the lessons under the sources narrate. """
+    from bake_mark import lesson_narration
+    from polly import chunk_spans, speech_name
+    referenced = set()
+    for source in sources:
+        lessons = [source] if os.path.isfile(source) else find_lessons(source, pattern)
+        for lesson in lessons:
+            for text in lesson_narration(lesson):
+                referenced.add(speech_name(text))
+                # Keep the chunks of long narration too, so that editing it later only voices what changed
+                spans = chunk_spans(text)
+                if len(spans) > 1:
+                    referenced.update(speech_name(text[start:end]) for start, end in spans)
+    return referenced
+
+
+def add_last_used(clips):
+    """ Notes when each clip was last used by a deck, or made, whichever was later. """
+    uses = usage.last_uses()
+    for clip in clips:
+        used = uses.get(clip["hash"])
+        used = datetime.strptime(used, "%Y-%m-%d %H:%M:%S").timestamp() if used else 0
+        clip["last_used"] = max(used, clip["modified"])
+
+
+def plan(clips, referenced, max_bytes=VOICES_MAX_BYTES, max_age_days=VOICES_MAX_AGE_DAYS, now=None):
+    """
+    Picks the clips to evict, least recently used first, giving each one the reason ("age" or "size").
+    Returns the evicted and the kept clips.
+    """
+    oldest_allowed = (now or time.time()) - max_age_days * 24 * 60 * 60
+    total = sum(clip["size"] for clip in clips)
+    evicted, kept = [], []
+    for clip in sorted(clips, key=lambda clip: clip["last_used"]):
+        if clip["hash"] in referenced:
+            kept.append(clip)
+        elif clip["last_used"] < oldest_allowed:
+            evicted.append(dict(clip, reason="age"))
+            total -= clip["size"]
+        elif total > max_bytes:
+            evicted.append(dict(clip, reason="size"))
+            total -= clip["size"]
+        else:
+            kept.append(clip)
+    return evicted, kept
+
+
+def remove(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def collect_garbage(sources, pattern=DEFAULT_PATTERN, max_bytes=VOICES_MAX_BYTES,
+                    max_age_days=VOICES_MAX_AGE_DAYS, dry_run=False):
+    """ Evicts clips by the retention policy and compacts the index to match, returning a report of it all. """
+    clips, partials = stored_clips()
+    referenced = referenced_hashes(sources, pattern)
+    add_last_used(clips)
+    evicted, kept = plan(clips, referenced, max_bytes, max_age_days)
+    stale_partials = [path for path in partials if os.path.getmtime(path) < time.time() - PARTIAL_MAX_AGE]
+    remaining = {(clip["voice"], clip["hash"]) for clip in kept}
+    remaining_hashes = {clip["hash"] for clip in kept}
+    # Index entries for clips that are being evicted, or whose files were already gone
+    stale_clips = [pair for pair in dub_index.indexed_clips() if pair not in remaining]
+    stale_dubs = dub_index.dub_hashes() - remaining_hashes - referenced
+    report = {
+        "clips": len(clips),
+        "bytes": sum(clip["size"] for clip in clips),
+        "protected": sum(clip["hash"] in referenced for clip in kept),
+        "evicted": {reason: [clip for clip in evicted if clip["reason"] == reason] for reason in ["age", "size"]},
+        "partials": len(stale_partials),
+        "freed": sum(clip["size"] for clip in evicted) + sum(os.path.getsize(path) for path in stale_partials),
+        "index_clips": len(stale_clips),
+        "index_dubs": len(stale_dubs),
+        "usage_folded": 0,
+    }
+    if not dry_run:
+        for clip in evicted:
+            remove(clip["paths"])
+        remove(stale_partials)
+        dub_index.forget_clips(stale_clips)
+        dub_index.forget_dubs(stale_dubs)
+        usage.forget(stale_dubs)
+        report["usage_folded"] = usage.compact()
+        dub_index.vacuum()
+    return report
+
+
+def print_report(report, dry_run):
+    verb = "Would free" if dry_run else "Freed"
+    evicted = [clip for clips in report["evicted"].values() for clip in clips]
+    print(f"{report['clips']} clips in the store, {format_size(report['bytes'])}; "
+          f"{report['protected']} are narrated by current lessons")
+    for reason, description in [("age", "unused for too long"), ("size", "least recently used, over the size budget")]:
+        clips = report["evicted"][reason]
+        print(f"  {len(clips):>6} clips {description}: {format_size(sum(clip['size'] for clip in clips))}")
+    print(f"  {report['partials']:>6} leftover partial downloads")
+    voices = sorted({clip["voice"] for clip in evicted})
+    for voice in voices:
+        clips = [clip for clip in evicted if clip["voice"] == voice]
+        print(f"    {voice}: {len(clips)} clips, {format_size(sum(clip['size'] for clip in clips))}")
+    print(f"{verb} {format_size(report['freed'])} in {len(evicted)} clips")
+    print(f"Index: {report['index_clips']} clip entries and {report['index_dubs']} texts "
+          f"{'would be' if dry_run else 'were'} dropped" +
+          ("" if dry_run else f", and {report['usage_folded']} usage records compacted"))
+
+
+def store_stats():
+    clips, _ = stored_clips()
+    add_last_used(clips)
+    summary = {}
+    for clip in clips:
+        numbers = summary.setdefault(clip["voice"], {"clips": 0, "bytes": 0, "oldest": clip["last_used"]})
+        numbers["clips"] += 1
+        numbers["bytes"] += clip["size"]
+        numbers["oldest"] = min(numbers["oldest"], clip["last_used"])
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect and trim the voice clip store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="Show how many clips each voice has.")
+    gc_parser = commands.add_parser("gc", help="Evict clips that no current lesson narrates.")
+    gc_parser.add_argument("courses", nargs="+", help="The course folders (or lessons) whose narration must be kept.")
+    gc_parser.add_argument("--pattern", default=DEFAULT_PATTERN, help="Which files in the course folders are lessons.")
+    gc_parser.add_argument("--max-size", type=parse_size, default=VOICES_MAX_BYTES, help="The size budget, like 5GB.")
+    gc_parser.add_argument("--max-age", type=float, default=VOICES_MAX_AGE_DAYS,
+                           help="Evict unreferenced clips unused for this many days.")
+    gc_parser.add_argument("--dry-run", action="store_true", help="Only report what would be evicted.")
+    args = parser.parse_args()
+    if args.command == "stats":
+        for voice, numbers in store_stats().items():
+            print(f"{voice:<10} {numbers['clips']:>7} clips {format_size(numbers['bytes']):>10}, "
+                  f"least recently used {time.strftime('%Y-%m-%d', time.localtime(numbers['oldest']))}")
+    else:
+        report = collect_garbage(args.courses, args.pattern, args.max_size, args.max_age, args.dry_run)
+        print_report(report, args.dry_run)
@@ -0,0 +1,91 @@
+"""
+Keeps baking a lesson again whenever it (or anything in its graphics folder) changes, for a quick
+edit-save-preview loop:
+
+    python bake_mark.py lesson_read.md --watch
+
+Everything stays loaded between bakes: the imports, the lexers and sentence splitter, and the in-memory parts
+of the caches. Unchanged slides come from the slide cache, and outputs whose contents did not change are left
+alone (videos included), so that a preview only has to reload what actually changed.
+"""
+import os
+import time
+import traceback
+
+import timings
+from locations import POWERPOINT_TEMPLATE
+
+# Seconds between checks for changes
+POLL_INTERVAL = 0.5
+
+
+def snapshot(paths, folders):
+    """ Returns the size and mtime of each path, and of every file under each folder. """
+    found = {}
+    for path in paths:
+        try:
+            stats = os.stat(path)
+            found[path] = (stats.st_mtime_ns, stats.st_size)
+        except FileNotFoundError:
+            found[path] = None
+    for folder in folders:
+        for root, _, files in os.walk(folder):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    stats = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found[path] = (stats.st_mtime_ns, stats.st_size)
+    return found
+
+
+def wait_for_change(previous, paths, folders, interval=POLL_INTERVAL):
+    """ Blocks until something changes, and then until it stops changing, since editors often save in steps. """
+    current = snapshot(paths, folders)
+    while current == previous:
+        time.sleep(interval)
+        current = snapshot(paths, folders)
+    settled = None
+    while settled != current:
+        settled = current
+        time.sleep(interval)
+        current = snapshot(paths, folders)
+    return current
+
+
+def warm_up(transcript=False):
+    """ Pays for the slow imports now, so that the first edit is as quick as the rest. """
+    import code_cache
+    import code_formatting
+    import code_lexers
+    if transcript:
+        from make_subtitles import get_sentencizer
+        get_sentencizer()
+
+
+def watch_lesson(input_path, output_path, graphics_path, options, interval=POLL_INTERVAL):
+    from bake_mark import bake_markdown
+    paths, folders = [input_path, POWERPOINT_TEMPLATE], [graphics_path]
+    warm_up(options.get("transcript"))
+    # Only the first bake does exactly what the options say; after that, the build is already up to date
+    only_changed = False
+    try:
+        while True:
+            watched = snapshot(paths, folders)
+            start_time_stamp = time.time()
+            try:
+                for progress in bake_markdown(input_path, output_path, graphics_path, only_changed=only_changed,
+                                              **options):
+                    print(progress)
+                print(timings.summary_table())
+            except Exception:
+                # Keep watching, so that the author can fix the lesson and save again
+                traceback.print_exc()
+            else:
+                only_changed = True
+                options = dict(options, force_rebuild=False)
+            print(f"Baked in {time.time() - start_time_stamp:.2f}s; watching {input_path} for changes (Ctrl+C to stop)")
+            wait_for_change(watched, paths, folders, interval)
+    except KeyboardInterrupt:
+        print("Stopped watching")